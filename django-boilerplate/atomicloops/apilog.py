@@ -0,0 +1,439 @@
+import atexit
+import csv
+import io
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from urllib.parse import parse_qsl, urlencode
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+MASK = '***FILTERED***'
+
+# Response bodies are only kept for these, everything else is logged without one
+TEXT_CONTENT_TYPES = ('application/json', 'text/')
+
+
+def day_start(moment):
+    """UTC midnight of the day `moment` falls in, log storage is partitioned on UTC days."""
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, moment.day, tzinfo=dt_timezone.utc)
+
+
+def mask(value, keys):
+    if isinstance(value, dict):
+        return {key: MASK if key.lower() in keys else mask(item, keys) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mask(item, keys) for item in value]
+    return value
+
+
+def mask_path(path, keys):
+    """`path` with the values of its query parameters named in `keys` masked."""
+    base, _, query = path.partition('?')
+    params = parse_qsl(query, keep_blank_values=True)
+    if not any(name.lower() in keys for name, _ in params):
+        return path
+    return f"{base}?{urlencode([(name, MASK if name.lower() in keys else value) for name, value in params])}"
+
+
+def decode_body(raw, content_type, keys, limit):
+    """Masked JSON text of a request/response body, the raw text when it isn't JSON."""
+    if not raw:
+        return ''
+    if len(raw) > limit:
+        return f'** {len(raw)} bytes, over the {limit} bytes limit **'
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return '** binary **'
+    if 'json' not in content_type:
+        return text if content_type.startswith('text/') else ''
+    lowered = text.lower()
+    # most bodies contain none of the keys, only those are parsed and masked
+    if not any(f'"{key}"' in lowered for key in keys):
+        return text
+    try:
+        return json.dumps(mask(json.loads(text), keys), ensure_ascii=False)
+    except ValueError:
+        return text
+
+
+def build_entry(record):
+    """Turn what the middleware captured into the stored entry, off the request thread."""
+    keys = {key.lower() for key in getattr(settings, 'API_LOG_EXCLUDE_KEYS', ())}
+    limit = getattr(settings, 'API_LOG_MAX_BODY_SIZE', 32768)
+    meta = record['meta']
+    headers = {
+        name[5:].replace('_', '-').title(): value
+        for name, value in meta.items() if name.startswith('HTTP_')
+    }
+    headers = {name: MASK if name.lower() in keys else value for name, value in headers.items()}
+    forwarded = meta.get('HTTP_X_FORWARDED_FOR')
+    return {
+        'id': uuid.uuid4(),
+        'createdAt': record['time'],
+        'method': record['method'],
+        'path': mask_path(record['path'], keys)[:1024],
+        'urlName': record['urlName'],
+        'statusCode': record['status'],
+        'durationMs': round(record['duration'] * 1000, 3),
+        'userId': record['userId'],
+        'clientIp': (forwarded.split(',')[0].strip() if forwarded else meta.get('REMOTE_ADDR', ''))[:50],
+        'headers': json.dumps(headers, ensure_ascii=False),
+        'body': decode_body(record['body'], meta.get('CONTENT_TYPE', ''), keys, limit),
+        'response': decode_body(record['response'], record['responseType'], keys, limit),
+    }
+
+
+class BaseApiLogBackend:
+    """
+    Storage of API logs. write() receives batches of entries from the flush thread,
+    prune() drops everything logged before `before` (an aware datetime).
+    """
+
+    def write(self, entries):
+        raise NotImplementedError
+
+    def prune(self, before):
+        raise NotImplementedError
+
+
+class DatabaseApiLogBackend(BaseApiLogBackend):
+    """
+    ApiLog rows in API_LOG_DATABASE, point it at its own database to keep the logs off the
+    task workload. On PostgreSQL the table is partitioned by UTC day, partitions are created
+    on demand and retention drops whole partitions instead of deleting rows.
+    """
+
+    def __init__(self):
+        self.using = getattr(settings, 'API_LOG_DATABASE', 'default')
+        self._days = set()
+        self._table = False
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    @property
+    def partitioned(self):
+        return self.connection.vendor == 'postgresql'
+
+    def partition_name(self, day):
+        from atomicloops.models import ApiLog
+        return f'{ApiLog._meta.db_table}_p{day:%Y%m%d}'
+
+    def ensure_table(self):
+        from atomicloops.models import ApiLog
+        if self._table:
+            return
+        with self._lock:
+            if self._table:
+                return
+            connection = self.connection
+            if self.partitioned:
+                table = connection.ops.quote_name(ApiLog._meta.db_table)
+                with connection.cursor() as cursor:
+                    # the primary key of a partitioned table has to contain the partition key
+                    cursor.execute(
+                        f'CREATE TABLE IF NOT EXISTS {table} ('
+                        'id uuid NOT NULL, created_at timestamp with time zone NOT NULL, '
+                        'method varchar(10) NOT NULL, path varchar(1024) NOT NULL, url_name varchar(255) NULL, '
+                        'status_code smallint NOT NULL, duration_ms double precision NOT NULL, user_id uuid NULL, '
+                        'client_ip varchar(50) NOT NULL, headers text NOT NULL, body text NOT NULL, '
+                        'response text NOT NULL, PRIMARY KEY (id, created_at)'
+                        ') PARTITION BY RANGE (created_at)'
+                    )
+                    cursor.execute(f'CREATE INDEX IF NOT EXISTS api_log_created_at ON {table} (created_at)')
+            elif ApiLog._meta.db_table not in connection.introspection.table_names():
+                with connection.schema_editor() as editor:
+                    editor.create_model(ApiLog)
+            self._table = True
+
+    def ensure_partitions(self, days):
+        from atomicloops.models import ApiLog
+        self.ensure_table()
+        missing = set(days) - self._days
+        if not self.partitioned or not missing:
+            self._days |= missing
+            return
+        quote = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            for day in sorted(missing):
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {quote(self.partition_name(day))} '
+                    f'PARTITION OF {quote(ApiLog._meta.db_table)} FOR VALUES FROM (%s) TO (%s)',
+                    [day, day + timedelta(days=1)],
+                )
+        self._days |= missing
+
+    def write(self, entries):
+        from atomicloops.models import ApiLog
+        self.ensure_partitions({day_start(entry['createdAt']) for entry in entries})
+        if not self.partitioned:
+            ApiLog.objects.using(self.using).bulk_create([ApiLog(**entry) for entry in entries], batch_size=1000)
+            return
+        # COPY costs a quarter of bulk_create per row, which matters on the flush thread sharing the GIL
+        connection = self.connection
+        fields = ApiLog._meta.concrete_fields
+        buffer = io.StringIO()
+        # quoted, so empty strings stay empty strings, only None is read as NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NOTNULL).writerows(
+            [field.get_db_prep_save(entry[field.attname], connection) for field in fields] for entry in entries
+        )
+        buffer.seek(0)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        with transaction.atomic(using=self.using), connection.cursor() as cursor:
+            # losing the last logs on a crash is fine, waiting for the WAL flush isn't
+            cursor.execute('SET LOCAL synchronous_commit TO OFF')
+            cursor.copy_expert(
+                f'COPY {connection.ops.quote_name(ApiLog._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+
+    def partitions(self):
+        """{UTC day: partition table} of the existing partitions."""
+        from atomicloops.models import ApiLog
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE parent.relname = %s',
+                [ApiLog._meta.db_table],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        prefix = f'{ApiLog._meta.db_table}_p'
+        return {
+            datetime.strptime(name[len(prefix):], '%Y%m%d').replace(tzinfo=dt_timezone.utc): name
+            for name in names if name.startswith(prefix)
+        }
+
+    def prune(self, before):
+        from atomicloops.models import ApiLog
+        self.ensure_table()
+        if not self.partitioned:
+            return ApiLog.objects.using(self.using).filter(createdAt__lt=before).delete()[0]
+        # a partition goes once its whole day is past the cutoff, DROP TABLE is instant and leaves no bloat
+        dropped = 0
+        with self.connection.cursor() as cursor:
+            for day, name in sorted(self.partitions().items()):
+                if day + timedelta(days=1) <= before:
+                    cursor.execute(f'DROP TABLE IF EXISTS {self.connection.ops.quote_name(name)}')
+                    self._days.discard(day)
+                    dropped += 1
+        return dropped
+
+
+class MongoApiLogBackend(BaseApiLogBackend):
+    """
+    insert_many into one collection per UTC day (api_log_YYYYMMDD) of API_LOG_MONGO_DATABASE,
+    retention drops whole collections.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def database(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import pymongo
+                    self._client = pymongo.MongoClient(settings.API_LOG_MONGO_URL)
+        return self._client[getattr(settings, 'API_LOG_MONGO_DATABASE', 'api_logs')]
+
+    def write(self, entries):
+        days = {}
+        for entry in entries:
+            document = dict(entry)
+            document['_id'] = str(document.pop('id'))
+            if document['userId'] is not None:
+                document['userId'] = str(document['userId'])
+            days.setdefault(day_start(entry['createdAt']), []).append(document)
+        for day, documents in days.items():
+            self.database[f'api_log_{day:%Y%m%d}'].insert_many(documents, ordered=False)
+
+    def prune(self, before):
+        dropped = 0
+        for name in self.database.list_collection_names(filter={'name': {'$regex': r'^api_log_\d{8}$'}}):
+            day = datetime.strptime(name[len('api_log_'):], '%Y%m%d').replace(tzinfo=dt_timezone.utc)
+            if day + timedelta(days=1) <= before:
+                self.database.drop_collection(name)
+                dropped += 1
+        return dropped
+
+
+class MemoryApiLogBackend(BaseApiLogBackend):
+    """Keeps entries in a list, for tests and benchmarks."""
+
+    def __init__(self):
+        self.entries = []
+
+    def write(self, entries):
+        self.entries.extend(entries)
+
+    def prune(self, before):
+        kept = [entry for entry in self.entries if entry['createdAt'] >= before]
+        dropped, self.entries = len(self.entries) - len(kept), kept
+        return dropped
+
+
+class ApiLogBuffer:
+    """
+    In-process queue between the middleware and the backend. put() only enqueues what the
+    request already has in memory; a daemon thread builds the entries and writes them in
+    batches of API_LOG_BATCH_SIZE, woken by a full batch or every API_LOG_FLUSH_INTERVAL
+    seconds. When the backend falls behind and the queue is full new records are dropped
+    and counted.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.batch_size = getattr(settings, 'API_LOG_BATCH_SIZE', 500)
+        self.interval = getattr(settings, 'API_LOG_FLUSH_INTERVAL', 2)
+        self.queue = queue.Queue(maxsize=getattr(settings, 'API_LOG_QUEUE_SIZE', 10000))
+        self.sample_rate = getattr(settings, 'API_LOG_SAMPLE_RATE', 1.0)
+        self.sample_rates = getattr(settings, 'API_LOG_SAMPLE_RATES', {})
+        self.dropped = 0
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        # serializes the flush thread with flush() calls from other threads
+        self._flush_lock = threading.Lock()
+
+    def sampled(self, url_name):
+        rate = self.sample_rates.get(url_name, self.sample_rate)
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def put(self, record):
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='api-log-flush', daemon=True)
+                self._thread.start()
+
+    def take(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self.flush():
+                # don't hold a connection between flushes, it would count against the pool
+                # and keep test databases from being dropped
+                connections.close_all()
+
+    def write(self, batch):
+        try:
+            self.backend.write([build_entry(record) for record in batch])
+        except Exception:
+            logger.exception('Could not write %s API log entries', len(batch))
+
+    def flush(self):
+        """Write everything queued so far, from the calling thread. Returns the number of records."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self.take()
+                if not batch:
+                    return written
+                self.write(batch)
+                written += len(batch)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_api_log_buffer():
+    """Return the process wide buffer writing to API_LOG_BACKEND, None when logging is off."""
+    global _buffer
+    backend = getattr(settings, 'API_LOG_BACKEND', None)
+    if backend is None:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ApiLogBuffer(import_string(backend)())
+    return _buffer
+
+
+def reset_api_log_buffer():
+    global _buffer, _buffer_lock
+    _buffer = None
+    _buffer_lock = threading.Lock()
+
+
+def flush_api_logs():
+    if _buffer is not None:
+        _buffer.flush()
+
+
+# the flush thread doesn't survive a fork, children start their own buffer
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_api_log_buffer)
+# a worker shutting down writes what it still holds
+atexit.register(flush_api_logs)
+
+
+def log_request(request, response, duration):
+    """Queue one request for logging, sampled per url name, errors are always kept."""
+    buffer = get_api_log_buffer()
+    if buffer is None:
+        return
+    match = request.resolver_match
+    url_name = match.url_name if match else None
+    if response.status_code < 400 and not buffer.sampled(url_name):
+        return
+    try:
+        body = request.body
+    except Exception:
+        # the view read the stream itself, e.g. a multipart upload
+        body = b''
+    response_type = response.get('Content-Type', '')
+    content = b''
+    if not getattr(response, 'streaming', False) and response_type.startswith(TEXT_CONTENT_TYPES):
+        content = response.content
+    # a lazy user nobody looked at stays unevaluated, DRF replaces it once it authenticates
+    user = getattr(request, 'user', None)
+    user = getattr(user, '_wrapped', user)
+    buffer.put({
+        'time': timezone.now(),
+        'duration': duration,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'urlName': url_name,
+        'status': response.status_code,
+        'userId': getattr(user, 'pk', None) if getattr(user, 'is_authenticated', False) else None,
+        'meta': request.META,
+        'body': body,
+        'response': content,
+        'responseType': response_type,
+    })
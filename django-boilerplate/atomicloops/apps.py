@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AtomicloopsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'atomicloops'
+
+    def ready(self):
+        from django.core.signals import request_finished
+        from .connections import record_served
+        # the Celery side is connected in atomicloops.tasks
+        request_finished.connect(record_served, dispatch_uid='atomicloops.connections.record_served')
@@ -0,0 +1,92 @@
+import time
+from functools import partial
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from atomicloops.connections import get_metrics, get_pool
+
+Database = base.Database
+
+# libpq PQtransactionStatus, the same for psycopg2 and psycopg
+TRANSACTION_IDLE = 0
+TRANSACTION_UNKNOWN = 4
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Django's PostgreSQL backend counting the connections it opens (atomicloops.connections).
+    With OPTIONS['atomic_pool'] ({'max_size': ...}, True for the defaults) connect() takes a
+    connection from the in-process pool and close() gives it back, rolled back; with CONN_MAX_AGE = 0
+    that happens at the end of every request and Celery task. CONN_HEALTH_CHECKS pings a pooled
+    connection before it is handed out again. The key isn't OPTIONS['pool'], which Django 5.1's
+    own psycopg 3 pool reads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the pool self.connection came from
+        self.connection_pool = None
+
+    @property
+    def pool_options(self):
+        options = self.settings_dict['OPTIONS'].get('atomic_pool')
+        if not options:
+            return None
+        return {} if options is True else options
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('atomic_pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        options = self.pool_options
+        if options is None:
+            begin = time.monotonic()
+            connection = super().get_new_connection(conn_params)
+            get_metrics(self.alias).record_open(time.monotonic() - begin)
+            return connection
+        pool = get_pool(self.alias, repr(sorted(conn_params.items())), options)
+        check = self.ping if self.settings_dict['CONN_HEALTH_CHECKS'] else None
+        connection = pool.get(partial(super().get_new_connection, conn_params), check)
+        self.connection_pool = pool
+        # set by super() on the connections it opens
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool, self.connection_pool = self.connection_pool, None
+        if pool is None:
+            try:
+                return super()._close()
+            finally:
+                get_metrics(self.alias).record_close()
+        # closed inside an atomic block the wrapper keeps the connection, nobody else may get it
+        pool.put(self.connection, usable=not self.in_atomic_block and self.reset())
+
+    def reset(self):
+        """Roll back what the connection was left in, False when it can't be reused."""
+        if self.errors_occurred and not self.is_usable():
+            return False
+        try:
+            status = self.connection.info.transaction_status
+            if status == TRANSACTION_UNKNOWN:
+                return False
+            if status != TRANSACTION_IDLE:
+                self.connection.rollback()
+        except Database.Error:
+            return False
+        return not self.connection.closed
+
+    def ping(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.info.transaction_status != TRANSACTION_IDLE:
+                connection.rollback()
+        except Database.Error:
+            return False
+        return True
@@ -0,0 +1,172 @@
+# Shared helpers for the db-backup and db-restore commands
+import csv
+import gzip
+import hashlib
+import json
+import os
+import re
+from django.apps import apps
+from django.utils.dateparse import parse_datetime
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+COMPRESSION_EXTENSIONS = {
+    'zstd': '.csv.zst',
+    'gzip': '.csv.gz',
+    'none': '.csv',
+}
+
+# Dumps are CSV with a header row, every non NULL value quoted and NULL written
+# as an unquoted empty field. That is what COPY ... (FORMAT csv, FORCE_QUOTE *)
+# produces and what COPY FROM reads back, so both code paths share one format.
+CSV_OPTIONS = {'quoting': csv.QUOTE_NOTNULL, 'lineterminator': '\n'}
+
+
+# a quoted value, "" standing for one quote, or the unquoted text up to the next comma
+CSV_FIELD = re.compile(r'"((?:[^"]|"")*)"|([^,]*)')
+
+
+def parse_record(record):
+    values, position = [], 0
+    while True:
+        match = CSV_FIELD.match(record, position)
+        quoted, plain = match.groups()
+        values.append(quoted.replace('""', '"') if quoted is not None else plain or None)
+        position = match.end()
+        if position >= len(record):
+            return values
+        # the comma
+        position += 1
+
+
+def read_rows(f):
+    """
+    Records of a dump read from the text stream `f`, header included, with None for NULL.
+    csv.reader returns '' for both an unquoted empty field and "" before Python 3.13.
+    """
+    record, quotes = '', 0
+    for line in f:
+        record += line
+        quotes += line.count('"')
+        # an odd count means a quoted value goes on over the next line
+        if quotes % 2 == 0:
+            yield parse_record(record[:-1] if record.endswith('\n') else record)
+            record, quotes = '', 0
+
+
+def default_compression():
+    try:
+        import zstandard  # noqa: F401
+        return 'zstd'
+    except ImportError:
+        return 'gzip'
+
+
+def open_writer(path, compression):
+    if compression == 'zstd':
+        import zstandard
+        fh = open(path, 'wb')
+        return zstandard.ZstdCompressor(level=3).stream_writer(fh, closefd=True)
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    return open(path, 'wb')
+
+
+def open_reader(path, compression):
+    if compression == 'zstd':
+        import zstandard
+        fh = open(path, 'rb')
+        return zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+class HashingWriter:
+    """
+    Binary file wrapper that keeps a sha256 and byte count of the
+    uncompressed stream written through it.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def file_checksum(path, compression, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open_reader(path, compression) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_backup_models(labels=None):
+    """
+    Concrete, managed models that own a table, including auto created m2m
+    tables. `labels` optionally restricts to "app_label" or "app_label.Model".
+    """
+    models = []
+    for model in apps.get_models(include_auto_created=True):
+        opts = model._meta
+        if opts.proxy or not opts.managed:
+            continue
+        if labels and opts.app_label not in labels and opts.label not in labels:
+            continue
+        models.append(model)
+    return models
+
+
+def table_dependencies(model):
+    """Tables this model's table references through foreign keys."""
+    dependencies = set()
+    for field in model._meta.local_concrete_fields:
+        if field.is_relation and field.related_model is not None:
+            related_table = field.related_model._meta.db_table
+            if related_table != model._meta.db_table:
+                dependencies.add(related_table)
+    return sorted(dependencies)
+
+
+def read_manifest(backup_path):
+    with open(os.path.join(backup_path, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def write_manifest(backup_path, manifest):
+    with open(os.path.join(backup_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def snapshot_time(manifest):
+    """When the backup's snapshot was taken, startedAt for manifests from before snapshotAt."""
+    return parse_datetime(manifest.get('snapshotAt') or manifest['startedAt'])
+
+
+def latest_manifest(backup_dir):
+    """
+    Return (path, manifest) of the backup in backup_dir with the most recent snapshot, or
+    (None, None). Directory names can't be trusted for this, --output names them freely.
+    """
+    if not os.path.isdir(backup_dir):
+        return None, None
+    backups = [
+        (os.path.join(backup_dir, name), read_manifest(os.path.join(backup_dir, name)))
+        for name in os.listdir(backup_dir)
+        if os.path.isfile(os.path.join(backup_dir, name, MANIFEST_NAME))
+    ]
+    if not backups:
+        return None, None
+    return max(backups, key=lambda backup: (snapshot_time(backup[1]), parse_datetime(backup[1]['finishedAt'])))
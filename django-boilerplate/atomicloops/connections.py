@@ -0,0 +1,281 @@
+# Database connection lifecycle: the in-process pool of atomicloops.backends.postgresql and per
+# worker metrics on connections opened and time spent waiting for one, see `connection-stats`
+import logging
+import os
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError
+
+logger = logging.getLogger(__name__)
+
+WORKERS_KEY = 'db-connections:workers'
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionMetrics:
+    """Counters of one database in this process, updated from any thread."""
+
+    FIELDS = ('opened', 'closed', 'open_seconds', 'checkouts', 'reused', 'waits', 'wait_seconds', 'wait_max', 'timeouts')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+
+    def record_open(self, seconds):
+        with self.lock:
+            self.opened += 1
+            self.open_seconds += seconds
+
+    def record_close(self):
+        with self.lock:
+            self.closed += 1
+
+    def record_checkout(self, waited, reused):
+        with self.lock:
+            self.checkouts += 1
+            self.reused += reused
+            if waited:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def record_timeout(self, waited):
+        with self.lock:
+            self.timeouts += 1
+            self.wait_seconds += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self):
+        with self.lock:
+            values = {name: getattr(self, name) for name in self.FIELDS}
+        values['open'] = values['opened'] - values['closed']
+        return values
+
+
+class ConnectionPool:
+    """
+    Open connections to one database shared by the threads of a process. get() hands out the
+    most recently returned idle connection, opens a new one while fewer than `max_size` are
+    open, and otherwise waits up to `timeout` seconds for one to be returned with put().
+    Connections are closed after `max_lifetime` seconds, or `max_idle` seconds unused.
+    """
+
+    def __init__(self, max_size, timeout, max_lifetime, max_idle, metrics):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.metrics = metrics
+        self.condition = threading.Condition()
+        # [(connection, returned at)], the most recently returned last
+        self.idle = []
+        # connections open, idle or handed out
+        self.size = 0
+        self.opened_at = {}
+        self.closed = False
+
+    def get(self, connect, check=None):
+        """A connection, opened with connect() if need be. check(connection) is False for a dead one."""
+        begin = time.monotonic()
+        waited = 0
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                waited = time.monotonic() - begin
+                if waited >= self.timeout:
+                    self.metrics.record_timeout(waited)
+                    raise PoolTimeout(f'no database connection free after {self.timeout}s, {self.size} open')
+                self.condition.wait(self.timeout - waited)
+                waited = time.monotonic() - begin
+            stale = self.expired(time.monotonic())
+            connection = self.idle.pop()[0] if self.idle else None
+            if connection is None:
+                self.size += 1
+        self.discard(stale)
+
+        if connection is not None and (self.too_old(connection) or (check is not None and not check(connection))):
+            # the slot is kept for its replacement
+            self.close(connection)
+            connection = None
+        self.metrics.record_checkout(waited, connection is not None)
+        if connection is not None:
+            return connection
+        try:
+            begin = time.monotonic()
+            connection = connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        self.metrics.record_open(time.monotonic() - begin)
+        self.opened_at[id(connection)] = time.monotonic()
+        return connection
+
+    def put(self, connection, usable=True):
+        """Give back a connection from get(), an unusable one is closed and frees its slot."""
+        keep = usable and not self.closed and not self.too_old(connection)
+        with self.condition:
+            if keep:
+                self.idle.append((connection, time.monotonic()))
+            else:
+                self.size -= 1
+            stale = self.expired(time.monotonic())
+            self.condition.notify()
+        if not keep:
+            self.close(connection)
+        self.discard(stale)
+
+    def too_old(self, connection):
+        return time.monotonic() - self.opened_at.get(id(connection), 0) > self.max_lifetime
+
+    def expired(self, now):
+        """Take the connections idle for over max_idle out of the pool, the caller closes them."""
+        count = 0
+        while count < len(self.idle) and now - self.idle[count][1] > self.max_idle:
+            count += 1
+        stale = [connection for connection, _ in self.idle[:count]]
+        del self.idle[:count]
+        self.size -= count
+        return stale
+
+    def discard(self, connections):
+        for connection in connections:
+            self.close(connection)
+
+    def close(self, connection):
+        self.opened_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self.metrics.record_close()
+
+    def close_idle(self):
+        with self.condition:
+            self.closed = True
+            idle = [connection for connection, _ in self.idle]
+            self.size -= len(idle)
+            self.idle = []
+            self.condition.notify_all()
+        self.discard(idle)
+
+
+_lock = threading.Lock()
+_pools = {}
+_metrics = {}
+# pools inherited over a fork: the connections are the parent's, closing or even garbage
+# collecting them would end the parent's sessions, so they are kept and never used
+_inherited = []
+_served = 0
+_published_at = 0
+
+
+def get_metrics(alias):
+    metrics = _metrics.get(alias)
+    if metrics is None:
+        with _lock:
+            metrics = _metrics.setdefault(alias, ConnectionMetrics())
+    return metrics
+
+
+def get_pool(alias, key, options):
+    """
+    The pool of database `alias` in this process. `key` identifies the connection parameters,
+    the test runner renames the database in place and must not get connections to the old one.
+    """
+    pool = _pools.get((alias, key))
+    if pool is None:
+        metrics = get_metrics(alias)
+        with _lock:
+            pool = _pools.get((alias, key))
+            if pool is None:
+                pool = _pools[(alias, key)] = ConnectionPool(
+                    max_size=options.get('max_size', 10),
+                    timeout=options.get('timeout', settings.DATABASE_POOL_TIMEOUT),
+                    max_lifetime=options.get('max_lifetime', settings.DATABASE_POOL_MAX_LIFETIME),
+                    max_idle=options.get('max_idle', settings.DATABASE_POOL_MAX_IDLE),
+                    metrics=metrics,
+                )
+    return pool
+
+
+def reset_pools():
+    """Close the idle connections of every pool and start over, connections handed out are closed on return."""
+    global _pools
+    with _lock:
+        pools, _pools = _pools, {}
+    for pool in pools.values():
+        pool.close_idle()
+
+
+def reset_metrics():
+    global _metrics, _served, _published_at
+    _metrics = {}
+    _served = 0
+    _published_at = 0
+
+
+def _after_fork():
+    global _pools, _lock
+    _inherited.extend(_pools.values())
+    _pools = {}
+    _lock = threading.Lock()
+    reset_metrics()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def snapshot():
+    return {
+        'worker': worker_name(),
+        'served': _served,
+        'at': time.time(),
+        'databases': {alias: metrics.snapshot() for alias, metrics in list(_metrics.items())},
+    }
+
+
+def publish():
+    """Store this worker's metrics in the cache for `connection-stats`."""
+    interval = settings.DATABASE_METRICS_INTERVAL
+    name = worker_name()
+    cache.set(f'db-connections:{name}', snapshot(), interval * 3)
+    workers = cache.get(WORKERS_KEY) or {}
+    # workers not heard from in a while are dropped, the others re-add themselves on their next publish
+    workers = {worker: at for worker, at in workers.items() if at > time.time() - interval * 3}
+    workers[name] = time.time()
+    cache.set(WORKERS_KEY, workers, None)
+
+
+def record_served(**kwargs):
+    """request_finished / task_postrun receiver, publishes every DATABASE_METRICS_INTERVAL seconds."""
+    global _served, _published_at
+    _served += 1
+    interval = settings.DATABASE_METRICS_INTERVAL
+    if not interval or time.monotonic() - _published_at < interval:
+        return
+    _published_at = time.monotonic()
+    try:
+        publish()
+    except Exception:
+        # metrics never fail a request
+        logger.warning('publishing database connection metrics failed', exc_info=True)
+
+
+def collect():
+    """The latest snapshot() of every worker that published one."""
+    workers = cache.get(WORKERS_KEY) or {}
+    snapshots = cache.get_many([f'db-connections:{worker}' for worker in workers])
+    return sorted(snapshots.values(), key=lambda item: item['worker'])
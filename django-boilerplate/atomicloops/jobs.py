@@ -0,0 +1,100 @@
+# Deduplicated enqueueing of long jobs: while one runs for a (job, model, filters, user), asking
+# for the same again returns that job instead of starting another. The lock is a Redis key of the
+# default cache holding the job id, taken with SET NX and dropped by a compare-and-delete script,
+# the job releases it when it ends and it expires after EXPORT_JOB_LOCK_SECONDS when a worker dies
+import hashlib
+import json
+import threading
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+
+# KEYS[1] the lock, ARGV[1] the job id that must still hold it
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# caches that aren't Redis (LocMemCache in the tests) live in this process, this makes their
+# check and delete one step
+_local_lock = threading.Lock()
+
+
+def job_key(job, model, filters, user_id):
+    fingerprint = json.dumps([model, filters, str(user_id)], sort_keys=True, default=str)
+    return f'jobs:{job}:{hashlib.sha256(fingerprint.encode()).hexdigest()}'
+
+
+def get_lock_client():
+    """Raw Redis client of the default cache, None when the cache isn't django-redis."""
+    from django_redis import get_redis_connection
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def acquire(key, job_id, timeout):
+    """Id of the job holding `key`: `job_id` when it got the lock, the running job's otherwise."""
+    client = get_lock_client()
+    if client is None:
+        with _local_lock:
+            if cache.add(key, job_id, timeout):
+                return job_id
+            return cache.get(key)
+    name = cache.make_key(key)
+    while True:
+        if client.set(name, job_id, nx=True, ex=timeout):
+            return job_id
+        holder = client.get(name)
+        # released between set and get, try again
+        if holder is not None:
+            return holder.decode()
+
+
+def release(key, job_id):
+    """Drop the lock if `job_id` still holds it, a job finishing late must not free its successor's."""
+    client = get_lock_client()
+    if client is None:
+        with _local_lock:
+            if cache.get(key) == job_id:
+                cache.delete(key)
+        return
+    client.eval(RELEASE_SCRIPT, 1, cache.make_key(key), job_id)
+
+
+def enqueue_export(model, app_name, user_id=None, filterset=None, filters=None, region=None):
+    """
+    Queue atomicloops.tasks.export_data for `app_name.model`, rows filtered with the FilterSet at
+    dotted path `filterset` and its `filters` (dates in the X-Timezone-Region `region`), unless the
+    same export is already pending or running.
+    Returns (ExportData, created), the row tracks the job's status and the file once it is done.
+    """
+    # celery and the users app are loaded on the first export, not with the urlconf
+    from atomicloops.tasks import export_data
+    from users.models import ExportData
+
+    filters = filters or {}
+    job_id = str(uuid.uuid4())
+    key = job_key('export', f'{app_name}.{model}', [filterset, filters, region], user_id)
+    holder = acquire(key, job_id, settings.EXPORT_JOB_LOCK_SECONDS)
+    if holder != job_id:
+        job = ExportData.objects.filter(pk=holder).first()
+        if job is None:
+            # the holder is between taking the lock and saving its row
+            job = ExportData(id=holder, userId_id=user_id, modelName=model, filters=filters)
+        return job, False
+
+    try:
+        job = ExportData.objects.create(id=job_id, userId_id=user_id, modelName=model, filters=filters)
+        export_data.apply_async(
+            (model, app_name),
+            {'userId': user_id, 'filterset': filterset, 'filters': filters, 'region': region, 'lock': key},
+            task_id=job_id,
+        )
+    except Exception:
+        release(key, job_id)
+        raise
+    return job, True
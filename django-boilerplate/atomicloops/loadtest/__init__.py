@@ -0,0 +1,3 @@
+# HTTP load tests run against a local server by the loadtest management command.
+# scenarios.py holds the scripted user journeys, fixtures.py the data they run on,
+# baselines.json the reference numbers a run is compared to.
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+SUCCESS = (200, 201, 204)
+
+
+class Client:
+    """
+    Minimal asyncio HTTP/1.1 client recording the latency of every request under an
+    endpoint label. One connection per request (Connection: close) so every server,
+    runserver included, handles it the same way.
+    """
+
+    def __init__(self, url, timeout=60):
+        url = urlsplit(url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        # endpoint -> latencies in ms of the successful requests
+        self.samples = defaultdict(list)
+        # endpoint -> {status: count} of the failed ones, 0 for connection errors and timeouts
+        self.errors = defaultdict(Counter)
+
+    async def request(self, endpoint, method, path, token=None, data=None, expect=SUCCESS):
+        body = b'' if data is None else json.dumps(data).encode()
+        headers = {'Host': self.host, 'Content-Length': len(body), 'Connection': 'close'}
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        if token is not None:
+            headers['Authorization'] = f'Bearer {token}'
+        head = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+
+        begin = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            writer.write(f'{method} {self.prefix}/{path} HTTP/1.1\r\n{head}\r\n'.encode() + body)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout=self.timeout)
+            writer.close()
+            status = int(response.split(b' ', 2)[1])
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = 0
+        if status in expect:
+            self.samples[endpoint].append((time.monotonic() - begin) * 1000)
+        else:
+            self.errors[endpoint][status] += 1
+        return status
@@ -0,0 +1,221 @@
+import bisect
+import csv
+import hashlib
+import io
+import itertools
+import random
+import uuid
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from django.db import connections, transaction
+from django.utils import timezone
+
+# Every synthetic account uses this prefix, purge() deletes them with everything they own
+EMAIL_PREFIX = 'synthetic-'
+PASSWORD = 'synthetic-password'
+
+# Rows generated per unit of work, each chunk has its own random stream so the data
+# doesn't depend on the number of workers or on the insert batch size
+CHUNK_SIZE = 10000
+
+STATUS_WEIGHTS = {'pending': 40, 'in_progress': 20, 'completed': 40}
+PRIORITY_WEIGHTS = {'low': 30, 'medium': 50, 'high': 20}
+# share of tasks with a due date
+DUE_DATE_RATIO = 0.8
+
+WORDS = (
+    'review', 'update', 'prepare', 'client', 'invoice', 'report', 'meeting', 'design', 'deploy', 'fix',
+    'audit', 'quarterly', 'budget', 'onboarding', 'training', 'inventory', 'follow', 'call', 'schedule',
+    'draft', 'contract', 'website', 'release', 'backup', 'survey', 'payroll', 'order', 'supplier', 'visit',
+    'sales', 'marketing', 'campaign', 'support', 'ticket', 'document', 'policy', 'office', 'vendor',
+)
+
+
+def ident(seed, kind, index):
+    """Stable uuid of the `index`th `kind` row, so rows can point at each other without lookups."""
+    digest = hashlib.blake2b(f'{seed}:{kind}:{index}'.encode(), digest_size=16).digest()
+    return uuid.UUID(bytes=digest, version=4)
+
+
+def skewed_weights(count, skew):
+    """Zipf like weights, 0 is uniform, 1 means the first is twice the second and so on."""
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+def allocate(total, weights, minimum=0):
+    """Split `total` into integers proportional to `weights`, at least `minimum` each (largest remainder)."""
+    spare = total - minimum * len(weights)
+    if spare < 0:
+        raise ValueError(f'{total} is less than {minimum} for each of {len(weights)}')
+    scale = sum(weights)
+    shares = [spare * weight / scale for weight in weights]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(weights)), key=lambda index: counts[index] - shares[index])
+    for index in by_remainder[:spare - sum(counts)]:
+        counts[index] += 1
+    return [count + minimum for count in counts]
+
+
+def offsets(counts):
+    return [0, *itertools.accumulate(counts)][:-1]
+
+
+@lru_cache(maxsize=256)
+def cumulative_weights(count, skew):
+    return list(itertools.accumulate(skewed_weights(count, skew)))
+
+
+def make_plan(companies, employees, tasks, skew=1.0, seed=0, days=365, end=None):
+    """
+    Sizes of everything to generate. Companies get employees by a skewed distribution
+    (a few large ones, a long tail of small ones) and tasks proportional to their staff,
+    inside a company a few employees carry most of the tasks.
+    """
+    from django.contrib.auth.hashers import make_password
+
+    employee_counts = allocate(employees, skewed_weights(companies, skew), minimum=1)
+    task_counts = allocate(tasks, employee_counts)
+    return {
+        'seed': seed,
+        'skew': skew,
+        'days': days,
+        # pass `end` to reproduce timestamps too
+        'end': timezone.make_aware(datetime.combine(end, time.max)) if end else timezone.now(),
+        'password': make_password(PASSWORD, salt=f'synthetic{seed}'),
+        'companies': companies,
+        'employees': employees,
+        'tasks': tasks,
+        'employee_counts': employee_counts,
+        'employee_offsets': offsets(employee_counts),
+        'task_counts': task_counts,
+        'task_offsets': offsets(task_counts),
+    }
+
+
+def chunks(total):
+    return [(start, min(start + CHUNK_SIZE, total)) for start in range(0, total, CHUNK_SIZE)]
+
+
+def timestamps(plan, rng):
+    created = plan['end'] - timedelta(seconds=rng.uniform(0, plan['days'] * 86400))
+    # most rows are touched again within a few days of being created
+    updated = min(plan['end'], created + timedelta(seconds=rng.expovariate(1 / (3 * 86400))))
+    return created, updated
+
+
+def user_row(plan, rng, kind, index):
+    created, updated = timestamps(plan, rng)
+    return {
+        'id': ident(plan['seed'], kind, index),
+        'createdAt': created,
+        'updatedAt': updated,
+        'email': f'{EMAIL_PREFIX}{kind}-{index}@example.com',
+        'password': plan['password'],
+        'firstName': rng.choice(WORDS).title(),
+        'lastName': f'{kind.title()} {index}',
+        'userRole': 'EMPLOYER' if kind == 'employer' else 'EMPLOYEE',
+        'phoneNumber': f'+91{rng.randrange(10 ** 9, 10 ** 10)}' if rng.random() < 0.5 else None,
+    }
+
+
+def company_row(plan, rng, index):
+    created, updated = timestamps(plan, rng)
+    return {
+        'id': ident(plan['seed'], 'company', index),
+        'createdAt': created,
+        'updatedAt': updated,
+        'name': f"{' '.join(rng.choices(WORDS, k=2)).title()} {index}",
+        'userId_id': ident(plan['seed'], 'employer', index),
+        'isVerified': rng.random() < 0.9,
+    }
+
+
+def task_row(plan, rng, index):
+    company = bisect.bisect_right(plan['task_offsets'], index) - 1
+    staff = plan['employee_counts'][company]
+    weights = cumulative_weights(staff, plan['skew'])
+    assignee = min(bisect.bisect_left(weights, rng.random() * weights[-1]), staff - 1)
+    created, updated = timestamps(plan, rng)
+    due = None
+    if rng.random() < DUE_DATE_RATIO:
+        due = created.date() + timedelta(days=rng.randint(-7, 60))
+    return {
+        'id': ident(plan['seed'], 'task', index),
+        'createdAt': created,
+        'updatedAt': updated,
+        'title': ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))).capitalize(),
+        'description': ' '.join(rng.choices(WORDS, k=rng.randint(8, 40))).capitalize(),
+        'status': rng.choices(list(STATUS_WEIGHTS), weights=list(STATUS_WEIGHTS.values()))[0],
+        'priority': rng.choices(list(PRIORITY_WEIGHTS), weights=list(PRIORITY_WEIGHTS.values()))[0],
+        'dueDate': due,
+        'assignedTo_id': ident(plan['seed'], 'employee', plan['employee_offsets'][company] + assignee),
+        'createdBy_id': ident(plan['seed'], 'employer', company),
+        'companyId_id': ident(plan['seed'], 'company', company),
+    }
+
+
+def build_rows(plan, kind, start, stop):
+    rng = random.Random(f"{plan['seed']}:{kind}:{start}")
+    if kind == 'company':
+        return [company_row(plan, rng, index) for index in range(start, stop)]
+    if kind == 'task':
+        return [task_row(plan, rng, index) for index in range(start, stop)]
+    return [user_row(plan, rng, kind, index) for index in range(start, stop)]
+
+
+def insert(model, rows, method='bulk', batch_size=5000, using='default'):
+    """
+    Insert `rows` (dicts of attname -> value, missing fields get their defaults) in one transaction,
+    with COPY on PostgreSQL or multi row INSERTs. Unlike bulk_create this keeps createdAt/updatedAt.
+    """
+    connection = connections[using]
+    fields = model._meta.concrete_fields
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in fields)
+    values = [
+        [row[field.attname] if field.attname in row else field.get_default() for field in fields]
+        for row in rows
+    ]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if method == 'copy':
+            # synthetic data, losing the last commits on a crash is fine
+            cursor.execute('SET LOCAL synchronous_commit TO OFF')
+            buffer = io.StringIO()
+            # None is written as an unquoted empty field, which CSV COPY reads as NULL
+            csv.writer(buffer).writerows(values)
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            return len(values)
+        batch_size = max(1, min(batch_size, connection.ops.bulk_batch_size(fields, values)))
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            placeholders = connection.ops.bulk_insert_sql(fields, [['%s'] * len(fields)] * len(batch))
+            params = [field.get_db_prep_save(value, connection) for row in batch for field, value in zip(fields, row)]
+            cursor.execute(f'INSERT INTO {table} ({columns}) {placeholders}', params)
+    return len(values)
+
+
+def generate_chunk(job):
+    """Generate and insert one (plan, kind, start, stop, method, batch_size) chunk, in a worker process."""
+    plan, kind, start, stop, method, batch_size = job
+    from tasksaathi.models import Company, Task
+    from users.models import Users
+
+    model = {'employer': Users, 'employee': Users, 'company': Company, 'task': Task}[kind]
+    return insert(model, build_rows(plan, kind, start, stop), method, batch_size)
+
+
+def purge():
+    """Delete every synthetic user, their companies, tasks and summaries."""
+    from tasksaathi.models import Company, Task, TaskSummary
+    from users.models import Users
+
+    companies = Company.objects.filter(userId__email__startswith=EMAIL_PREFIX)
+    tasks = Task.objects.filter(companyId__in=companies)
+    # no per task signals or cascades to collect for millions of rows, the summaries go below
+    deleted = tasks._raw_delete(tasks.db)
+    TaskSummary.objects.filter(companyId__in=companies).delete()
+    companies.delete()
+    Users.objects.filter(email__startswith=EMAIL_PREFIX).delete()
+    return deleted
@@ -0,0 +1,68 @@
+import random
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Every load test account uses this prefix, teardown deletes them with everything they own
+EMAIL_PREFIX = 'loadtest-'
+PASSWORD = 'loadtest-password'
+
+
+def teardown():
+    from users.models import Users
+    Users.objects.filter(email__startswith=EMAIL_PREFIX).delete()
+
+
+def setup(employees=5, tasks=500, seed=0):
+    """
+    Recreate the load test company from scratch so every run sees the same data:
+    an employer, `employees` employees, a superuser for the bulk endpoints and
+    `tasks` tasks spread over the employees. Returns the context scenarios run with.
+    """
+    from tasksaathi.models import Company, Task
+    from tasksaathi.signals import SUMMARY_FIELDS, apply_summary_changes
+    from users.models import Users
+
+    teardown()
+    employer = Users.objects.create_user(
+        email=f'{EMAIL_PREFIX}employer@example.com', password=PASSWORD,
+        firstName='Load', lastName='Employer', userRole='EMPLOYER',
+    )
+    staff = [
+        Users.objects.create_user(
+            email=f'{EMAIL_PREFIX}employee-{index}@example.com', password=PASSWORD,
+            firstName='Load', lastName=f'Employee {index}',
+        )
+        for index in range(employees)
+    ]
+    admin = Users.objects.create_user(
+        email=f'{EMAIL_PREFIX}admin@example.com', password=PASSWORD,
+        firstName='Load', lastName='Admin', is_staff=True, is_superuser=True,
+    )
+    company = Company.objects.create(name='Load test', userId=employer, isVerified=True)
+
+    rng = random.Random(seed)
+    statuses = [choice for choice, _ in Task.STATUS_CHOICES]
+    priorities = [choice for choice, _ in Task.PRIORITY_CHOICES]
+    created = Task.objects.bulk_create([
+        Task(
+            title=f'Load test task {index}', description=f'Generated task number {index}',
+            status=rng.choice(statuses), priority=rng.choice(priorities),
+            assignedTo=staff[index % len(staff)], createdBy=employer, companyId=company,
+        )
+        for index in range(tasks)
+    ], batch_size=1000)
+    # bulk_create skips the signals that keep the summary counters
+    apply_summary_changes((None, {field: getattr(task, field) for field in SUMMARY_FIELDS}) for task in created)
+
+    return {
+        'password': PASSWORD,
+        'company': str(company.id),
+        'employer': {'id': str(employer.id), 'email': employer.email, 'token': str(AccessToken.for_user(employer))},
+        'employees': [
+            {'id': str(user.id), 'email': user.email, 'token': str(AccessToken.for_user(user))} for user in staff
+        ],
+        'admin': {'id': str(admin.id), 'email': admin.email, 'token': str(AccessToken.for_user(admin))},
+        # (task id, assignee index) so employee scenarios only touch their own tasks
+        'tasks': [(str(task.id), index % len(staff)) for index, task in enumerate(created)],
+        'statuses': statuses,
+        'priorities': priorities,
+    }
@@ -0,0 +1,72 @@
+import json
+import os
+import statistics
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# a run regresses when an endpoint's p95 grows or its throughput drops by more than this
+DEFAULT_TOLERANCE = 0.25
+
+
+def percentile(values, pct):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def summarize(client, seconds):
+    """{endpoint: {count, errors, rps, p50, p95, p99}} for one scenario run by `client`."""
+    results = {}
+    for endpoint in sorted(set(client.samples) | set(client.errors)):
+        samples = sorted(client.samples[endpoint])
+        results[endpoint] = {
+            'count': len(samples),
+            'errors': dict(client.errors[endpoint]),
+            'rps': round(len(samples) / seconds, 1) if seconds else 0.0,
+            **{
+                f'p{pct}': round(percentile(samples, pct), 1) if samples else None
+                for pct in (50, 95, 99)
+            },
+        }
+    return results
+
+
+def load_baselines(path=BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, settings, path=BASELINES):
+    """Store p50/p95/p99 and throughput of `results` ({scenario: {endpoint: stats}}), keeping other scenarios."""
+    baselines = load_baselines(path)
+    baselines['settings'] = settings
+    scenarios = baselines.setdefault('scenarios', {})
+    for name, endpoints in results.items():
+        scenarios[name] = {
+            endpoint: {key: stats[key] for key in ('p50', 'p95', 'p99', 'rps')}
+            for endpoint, stats in endpoints.items()
+        }
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baselines, tolerance=DEFAULT_TOLERANCE):
+    """Human readable regressions of `results` against `baselines`, empty when the run passes."""
+    regressions = []
+    stored = baselines.get('scenarios', {})
+    for name, endpoints in results.items():
+        for endpoint, stats in endpoints.items():
+            label = f'{name} {endpoint}'
+            if stats['errors']:
+                regressions.append(f'{label}: failed requests {stats["errors"]}')
+            baseline = stored.get(name, {}).get(endpoint)
+            if baseline is None or stats['p95'] is None:
+                continue
+            if stats['p95'] > baseline['p95'] * (1 + tolerance):
+                regressions.append(f'{label}: p95 {stats["p95"]}ms, baseline {baseline["p95"]}ms')
+            if stats['rps'] < baseline['rps'] * (1 - tolerance):
+                regressions.append(f'{label}: {stats["rps"]} req/s, baseline {baseline["rps"]} req/s')
+    return regressions
@@ -0,0 +1,94 @@
+import uuid
+
+# name -> coroutine function (client, context, iteration), in the order they run
+SCENARIOS = {}
+
+# multiple-create accepts at most 100 rows per request
+BULK_IMPORT_SIZE = 100
+
+
+def scenario(name):
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+def employee(context, iteration):
+    return context['employees'][iteration % len(context['employees'])]
+
+
+@scenario('employer-login')
+async def employer_login(client, context, iteration):
+    """Employer signs in"""
+    await client.request('POST /login/', 'POST', 'login/', data={
+        'email': context['employer']['email'], 'password': context['password'],
+    })
+
+
+@scenario('employee-login')
+async def employee_login(client, context, iteration):
+    """Employees sign in"""
+    await client.request('POST /login/', 'POST', 'login/', data={
+        'email': employee(context, iteration)['email'], 'password': context['password'],
+    })
+
+
+@scenario('task-list')
+async def task_list(client, context, iteration):
+    """Employer pages through the company tasks, an employee opens their own"""
+    token = context['employer']['token']
+    offset = (iteration * 10) % max(len(context['tasks']), 1)
+    await client.request('GET /api/tasks/', 'GET', f'api/tasks/?limit=10&offset={offset}', token=token)
+    await client.request('GET /api/tasks/my-tasks/', 'GET', 'api/tasks/my-tasks/',
+                         token=employee(context, iteration)['token'])
+
+
+@scenario('task-filter')
+async def task_filter(client, context, iteration):
+    """Employer filters by status and priority, then searches"""
+    token = context['employer']['token']
+    status = context['statuses'][iteration % len(context['statuses'])]
+    priority = context['priorities'][iteration % len(context['priorities'])]
+    await client.request('GET /api/tasks/?status&priority', 'GET',
+                         f'api/tasks/?status={status}&priority={priority}', token=token)
+    await client.request('GET /api/tasks/?search', 'GET', f'api/tasks/?search=task+{iteration % 50}', token=token)
+
+
+@scenario('task-create')
+async def task_create(client, context, iteration):
+    """Employer creates a task for an employee"""
+    await client.request('POST /api/tasks/', 'POST', 'api/tasks/', token=context['employer']['token'], data={
+        'title': f'Load test created {iteration}',
+        'description': 'Created by the load test',
+        'priority': context['priorities'][iteration % len(context['priorities'])],
+        'assignedTo': employee(context, iteration)['id'],
+        'createdBy': context['employer']['id'],
+        'companyId': context['company'],
+    })
+
+
+@scenario('task-status')
+async def task_status(client, context, iteration):
+    """Employees move their tasks through the statuses"""
+    task_id, assignee = context['tasks'][iteration % len(context['tasks'])]
+    status = context['statuses'][iteration % len(context['statuses'])]
+    await client.request('PATCH /api/tasks/{id}/update-status/', 'PATCH', f'api/tasks/{task_id}/update-status/',
+                         token=context['employees'][assignee]['token'], data={'status': status})
+
+
+@scenario('bulk-import')
+async def bulk_import(client, context, iteration):
+    """Admin imports a batch of tasks"""
+    batch = uuid.uuid4().hex[:8]
+    await client.request('POST /api/tasks/multiple-create/', 'POST', 'api/tasks/multiple-create/',
+                         token=context['admin']['token'], data=[
+                             {
+                                 'title': f'Load test import {batch} {index}',
+                                 'description': 'Imported by the load test',
+                                 'assignedTo': employee(context, index)['id'],
+                                 'createdBy': context['employer']['id'],
+                                 'companyId': context['company'],
+                             }
+                             for index in range(BULK_IMPORT_SIZE)
+                         ])
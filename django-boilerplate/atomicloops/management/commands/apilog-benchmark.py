@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+import statistics
+import time
+
+BENCHMARK_PATH = '/apilog-benchmark/'
+
+
+class Command(BaseCommand):
+    help = ('benchmark the per request overhead of API logging: off, written synchronously in the request '
+            'and queued for the background flush thread')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--backend', default='atomicloops.apilog.MemoryApiLogBackend',
+                            help='API_LOG_BACKEND to write to, the benchmark rows are deleted afterwards')
+        parser.add_argument('--rows', type=int, default=20, help='Items in the JSON response of the view')
+
+    def handle(self, *args, **kwargs):
+        from django.http import JsonResponse
+        from django.test import RequestFactory
+        from django.urls import ResolverMatch
+        from atomicloops.apilog import get_api_log_buffer, reset_api_log_buffer
+        from atomicloops.middleware import ApiLogMiddleware
+
+        payload = {'data': [{'id': index, 'title': f'Task {index}', 'status': 'pending'}
+                            for index in range(kwargs['rows'])]}
+
+        def view(request):
+            return JsonResponse(payload)
+
+        factory = RequestFactory()
+
+        def make_request():
+            request = factory.post(BENCHMARK_PATH, {'title': 'Task', 'password': 'secret'},
+                                   content_type='application/json', HTTP_AUTHORIZATION='Bearer token')
+            request.resolver_match = ResolverMatch(view, (), {}, url_name='apilog-benchmark')
+            return request
+
+        def run(mode):
+            reset_api_log_buffer()
+            middleware = ApiLogMiddleware(view)
+            # build the requests up front, only the middleware and the view are timed
+            requests = [make_request() for _ in range(kwargs['requests'])]
+            timings = []
+            buffer = get_api_log_buffer()
+            for request in requests:
+                begin = time.perf_counter()
+                middleware(request)
+                if mode == 'sync':
+                    # what logging in the request costs: build the entry and write it before answering
+                    buffer.flush()
+                timings.append(time.perf_counter() - begin)
+            begin = time.perf_counter()
+            if buffer is not None:
+                buffer.flush()
+            drain = time.perf_counter() - begin
+            return timings, drain
+
+        results = {}
+        modes = [('off', None), ('sync', kwargs['backend']), ('buffered', kwargs['backend'])]
+        for mode, backend in modes:
+            # the flush thread doesn't take anything during the run, so the request timings are the
+            # cost in the request alone; the queue is drained and timed at the end
+            with override_settings(API_LOG_BACKEND=backend, API_LOG_FLUSH_INTERVAL=3600,
+                                   API_LOG_BATCH_SIZE=kwargs['requests'] + 1,
+                                   API_LOG_QUEUE_SIZE=kwargs['requests'] + 1):
+                results[mode] = run(mode)
+        reset_api_log_buffer()
+        self.cleanup(kwargs['backend'])
+
+        base = statistics.mean(results['off'][0])
+        for mode, _ in modes:
+            timings, drain = results[mode]
+            mean = statistics.mean(timings)
+            p99 = statistics.quantiles(timings, n=100)[98]
+            line = (f'{mode:>9}: {mean * 1e6:8.1f}µs mean, {p99 * 1e6:8.1f}µs p99, '
+                    f'{(mean - base) * 1e6:+8.1f}µs over no logging')
+            if mode == 'buffered':
+                line += f', then {drain / len(timings) * 1e6:.1f}µs per request on the flush thread'
+            self.stdout.write(line)
+
+    def cleanup(self, backend):
+        if backend == 'atomicloops.apilog.DatabaseApiLogBackend':
+            from atomicloops.models import ApiLog
+            ApiLog.objects.filter(path__startswith=BENCHMARK_PATH).delete()
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+import statistics
+import threading
+import time
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share / 100))]
+
+
+class Command(BaseCommand):
+    help = ('latency of OTP emails (send_email, from publishing to a worker starting it) while exports keep the '
+            'workers busy, against running workers started with -E. Run it once with the worker profiles of '
+            'docker-compose.yml and once with a single worker consuming every queue to compare. Point the '
+            'workers at a dummy EMAIL_BACKEND, the emails go to --receiver')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exports', type=int, default=4, help='export_data tasks queued first')
+        parser.add_argument('--model', default='tasksaathi.Task', help='app_label.Model the exports read')
+        parser.add_argument('--emails', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=0.2, help='Seconds between two emails')
+        parser.add_argument('--warmup', type=float, default=2, help='Seconds between the exports and the first email')
+        parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for the emails to start')
+        parser.add_argument('--receiver', default='otp-benchmark@example.com')
+
+    def handle(self, *args, **kwargs):
+        from src.celery import app
+        from atomicloops.tasks import export_data, send_email
+
+        app_label, model = kwargs['model'].split('.')
+        sent, started = {}, {}
+        done = threading.Event()
+
+        def on_started(event):
+            started[event['uuid']] = event['timestamp']
+            if len(started.keys() & sent.keys()) == kwargs['emails']:
+                done.set()
+
+        with app.connection_for_read() as connection:
+            receiver = app.events.Receiver(connection, handlers={'task-started': on_started})
+            listener = threading.Thread(target=receiver.capture, kwargs={'wakeup': True}, daemon=True)
+            listener.start()
+            time.sleep(1)
+
+            exports = [export_data.delay(model, app_label).id for _ in range(kwargs['exports'])]
+            time.sleep(kwargs['warmup'])
+            for index in range(kwargs['emails']):
+                begin = time.time()
+                result = send_email.delay(kwargs['receiver'], 'Verification otp', f'<p>OTP benchmark {index}</p>')
+                sent[result.id] = begin
+                time.sleep(kwargs['interval'])
+            done.wait(kwargs['timeout'])
+            receiver.should_stop = True
+
+        latencies = [(started[task_id] - begin) * 1000 for task_id, begin in sent.items() if task_id in started]
+        if not latencies:
+            raise CommandError('no email started, are workers running with -E (task events)?')
+        self.stdout.write(
+            f"{len(latencies)} of {kwargs['emails']} OTP emails started, "
+            f"{len([task_id for task_id in exports if task_id in started])} of {kwargs['exports']} exports started\n"
+            f"publish to start: p50 {statistics.median(latencies):.0f}ms p95 {percentile(latencies, 95):.0f}ms "
+            f"p99 {percentile(latencies, 99):.0f}ms max {max(latencies):.0f}ms"
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+import time
+
+
+class Command(BaseCommand):
+    help = ('database connections of every web and Celery worker, as they last published them (every '
+            'DATABASE_METRICS_INTERVAL seconds): open now, opened since the worker started and the time it took, '
+            'pooled checkouts served by an idle connection, and how often and how long a checkout waited')
+
+    def handle(self, *args, **kwargs):
+        from django.conf import settings
+        from atomicloops.connections import collect
+
+        workers = collect()
+        if not workers:
+            self.stdout.write(f'no metrics yet, workers publish every {settings.DATABASE_METRICS_INTERVAL}s')
+            return
+        self.stdout.write(
+            f"{'worker':<28} {'database':<10} {'served':>7} {'open':>5} {'opened':>7} {'connect':>8} "
+            f"{'reused':>7} {'waits':>6} {'wait avg':>9} {'wait max':>9} {'timeouts':>8} {'age':>5}"
+        )
+        for worker in workers:
+            for alias, db in worker['databases'].items():
+                connect = db['open_seconds'] / db['opened'] * 1000 if db['opened'] else 0
+                reused = f"{db['reused'] / db['checkouts']:.0%}" if db['checkouts'] else '-'
+                wait = db['wait_seconds'] / db['waits'] * 1000 if db['waits'] else 0
+                self.stdout.write(
+                    f"{worker['worker']:<28} {alias:<10} {worker['served']:>7} {db['open']:>5} {db['opened']:>7} "
+                    f"{connect:>6.1f}ms {reused:>7} {db['waits']:>6} {wait:>7.1f}ms {db['wait_max'] * 1000:>7.1f}ms "
+                    f"{db['timeouts']:>8} {time.time() - worker['at']:>4.0f}s"
+                )
+        self.stdout.write(
+            'served: requests and tasks, connect: average time to open a connection, reused/waits: pooled '
+            'databases only (DB_POOL_SIZE), age: since the worker published'
+        )
@@ -0,0 +1,265 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.conf import settings
+from django.db import connections, transaction
+from django.apps import apps
+import io
+import os
+import time
+from atomicloops.backup import file_checksum, latest_manifest, open_reader, read_manifest, read_rows
+
+
+class Command(BaseCommand):
+    help = 'run this in order to restore a backup written by db-backup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup', nargs='?', help='Backup directory or its name in BACKUP_DIR (default: latest)')
+        parser.add_argument('--models', nargs='*', default=None, help='Restrict to app labels or app_label.Model')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--jobs', type=int, default=4, help='Number of tables loaded in parallel')
+        parser.add_argument('--no-verify', action='store_true', help='Skip the manifest checksum verification')
+        parser.add_argument('--keep-indexes', action='store_true',
+                            help='Load with indexes and foreign keys in place instead of rebuilding them afterwards')
+
+    def handle(self, *args, **kwargs):
+        self.database = kwargs['database']
+        connection = connections[self.database]
+        self.is_postgres = connection.vendor == 'postgresql'
+        # The generic row by row path is meant for dev databases, keep it sequential
+        self.jobs = max(1, kwargs['jobs']) if self.is_postgres else 1
+        self.path, self.manifest = self.get_backup(kwargs['backup'])
+        self.compression = self.manifest['compression']
+        self.incremental = self.manifest['incremental']
+        tables = self.get_tables(kwargs['models'])
+        begin = time.monotonic()
+
+        if not kwargs['no_verify']:
+            self.verify(tables)
+
+        # Incremental backups are upserted on top of the current data and keep the schema as is
+        rebuild = self.is_postgres and not self.incremental and not kwargs['keep_indexes']
+        foreign_keys, indexes = [], []
+        if rebuild:
+            foreign_keys, indexes = self.drop_constraints(tables)
+        # Without dropped foreign keys, tables load level by level so referenced rows exist first
+        levels = [tables] if rebuild else self.dependency_levels(tables)
+        if not self.incremental:
+            self.truncate([entry for level in reversed(levels) for entry in level])
+
+        for level in levels:
+            self.run_parallel(self.load_table, level, lambda entry: f"{entry['model']} {entry['rows']} rows")
+
+        if rebuild:
+            self.run_parallel(self.execute_ddl, indexes, lambda ddl: f"index {ddl[0]}")
+            self.run_parallel(self.execute_ddl, foreign_keys, lambda ddl: f"constraint {ddl[0]}")
+        self.reset_sequences(tables)
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {len(tables)} tables from {self.path} in {round(time.monotonic() - begin, 2)}s"
+        ))
+
+    def get_backup(self, backup):
+        if backup is None:
+            path, manifest = latest_manifest(settings.BACKUP_DIR)
+            if manifest is None:
+                raise CommandError('No backup found in %s' % settings.BACKUP_DIR)
+            return path, manifest
+        path = backup if os.path.isdir(backup) else os.path.join(settings.BACKUP_DIR, backup)
+        try:
+            return path, read_manifest(path)
+        except FileNotFoundError:
+            raise CommandError('No manifest found in %s' % path)
+
+    def get_tables(self, labels):
+        tables = []
+        for entry in self.manifest['tables']:
+            app_label = entry['model'].split('.')[0]
+            if labels and app_label not in labels and entry['model'] not in labels:
+                continue
+            try:
+                entry['modelClass'] = apps.get_model(entry['model'])
+            except LookupError:
+                raise CommandError('Model %s from the manifest is not installed' % entry['model'])
+            tables.append(entry)
+        if not tables:
+            raise CommandError('No tables matched %s' % labels)
+        return tables
+
+    def run_parallel(self, func, items, label):
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self.timed, func, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    raise CommandError(f"{label(futures[future])} failed: {e}")
+                self.stdout.write(f"{label(futures[future])} in {seconds}s")
+
+    def timed(self, func, item):
+        begin = time.monotonic()
+        try:
+            func(item)
+        finally:
+            # Worker threads get their own connection, don't leak it
+            connections[self.database].close()
+        return round(time.monotonic() - begin, 3)
+
+    def verify(self, tables):
+        def check(entry):
+            checksum = file_checksum(os.path.join(self.path, entry['file']), self.compression)
+            if checksum != entry['sha256']:
+                raise CommandError(f"Checksum mismatch for {entry['file']}")
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(check, tables))
+        self.stdout.write(f"Verified checksums of {len(tables)} files")
+
+    def dependency_levels(self, tables):
+        # Tables in one level only reference tables from earlier levels, so a level can load in parallel
+        by_table = {entry['table']: entry for entry in tables}
+        done, levels = set(), []
+        while len(done) < len(tables):
+            level = [
+                entry for name, entry in by_table.items()
+                if name not in done and all(dep in done or dep not in by_table for dep in entry['dependsOn'])
+            ]
+            if not level:
+                # dependency cycle, the remaining tables rely on deferred constraints
+                level = [entry for name, entry in by_table.items() if name not in done]
+            done.update(entry['table'] for entry in level)
+            levels.append(level)
+        return levels
+
+    def drop_constraints(self, tables):
+        names = [entry['table'] for entry in tables]
+        connection = connections[self.database]
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT con.conname, rel.relname, pg_get_constraintdef(con.oid)
+                FROM pg_constraint con
+                JOIN pg_class rel ON rel.oid = con.conrelid
+                JOIN pg_namespace ns ON ns.oid = rel.relnamespace
+                LEFT JOIN pg_class ref ON ref.oid = con.confrelid
+                WHERE con.contype = 'f' AND ns.nspname = current_schema()
+                AND (rel.relname = ANY(%s) OR ref.relname = ANY(%s))
+            """, [names, names])
+            foreign_keys = cursor.fetchall()
+            cursor.execute("""
+                SELECT idx.relname, tbl.relname, pg_get_indexdef(idx.oid)
+                FROM pg_index ind
+                JOIN pg_class idx ON idx.oid = ind.indexrelid
+                JOIN pg_class tbl ON tbl.oid = ind.indrelid
+                JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+                WHERE ns.nspname = current_schema() AND tbl.relname = ANY(%s)
+                AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = ind.indexrelid)
+            """, [names])
+            indexes = cursor.fetchall()
+
+        quote = connection.ops.quote_name
+        foreign_keys = [
+            (name, f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}",
+             f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}")
+            for name, table, definition in foreign_keys
+        ]
+        indexes = [(name, definition, f"DROP INDEX {quote(name)}") for name, table, definition in indexes]
+        # Keep the DDL next to the dump so the schema can be recovered if the restore is interrupted
+        with open(os.path.join(self.path, 'restore-schema.sql'), 'w') as f:
+            for _, ddl, _ in indexes + foreign_keys:
+                f.write(ddl + ';\n')
+
+        with transaction.atomic(using=self.database), connection.cursor() as cursor:
+            for _, _, drop in foreign_keys + indexes:
+                cursor.execute(drop)
+        self.stdout.write(f"Dropped {len(indexes)} indexes and {len(foreign_keys)} foreign keys")
+        return foreign_keys, indexes
+
+    def truncate(self, tables):
+        connection = connections[self.database]
+        quote = connection.ops.quote_name
+        with transaction.atomic(using=self.database), connection.cursor() as cursor:
+            if self.is_postgres:
+                cursor.execute('TRUNCATE %s' % ', '.join(quote(entry['table']) for entry in tables))
+            else:
+                for entry in tables:
+                    cursor.execute('DELETE FROM %s' % quote(entry['table']))
+
+    def execute_ddl(self, ddl):
+        with connections[self.database].cursor() as cursor:
+            cursor.execute(ddl[1])
+
+    def load_table(self, entry):
+        connection = connections[self.database]
+        path = os.path.join(self.path, entry['file'])
+        with transaction.atomic(using=self.database), connection.cursor() as cursor:
+            with open_reader(path, self.compression) as f:
+                if self.is_postgres:
+                    self.copy_postgres(cursor, entry, f)
+                else:
+                    self.insert_rows(cursor, entry, f)
+
+    def copy_postgres(self, cursor, entry, f):
+        quote = cursor.db.ops.quote_name
+        columns = ', '.join(quote(column) for column in entry['columns'])
+        table = quote(entry['table'])
+        cursor.execute('SET LOCAL synchronous_commit TO OFF')
+        target = table
+        if self.incremental:
+            target = quote(f"restore_{entry['table']}")
+            cursor.execute(f"CREATE TEMP TABLE {target} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        copy_sql = f"COPY {target} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER)"
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):
+            # psycopg2
+            raw_cursor.copy_expert(copy_sql, f, size=1024 * 1024)
+        else:
+            # psycopg 3
+            with raw_cursor.copy(copy_sql) as copy:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    copy.write(chunk)
+        if self.incremental:
+            primary_key = quote(entry['primaryKey'])
+            updates = ', '.join(
+                f"{quote(column)} = EXCLUDED.{quote(column)}"
+                for column in entry['columns'] if column != entry['primaryKey']
+            )
+            conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {target} "
+                f"ON CONFLICT ({primary_key}) {conflict}"
+            )
+
+    def insert_rows(self, cursor, entry, f, batch_size=2000):
+        # Generic backends: convert the CSV strings back through the model fields and insert in batches
+        model = entry['modelClass']
+        fields_by_column = {field.column: field for field in model._meta.local_concrete_fields}
+        fields = [fields_by_column[column] for column in entry['columns']]
+        quote = cursor.db.ops.quote_name
+        table = quote(entry['table'])
+        pk_index = entry['columns'].index(entry['primaryKey'])
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f"INSERT INTO {table} ({', '.join(quote(c) for c in entry['columns'])}) VALUES ({placeholders})"
+        reader = read_rows(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        next(reader)
+        batch = []
+        for row in reader:
+            values = [
+                None if value is None else field.get_db_prep_save(field.to_python(value), cursor.db)
+                for field, value in zip(fields, row)
+            ]
+            if self.incremental:
+                cursor.execute(f"DELETE FROM {table} WHERE {quote(entry['primaryKey'])} = %s", [values[pk_index]])
+            batch.append(values)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+    def reset_sequences(self, tables):
+        connection = connections[self.database]
+        statements = connection.ops.sequence_reset_sql(no_style(), [entry['modelClass'] for entry in tables])
+        if statements:
+            with transaction.atomic(using=self.database), connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
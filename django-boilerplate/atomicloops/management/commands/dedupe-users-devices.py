@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+class Command(BaseCommand):
+    help = ('delete duplicate users_devices rows, keeping the latest registration of every (user, deviceId), '
+            'run once before migrating to the users_devices_user_device unique constraint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the duplicates')
+
+    def handle(self, *args, **kwargs):
+        from users.models import UsersDevices
+
+        # one window scan finds every row that isn't the newest of its (user, deviceId)
+        duplicates = UsersDevices.objects.annotate(row=Window(
+            RowNumber(),
+            partition_by=[F('userId'), F('deviceId')],
+            order_by=[F('updatedAt').desc(), F('createdAt').desc(), F('id').desc()],
+        )).filter(row__gt=1).values_list('id', flat=True)
+        ids = list(duplicates)
+        if kwargs['dry_run']:
+            self.stdout.write(f'{len(ids)} duplicate devices')
+            return
+
+        # short transactions so registrations and the push fan out aren't blocked behind one big delete
+        deleted = 0
+        for start in range(0, len(ids), kwargs['batch_size']):
+            with transaction.atomic():
+                deleted += UsersDevices.objects.filter(id__in=ids[start:start + kwargs['batch_size']]).delete()[0]
+            self.stdout.write(f'{deleted}/{len(ids)} duplicate devices deleted')
+        self.stdout.write(self.style.SUCCESS(f'{deleted} duplicate devices deleted'))
@@ -0,0 +1,141 @@
+from django.core.management.base import BaseCommand, CommandError
+from urllib.parse import urlsplit
+import asyncio
+import resource
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = 'open many idle /api/tasks/events/ streams against a running ASGI server and report what it holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api/tasks/events/')
+        parser.add_argument('--email', required=True, help='User whose JWT opens the streams')
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=200, help='Connections being opened at once')
+        parser.add_argument('--hold', type=float, default=30, help='Seconds to keep every stream open')
+        parser.add_argument('--server-pid', type=int, help='Report the RSS growth of this server process')
+        parser.add_argument('--publish', action='store_true',
+                            help='Publish one event through TASK_EVENTS_BROKER and time the fan out')
+
+    def handle(self, *args, **kwargs):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from tasksaathi.streams import get_channels
+        from users.models import Users
+
+        user = Users.objects.filter(email=kwargs['email']).first()
+        if user is None:
+            raise CommandError('No user with email %s' % kwargs['email'])
+        self.channels = get_channels(user)
+        if not self.channels:
+            raise CommandError('%s has no task events channel' % kwargs['email'])
+        url = urlsplit(kwargs['url'])
+        self.host, self.port = url.hostname, url.port or 80
+        self.target = url.path
+        # the header, not ?ticket=, one JWT opens every stream
+        self.authorization = f'Bearer {AccessToken.for_user(user)}'
+
+        # every stream is a socket on both ends
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        if kwargs['connections'] + 100 > hard:
+            self.stdout.write(self.style.WARNING(f"Open file limit is {hard}, expect connection failures"))
+        asyncio.run(self.run(kwargs))
+
+    async def run(self, kwargs):
+        rss_before = rss_kb(kwargs['server_pid'])
+        semaphore = asyncio.Semaphore(kwargs['concurrency'])
+        self.received = {}
+        begin = time.monotonic()
+        results = await asyncio.gather(*[self.connect(semaphore) for _ in range(kwargs['connections'])])
+        streams = [result for result in results if not isinstance(result, str)]
+        failures = [result for result in results if isinstance(result, str)]
+        opened_in = time.monotonic() - begin
+        latencies = sorted(latency for _, _, latency in streams)
+        self.stdout.write(f"Opened {len(streams)}/{kwargs['connections']} streams in {opened_in:.2f}s")
+        if failures:
+            self.stdout.write(self.style.WARNING(f"{len(failures)} failed, first: {failures[0]}"))
+        if latencies:
+            self.stdout.write(
+                f"Connect latency p50 {percentile(latencies, 50):.1f}ms p99 {percentile(latencies, 99):.1f}ms"
+            )
+
+        readers = [asyncio.create_task(self.read(index, reader)) for index, (reader, _, _) in enumerate(streams)]
+        await asyncio.sleep(kwargs['hold'])
+        rss_after = rss_kb(kwargs['server_pid'])
+        if rss_before is not None and rss_after is not None and streams:
+            self.stdout.write(
+                f"Server RSS {rss_before // 1024}MB -> {rss_after // 1024}MB, "
+                f"{(rss_after - rss_before) / len(streams):.1f}KB per stream"
+            )
+        if kwargs['publish'] and streams:
+            await self.fan_out(len(streams))
+        alive = sum(not reader.done() for reader in readers)
+        self.stdout.write(self.style.SUCCESS(f"{alive} streams still open after {kwargs['hold']}s"))
+
+        for task in readers:
+            task.cancel()
+        for _, writer, _ in streams:
+            writer.close()
+
+    async def connect(self, semaphore):
+        async with semaphore:
+            begin = time.monotonic()
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                writer.write(
+                    f"GET {self.target} HTTP/1.1\r\nHost: {self.host}\r\nAccept: text/event-stream\r\n"
+                    f"Authorization: {self.authorization}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=30)
+                if not head.startswith(b'HTTP/1.1 200'):
+                    writer.close()
+                    return head.split(b'\r\n')[0].decode()
+                # first event is the retry hint
+                await asyncio.wait_for(reader.readuntil(b'\n\n'), timeout=30)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                return repr(e)
+            return reader, writer, (time.monotonic() - begin) * 1000
+
+    async def read(self, index, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if b'event: loadtest' in line:
+                self.received[index] = time.monotonic()
+
+    async def fan_out(self, expected):
+        from asgiref.sync import sync_to_async
+        from tasksaathi.events import get_broker
+        sent = time.monotonic()
+        await sync_to_async(get_broker().publish)(self.channels[0], {'event': 'loadtest'})
+        deadline = sent + 30
+        while len(self.received) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        delays = sorted((received - sent) * 1000 for received in self.received.values())
+        if not delays:
+            self.stdout.write(self.style.WARNING('No stream received the published event'))
+            return
+        self.stdout.write(
+            f"Fan out to {len(delays)}/{expected} streams: p50 {percentile(delays, 50):.1f}ms "
+            f"p99 {percentile(delays, 99):.1f}ms max {delays[-1]:.1f}ms"
+        )
+
+
+def percentile(values, pct):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def rss_kb(pid):
+    if pid is None:
+        return None
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return None
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+import datetime
+import multiprocessing
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = ('generate a seeded, reproducible dataset of companies, employers, employees and tasks with skewed '
+            'sizes, inserted with COPY on PostgreSQL and multi row INSERTs elsewhere, over several processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=10)
+        parser.add_argument('--employees', type=int, default=500, help='Employees over all companies')
+        parser.add_argument('--tasks', type=int, default=20000, help='Tasks over all companies')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Zipf exponent of company sizes and of tasks per employee, 0 is uniform')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--days', type=int, default=365, help='Rows are created over this many days')
+        parser.add_argument('--end', type=datetime.date.fromisoformat,
+                            help='Last day of the generated history (YYYY-MM-DD), default now')
+        parser.add_argument('--workers', type=int,
+                            help='Processes inserting in parallel, default one per CPU on PostgreSQL')
+        parser.add_argument('--method', choices=['copy', 'bulk'],
+                            help='copy (PostgreSQL only) or multi row INSERTs, default copy on PostgreSQL')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT statement')
+        parser.add_argument('--purge', action='store_true', help='Delete the previous synthetic data first')
+
+    def handle(self, *args, **kwargs):
+        from atomicloops.loadtest import dataset
+        from tasksaathi.tasks import reconcile_task_summaries
+
+        postgres = connection.vendor == 'postgresql'
+        method = kwargs['method'] or ('copy' if postgres else 'bulk')
+        if method == 'copy' and not postgres:
+            raise CommandError('--method copy needs PostgreSQL')
+        # sqlite serializes writers, extra processes only wait on each other
+        workers = kwargs['workers'] or (os.cpu_count() if postgres else 1)
+        try:
+            plan = dataset.make_plan(
+                kwargs['companies'], kwargs['employees'], kwargs['tasks'], kwargs['skew'], kwargs['seed'],
+                kwargs['days'], kwargs['end'],
+            )
+        except ValueError as e:
+            raise CommandError(f'Every company needs an employee: {e}')
+
+        if kwargs['purge']:
+            self.stdout.write(f'{dataset.purge()} synthetic tasks deleted')
+
+        # users before the companies and tasks pointing at them
+        phases = [
+            ('employer', kwargs['companies']),
+            ('employee', kwargs['employees']),
+            ('company', kwargs['companies']),
+            ('task', kwargs['tasks']),
+        ]
+        begin = time.monotonic()
+        if workers > 1:
+            # forked workers must open their own connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                for kind, total in phases:
+                    self.run_phase(pool.imap_unordered, plan, kind, total, method, kwargs['batch_size'])
+        else:
+            for kind, total in phases:
+                self.run_phase(map, plan, kind, total, method, kwargs['batch_size'])
+
+        # the inserts skip the signals that keep the summary counters
+        self.stdout.write(reconcile_task_summaries())
+        if postgres:
+            from tasksaathi.models import Company, Task, TaskSummary
+            from users.models import Users
+            with connection.cursor() as cursor:
+                for model in (Users, Company, Task, TaskSummary):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        largest = max(plan['employee_counts'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {kwargs['companies']} companies, {kwargs['employees']} employees and {kwargs['tasks']} tasks "
+            f"in {time.monotonic() - begin:.1f}s, largest company has {largest} employees and "
+            f"{max(plan['task_counts'])} tasks, password {dataset.PASSWORD}"
+        ))
+
+    def run_phase(self, map_function, plan, kind, total, method, batch_size):
+        from atomicloops.loadtest.dataset import chunks, generate_chunk
+
+        begin = time.monotonic()
+        jobs = [(plan, kind, start, stop, method, batch_size) for start, stop in chunks(total)]
+        done = 0
+        step = max(total // 10, 1)
+        for count in map_function(generate_chunk, jobs):
+            if (done + count) // step > done // step and done + count < total:
+                self.stdout.write(f'{kind}: {done + count}/{total}')
+            done += count
+        seconds = time.monotonic() - begin
+        rate = done / seconds if seconds else 0
+        self.stdout.write(f'{kind}: {done} rows in {seconds:.1f}s ({rate:.0f} rows/s)')
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import os
+
+
+class Command(BaseCommand):
+    help = ('write the OpenAPI schema of the running code to STATIC_ROOT/SCHEMA_ARTIFACT_DIR as '
+            'openapi-<revision>.json and .yaml, /swagger/, /redoc/ and /postman.json/ serve it from there')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revision', help='Revision in the file names, default CODE_REVISION or the source hash')
+        parser.add_argument('--keep', type=int, default=3, help='Artifacts of older revisions kept, 0 keeps all')
+
+    def handle(self, *args, **kwargs):
+        from importlib import import_module
+        from drf_yasg.renderers import SwaggerJSONRenderer, SwaggerYAMLRenderer
+        from atomicloops.schema import code_revision, schema_artifact
+
+        schema_view = import_module(settings.ROOT_URLCONF).schema_view
+        revision = kwargs['revision'] or code_revision()
+        directory = os.path.join(settings.STATIC_ROOT, settings.SCHEMA_ARTIFACT_DIR)
+        os.makedirs(directory, exist_ok=True)
+        for renderer_class in (SwaggerJSONRenderer, SwaggerYAMLRenderer):
+            path = os.path.join(settings.STATIC_ROOT, schema_artifact(renderer_class.codec_class, revision))
+            content = schema_view.render_schema(renderer_class, revision)
+            # written next to the target and renamed, a server starting meanwhile never sees half a file
+            with open(f'{path}.tmp', 'wb') as artifact:
+                artifact.write(content)
+            os.replace(f'{path}.tmp', path)
+            self.stdout.write(f'{path}: {len(content)} bytes')
+
+        if kwargs['keep']:
+            self.prune(directory, revision, kwargs['keep'])
+        self.stdout.write(self.style.SUCCESS(f'OpenAPI schema of revision {revision} generated'))
+
+    def prune(self, directory, revision, keep):
+        # newest first, the current revision always stays
+        names = sorted(
+            (name for name in os.listdir(directory) if name.startswith('openapi-')),
+            key=lambda name: os.path.getmtime(os.path.join(directory, name)), reverse=True,
+        )
+        revisions = []
+        for name in names:
+            name_revision = name[len('openapi-'):].rsplit('.', 1)[0]
+            if name_revision not in revisions:
+                revisions.append(name_revision)
+            if name_revision != revision and revisions.index(name_revision) > keep:
+                os.remove(os.path.join(directory, name))
@@ -1,9 +1,7 @@
 from django.core.management.base import BaseCommand
 # from django.contrib.settings import boto3
 from django.conf import settings
-import boto3
 import os
-s3 = boto3.client('s3')
 
 
 class Command(BaseCommand):
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+import asyncio
+import time
+
+
+class Command(BaseCommand):
+    help = ('run the atomicloops.loadtest scenarios against a running server and compare p50/p95/p99 and '
+            'throughput per endpoint to the stored baselines, exits non zero on a regression')
+
+    def add_arguments(self, parser):
+        from atomicloops.loadtest.report import BASELINES, DEFAULT_TOLERANCE
+        from atomicloops.loadtest.scenarios import SCENARIOS
+        parser.add_argument('--url', default='http://localhost:8000/')
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                            help='Run only this scenario, repeatable, default all')
+        parser.add_argument('--requests', type=int, default=100, help='Iterations of every scenario')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--tasks', type=int, default=500, help='Tasks in the load test company')
+        parser.add_argument('--baselines', default=BASELINES)
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+        parser.add_argument('--save-baselines', action='store_true',
+                            help='Record this run as the new baselines instead of comparing')
+        parser.add_argument('--keep', action='store_true', help='Keep the load test users and tasks afterwards')
+
+    def handle(self, *args, **kwargs):
+        from atomicloops.loadtest import fixtures
+        from atomicloops.loadtest.report import compare, load_baselines, save_baselines
+        from atomicloops.loadtest.scenarios import SCENARIOS
+
+        names = kwargs['scenario'] or list(SCENARIOS)
+        context = fixtures.setup(tasks=kwargs['tasks'])
+        try:
+            results = asyncio.run(self.run(names, context, kwargs))
+        finally:
+            if not kwargs['keep']:
+                fixtures.teardown()
+
+        settings = {key: kwargs[key] for key in ('requests', 'concurrency', 'tasks')}
+        if kwargs['save_baselines']:
+            save_baselines(results, settings, kwargs['baselines'])
+            self.stdout.write(self.style.SUCCESS(f"Baselines saved to {kwargs['baselines']}"))
+            return
+
+        baselines = load_baselines(kwargs['baselines'])
+        if baselines.get('settings', settings) != settings:
+            self.stdout.write(self.style.WARNING(
+                f"Baselines were recorded with {baselines['settings']}, this run uses {settings}"
+            ))
+        regressions = compare(results, baselines, kwargs['tolerance'])
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f'{len(regressions)} regressions against {kwargs["baselines"]}')
+        self.stdout.write(self.style.SUCCESS('No regression against the baselines'))
+
+    async def run(self, names, context, kwargs):
+        from atomicloops.loadtest.client import Client
+        from atomicloops.loadtest.report import summarize
+        from atomicloops.loadtest.scenarios import SCENARIOS
+
+        results = {}
+        for name in names:
+            client = Client(kwargs['url'])
+            semaphore = asyncio.Semaphore(kwargs['concurrency'])
+
+            async def iteration(index):
+                async with semaphore:
+                    await SCENARIOS[name](client, context, index)
+
+            begin = time.monotonic()
+            await asyncio.gather(*[iteration(index) for index in range(kwargs['requests'])])
+            results[name] = summarize(client, time.monotonic() - begin)
+            self.write_results(name, results[name])
+        return results
+
+    def write_results(self, name, endpoints):
+        self.stdout.write(name)
+        for endpoint, stats in endpoints.items():
+            line = (
+                f"  {endpoint:<40} {stats['count']:>5} ok {stats['rps']:>7.1f} req/s "
+                f"p50 {stats['p50'] or 0:>7.1f}ms p95 {stats['p95'] or 0:>7.1f}ms p99 {stats['p99'] or 0:>7.1f}ms"
+            )
+            if stats['errors']:
+                line += f" errors {stats['errors']}"
+            self.stdout.write(line)
@@ -0,0 +1,167 @@
+from django.core.management.base import BaseCommand, CommandError
+import hashlib
+import random
+import statistics
+import time
+import uuid
+
+TABLE = 'task_benchmark'
+
+
+def company_id(index):
+    # same as md5('company' || index)::uuid in the fill query
+    return uuid.UUID(hashlib.md5(f'company{index}'.encode()).hexdigest())
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share / 100))]
+
+
+class Command(BaseCommand):
+    help = ('compare the task table as one heap and hash partitioned by company on a synthetic copy '
+            f'({TABLE}, same columns and indexes): per company list latency, VACUUM after churn, index sizes '
+            'and the backfill rate of partition-tasks. The application tables are not touched')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=50_000_000)
+        parser.add_argument('--companies', type=int, default=10_000)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Larger puts more of the tasks in the first companies, 0 is uniform')
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--samples', type=int, default=200, help='Companies whose task list is timed')
+        parser.add_argument('--churn', type=float, default=2.0, help='Percent of the rows updated before the VACUUM')
+        parser.add_argument('--fill-batch', type=int, default=1_000_000, help='Rows per INSERT while filling')
+        parser.add_argument('--backfill-batch', type=int, default=50_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help=f'Keep {TABLE} and its partitioned copy')
+
+    def handle(self, *args, **kwargs):
+        from django.db import connection
+        from atomicloops import partitioning
+        from tasksaathi.models import Task
+
+        if connection.vendor != 'postgresql':
+            raise CommandError('partitioning needs PostgreSQL')
+        self.quote = connection.ops.quote_name
+        self.column = {field.attname: self.quote(field.column) for field in Task._meta.concrete_fields}
+        shadow = partitioning.shadow_name(TABLE)
+        rng = random.Random(kwargs['seed'])
+        # the largest companies and a random spread of the others
+        samples = sorted({*range(min(10, kwargs['companies'])),
+                          *(rng.randrange(kwargs['companies']) for _ in range(kwargs['samples']))})
+
+        with connection.cursor() as cursor:
+            self.drop(cursor, partitioning)
+            cursor.execute(f'CREATE TABLE {TABLE} (LIKE {self.quote(Task._meta.db_table)} INCLUDING ALL)')
+            self.fill(cursor, kwargs)
+            partitioning.prepare(TABLE, Task._meta.get_field('companyId').column, kwargs['partitions'])
+            # the benchmark writes both layouts itself, the copy is not kept in sync
+            partitioning.drop_sync(cursor, TABLE, self.quote)
+            begin = time.monotonic()
+            for _ in partitioning.backfill(TABLE, kwargs['backfill_batch']):
+                pass
+            backfill = time.monotonic() - begin
+            cursor.execute(f'ANALYZE {TABLE}')
+            children = [name for name, _ in partitioning.partitions(TABLE)]
+            for table in (TABLE, *children):
+                cursor.execute(f'ALTER TABLE {table} SET (autovacuum_enabled = false)')
+
+            results = {}
+            for layout, table in (('heap', TABLE), ('partitioned', shadow)):
+                # the second pass, with what fits of the table cached
+                self.time_lists(cursor, table, samples)
+                results[layout] = {'list': self.time_lists(cursor, table, samples)}
+            self.churn(cursor, shadow, kwargs['churn'])
+            results['heap']['vacuum'] = [self.vacuum(cursor, TABLE)]
+            results['partitioned']['vacuum'] = [self.vacuum(cursor, name) for name in children]
+            results['heap']['index'] = [self.index_size(cursor, TABLE)]
+            results['partitioned']['index'] = [self.index_size(cursor, name) for name in children]
+            if not kwargs['keep']:
+                self.drop(cursor, partitioning)
+
+        self.report(kwargs, results, backfill, len(samples))
+
+    def drop(self, cursor, partitioning):
+        partitioning.drop_sync(cursor, TABLE, self.quote)
+        cursor.execute(f'DROP TABLE IF EXISTS {partitioning.shadow_name(TABLE)}, {TABLE}')
+
+    def fill(self, cursor, kwargs):
+        column = self.column
+        values = {
+            'id': 'gen_random_uuid()',
+            'createdAt': "now() - random() * interval '365 days'",
+            'updatedAt': 'now()',
+            'title': "'Task ' || n",
+            'description': "''",
+            'status': "(ARRAY['pending', 'in_progress', 'completed'])[1 + mod(n, 3)]",
+            'priority': "(ARRAY['low', 'medium', 'high'])[1 + mod(mod(n, 7), 3)]",
+            'dueDate': 'NULL',
+            'assignedTo_id': "md5('employee' || c || ':' || mod(n, 50))::uuid",
+            'createdBy_id': "md5('employer' || c)::uuid",
+            'companyId_id': "md5('company' || c)::uuid",
+        }
+        begin = time.monotonic()
+        for start in range(0, kwargs['tasks'], kwargs['fill_batch']):
+            stop = min(start + kwargs['fill_batch'], kwargs['tasks'])
+            cursor.execute(
+                f"INSERT INTO {TABLE} ({', '.join(column[name] for name in values)}) "
+                f"SELECT {', '.join(values.values())} "
+                f"FROM (SELECT n, floor(%s * power(random(), %s))::int AS c FROM generate_series(%s, %s) n) rows",
+                [kwargs['companies'], 1 + kwargs['skew'], start, stop - 1]
+            )
+            self.stdout.write(f'{stop} rows in {time.monotonic() - begin:.0f}s')
+
+    def time_lists(self, cursor, table, samples):
+        """ms per company for what the task list runs: the count and the first page."""
+        company = self.column['companyId_id']
+        timings = []
+        for index in samples:
+            begin = time.perf_counter()
+            cursor.execute(f'SELECT count(*) FROM {table} WHERE {company} = %s', [company_id(index)])
+            cursor.fetchall()
+            cursor.execute(f'SELECT * FROM {table} WHERE {company} = %s LIMIT 10', [company_id(index)])
+            cursor.fetchall()
+            timings.append((time.perf_counter() - begin) * 1000)
+        return timings
+
+    def churn(self, cursor, shadow, percent):
+        """The same status changes on both layouts, leaving dead rows for the VACUUM."""
+        column = self.column
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE churn AS SELECT {column['id']} AS id, {column['companyId_id']} AS company "
+            f"FROM {TABLE} TABLESAMPLE BERNOULLI (%s)",
+            [percent]
+        )
+        for table in (TABLE, shadow):
+            cursor.execute(
+                f"UPDATE {table} SET {column['status']} = 'completed', {column['updatedAt']} = now() FROM churn "
+                f"WHERE {table}.{column['id']} = churn.id AND {table}.{column['companyId_id']} = churn.company"
+            )
+        cursor.execute('DROP TABLE churn')
+
+    def vacuum(self, cursor, table):
+        begin = time.perf_counter()
+        cursor.execute(f'VACUUM {table}')
+        return time.perf_counter() - begin
+
+    def index_size(self, cursor, table):
+        cursor.execute('SELECT pg_indexes_size(%s::regclass)', [table])
+        return cursor.fetchone()[0]
+
+    def report(self, kwargs, results, backfill, samples):
+        self.stdout.write(
+            f"\n{kwargs['tasks']} tasks, {kwargs['companies']} companies, {kwargs['partitions']} partitions, "
+            f"backfill {kwargs['tasks'] / backfill:.0f} rows/s"
+        )
+        self.stdout.write(f"{'':<12} {'list p50':>9} {'list p95':>9} {'vacuum':>9} {'vacuum max':>11} {'indexes':>9}")
+        for layout, result in results.items():
+            self.stdout.write(
+                f"{layout:<12} {statistics.median(result['list']):8.2f}ms {percentile(result['list'], 95):8.2f}ms "
+                f"{sum(result['vacuum']):8.2f}s {max(result['vacuum']):10.2f}s "
+                f"{sum(result['index']) / 2 ** 20:7.0f}MB"
+            )
+        self.stdout.write(
+            f"list: count and first page of {samples} companies. vacuum: after updating {kwargs['churn']}% of the rows, "
+            f"the whole table, vacuum max: the largest single VACUUM, what autovacuum runs at once"
+        )
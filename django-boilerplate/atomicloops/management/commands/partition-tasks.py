@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+ACTIONS = ('status', 'prepare', 'backfill', 'swap', 'abort', 'drop-old')
+
+
+class Command(BaseCommand):
+    help = ('move a table to PostgreSQL hash partitioning by one of its foreign keys while the application keeps '
+            'running: prepare creates the partitioned copy and a trigger mirroring writes, backfill copies the rows '
+            'in batches, swap puts the copy in place, drop-old drops the original once you are done with it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=ACTIONS)
+        parser.add_argument('--model', default='tasksaathi.Task', help='app_label.Model of the table to partition')
+        parser.add_argument('--key', default='companyId', help='Field whose hash picks the partition')
+        parser.add_argument('--partitions', type=int, default=16, help='Number of hash partitions (prepare)')
+        parser.add_argument('--batch-size', type=int, default=50000, help='Rows per backfill transaction')
+        parser.add_argument('--after', help='Resume the backfill after this primary key')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds between backfill batches, to go easy on replicas')
+        parser.add_argument('--no-verify', action='store_true', help='Swap without comparing the row counts')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **kwargs):
+        from django.apps import apps
+        from django.db import connections
+        from atomicloops import partitioning
+
+        model = apps.get_model(kwargs['model'])
+        table = model._meta.db_table
+        key = model._meta.get_field(kwargs['key']).column
+        pk = model._meta.pk.column
+        using = kwargs['database']
+        try:
+            if kwargs['action'] == 'status':
+                with connections[using].cursor() as cursor:
+                    stage = partitioning.get_stage(cursor, table)
+                self.stdout.write(f'{table}: {stage}')
+                for name, rows in partitioning.partitions(table, using=using):
+                    self.stdout.write(f'  {name:<30} ~{rows} rows')
+            elif kwargs['action'] == 'prepare':
+                partitioning.prepare(table, key, kwargs['partitions'], pk=pk, using=using)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{partitioning.shadow_name(table)} created with {kwargs['partitions']} partitions by {key}, "
+                    f"writes to {table} are mirrored, run backfill next"
+                ))
+            elif kwargs['action'] == 'backfill':
+                self.backfill(partitioning, table, pk, using, kwargs)
+            elif kwargs['action'] == 'swap':
+                partitioning.swap(table, verify=not kwargs['no_verify'], using=using)
+                self.stdout.write(self.style.SUCCESS(
+                    f'{table} is partitioned, the original is kept as {partitioning.old_name(table)} '
+                    f'(no longer written to), remove it with drop-old'
+                ))
+            elif kwargs['action'] == 'abort':
+                partitioning.abort(table, using=using)
+                self.stdout.write(self.style.SUCCESS(f'{partitioning.shadow_name(table)} dropped'))
+            else:
+                partitioning.drop_old(table, using=using)
+                self.stdout.write(self.style.SUCCESS(f'{partitioning.old_name(table)} dropped'))
+        except partitioning.PartitioningError as e:
+            raise CommandError(str(e))
+
+    def backfill(self, partitioning, table, pk, using, kwargs):
+        begin = time.monotonic()
+        total = 0
+        for copied, last in partitioning.backfill(table, kwargs['batch_size'], kwargs['after'], pk=pk, using=using):
+            total += copied
+            self.stdout.write(f'{total} rows copied, {total / (time.monotonic() - begin):.0f} rows/s, last {pk} {last}')
+            if kwargs['sleep']:
+                time.sleep(kwargs['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Backfill of {table} done in {time.monotonic() - begin:.1f}s, run swap next'))
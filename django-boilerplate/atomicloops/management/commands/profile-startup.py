@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Run in a fresh interpreter, phase by phase, so every import is a cold one
+PHASES = '''
+import json, os, sys, time
+phases = {}
+begin = time.perf_counter()
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+phases['settings'] = time.perf_counter() - begin
+django.setup()
+phases['apps'] = time.perf_counter() - begin - sum(phases.values())
+if 'urls' in sys.argv:
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    phases['urls'] = time.perf_counter() - begin - sum(phases.values())
+if 'celery' in sys.argv:
+    from src.celery import app
+    app.loader.import_default_modules()
+    phases['celery'] = time.perf_counter() - begin - sum(phases.values())
+print(json.dumps(phases))
+'''
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from `python -X importtime` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+class Command(BaseCommand):
+    help = ('measure cold start: time of each startup phase (settings, app registry, urlconf, celery tasks) '
+            'and the slowest imports by cumulative time, like python -X importtime')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['web', 'command', 'celery'], default='web',
+                            help='web loads the urlconf too, celery imports the task modules, command only sets up')
+        parser.add_argument('--runs', type=int, default=3, help='Cold starts measured, the median is reported')
+        parser.add_argument('--top', type=int, default=25, help='Slowest imports listed')
+        parser.add_argument('--module', action='append', default=[],
+                            help='Only list imports under this package, can be repeated')
+
+    def handle(self, *args, **kwargs):
+        extra = {'web': ['urls'], 'command': [], 'celery': ['celery']}[kwargs['target']]
+        command = [sys.executable, '-X', 'importtime', '-c', PHASES, *extra]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ['DJANGO_SETTINGS_MODULE']}
+        runs = []
+        for _ in range(kwargs['runs']):
+            process = subprocess.run(command, capture_output=True, text=True, env=env)
+            if process.returncode:
+                raise CommandError(process.stderr[-2000:])
+            runs.append((json.loads(process.stdout.strip().splitlines()[-1]), parse_importtime(process.stderr)))
+
+        total = statistics.median(sum(phases.values()) for phases, _ in runs)
+        self.stdout.write(f"{kwargs['target']} cold start: {total * 1000:.0f}ms (median of {len(runs)})")
+        for phase in runs[0][0]:
+            seconds = statistics.median(phases[phase] for phases, _ in runs)
+            self.stdout.write(f'  {phase:<10} {seconds * 1000:8.0f}ms')
+
+        # the run closest to the median
+        _, imports = min(runs, key=lambda run: abs(sum(run[0].values()) - total))
+        if kwargs['module']:
+            imports = [item for item in imports
+                       if any(item[0] == name or item[0].startswith(f'{name}.') for name in kwargs['module'])]
+        packages = {}
+        for name, self_us, _, _ in imports:
+            packages[name.split('.')[0]] = packages.get(name.split('.')[0], 0) + self_us
+        self.stdout.write(f"\n{'self':>10}  package")
+        for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:kwargs['top']]:
+            self.stdout.write(f'{self_us / 1000:8.1f}ms  {name}')
+
+        self.stdout.write(f"\n{'cumulative':>12} {'self':>10}  module")
+        for name, self_us, cumulative_us, depth in sorted(imports, key=lambda item: -item[2])[:kwargs['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {"  " * depth}{name}')
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+import random
+import time
+import uuid
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'benchmark the push notification fan out offline with utils.push.FakePushClient, nothing is kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=20000)
+        parser.add_argument('--users', type=int, default=100, help='Devices are spread over this many users')
+        parser.add_argument('--invalid', type=float, default=0.05, help='Share of tokens FCM reports as invalid')
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated seconds per multicast call')
+        parser.add_argument('--workers', type=int, default=4, help='Multicast batches sent concurrently')
+
+    def handle(self, *args, **kwargs):
+        from users.models import Users, UsersDevices
+        from users.notifications import send_notifications
+        from utils.push import get_push_client, reset_push_client
+
+        settings = {
+            'PUSH_BACKEND': 'utils.push.FakePushClient',
+            'PUSH_FAKE_LATENCY': kwargs['latency'],
+            'PUSH_MAX_WORKERS': kwargs['workers'],
+        }
+        reset_push_client()
+        try:
+            with override_settings(**settings), transaction.atomic():
+                users = Users.objects.bulk_create([
+                    Users(email=f'push-benchmark-{uuid.uuid4().hex}@example.com',
+                          firstName='Push', lastName='Benchmark')
+                    for _ in range(kwargs['users'])
+                ])
+                UsersDevices.objects.bulk_create([
+                    UsersDevices(
+                        userId=users[index % len(users)],
+                        deviceId=f'device-{index}',
+                        token=('invalid-' if random.random() < kwargs['invalid'] else 'token-') + uuid.uuid4().hex,
+                        deviceType='android',
+                        language=random.choice(['en', 'fr']),
+                    )
+                    for index in range(kwargs['devices'])
+                ], batch_size=2000)
+
+                messages = {'en': ('Benchmark', 'Hello'), 'fr': ('Benchmark', 'Bonjour')}
+                begin = time.monotonic()
+                stats = send_notifications([([user.id for user in users], messages, {'event': 'benchmark'})])
+                seconds = time.monotonic() - begin
+                remaining = UsersDevices.objects.filter(userId__in=users).count()
+
+                self.stdout.write(
+                    f"{kwargs['devices']} devices in {stats['batches']} multicasts "
+                    f"({len(get_push_client().sent)} sent by the fake client) in {seconds:.2f}s, "
+                    f"{kwargs['devices'] / seconds:.0f} devices/s"
+                )
+                self.stdout.write(
+                    f"sent {stats['sent']}, invalid {stats['invalid-token']} (pruned, "
+                    f"{remaining} devices left), failed {stats['failed']}"
+                )
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            reset_push_client()
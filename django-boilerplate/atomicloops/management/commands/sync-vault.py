@@ -1,13 +1,11 @@
 from django.conf import settings
-import boto3
 import datetime
 import os
 from src import vault
 from django.core.management.base import BaseCommand
+from utils.storage import get_storage
 import json
 
-s3 = boto3.client("s3", region_name=settings.REGION, aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-
 
 # validate-setup
 class Command(BaseCommand):
@@ -33,12 +31,10 @@ class Command(BaseCommand):
             content = "credentials = %s" % credentials
             f.write(content)
         time = str(datetime.datetime.now()).split(".")[0].replace(' ', '-')
-        s3.upload_file(
+        url = get_storage().upload_file(
             "tmp",
-            settings.S3_BUCKET,
             f"vault/vault_{time}.py",
-            ExtraArgs={'ACL': 'public-read'})
-        url = os.path.join(settings.AWS_URL, f"vault/vault_{time}.py")
+            extra_args={'ACL': 'public-read'})
         os.remove('tmp')
         print("File uploaded successfully")
         print("This is the new vault url :")
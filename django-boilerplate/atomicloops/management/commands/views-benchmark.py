@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand, CommandError
+from urllib.parse import urlsplit
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+SCENARIOS = ('upload-profile', 'register')
+
+
+class Command(BaseCommand):
+    help = ('requests per second of the I/O bound views against a running server, run it once against '
+            'the WSGI workers and once against the uvicorn workers on the same machine to compare')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/')
+        parser.add_argument('--email', required=True, help='Existing user, upload-profile authenticates as them')
+        parser.add_argument('--scenario', choices=SCENARIOS, default='upload-profile')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **kwargs):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from users.models import Users
+
+        user = Users.objects.filter(email=kwargs['email']).first()
+        if user is None:
+            raise CommandError('No user with email %s' % kwargs['email'])
+        url = urlsplit(kwargs['url'])
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip('/')
+        self.token = str(AccessToken.for_user(user))
+        asyncio.run(self.run(kwargs))
+        if kwargs['scenario'] == 'register':
+            Users.objects.filter(email__startswith='views-benchmark-').delete()
+
+    async def run(self, kwargs):
+        semaphore = asyncio.Semaphore(kwargs['concurrency'])
+        begin = time.monotonic()
+        results = await asyncio.gather(*[
+            self.send(semaphore, kwargs['scenario']) for _ in range(kwargs['requests'])
+        ])
+        seconds = time.monotonic() - begin
+        latencies = sorted(latency for status, latency in results if 200 <= status < 300)
+        failures = [status for status, _ in results if not 200 <= status < 300]
+        self.stdout.write(
+            f"{kwargs['scenario']}: {len(latencies)}/{kwargs['requests']} ok in {seconds:.2f}s, "
+            f"{len(latencies) / seconds:.1f} requests/s at concurrency {kwargs['concurrency']}"
+        )
+        if latencies:
+            self.stdout.write(
+                f"latency p50 {percentile(latencies, 50):.0f}ms p95 {percentile(latencies, 95):.0f}ms "
+                f"max {latencies[-1]:.0f}ms"
+            )
+        if failures:
+            self.stdout.write(self.style.WARNING(f"{len(failures)} failed, statuses {sorted(set(failures))}"))
+
+    def build(self, scenario):
+        if scenario == 'register':
+            body = json.dumps({
+                'email': f'views-benchmark-{uuid.uuid4().hex}@example.com', 'password': uuid.uuid4().hex,
+                'firstName': 'Views', 'lastName': 'Benchmark',
+            }).encode()
+            return 'register/', 'application/json', body, {}
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="image.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + b'\xff\xd8' + b'\0' * 20000 + f'\r\n--{boundary}--\r\n'.encode()
+        content_type = f'multipart/form-data; boundary={boundary}'
+        return 'users/upload-profile/', content_type, body, {'Authorization': f'Bearer {self.token}'}
+
+    async def send(self, semaphore, scenario):
+        path, content_type, body, headers = self.build(scenario)
+        head = ''.join(f'{name}: {value}\r\n' for name, value in {
+            'Host': self.host,
+            'Content-Type': content_type,
+            'Content-Length': len(body),
+            'Connection': 'close',
+            **headers,
+        }.items())
+        async with semaphore:
+            begin = time.monotonic()
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                writer.write(f'POST {self.prefix}/{path} HTTP/1.1\r\n{head}\r\n'.encode() + body)
+                await writer.drain()
+                response = await asyncio.wait_for(reader.read(), timeout=60)
+                writer.close()
+            except (OSError, asyncio.TimeoutError):
+                return 0, None
+            return int(response.split(b' ', 2)[1]), (time.monotonic() - begin) * 1000
+
+
+def percentile(values, pct):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
@@ -1,5 +1,7 @@
 import re
 import json
+import time
+from django.conf import settings
 from django.db import connection
 from django.http import QueryDict, HttpResponse
 from django.http.multipartparser import MultiPartParser
@@ -84,3 +86,39 @@ class QueryCountMiddleware:
         with open('logs/query_count.txt', 'a+') as f:
             f.write(f"{request.path} {request.method} {query_count} \n")
         return response
+
+
+class ApiLogMiddleware:
+    """Queues every sampled request for atomicloops.apilog, the writes happen on its flush thread."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from atomicloops.apilog import log_request
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        log_request(request, response, time.perf_counter() - start)
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    After a successful write request, keep the user's reads on the primary for
+    DATABASE_REPLICA_STICKY_SECONDS so they see their own writes (atomicloops.routers).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and settings.DATABASE_REPLICAS:
+            # DRF sets the token authenticated user on the request too
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                from atomicloops.routers import pin_to_primary
+
+                pin_to_primary(user.pk)
+        return response
@@ -20,3 +20,25 @@ class ATL_TIMESTAMP(models.Model):
 
     class Meta:
         abstract = True
+
+
+# API request log, written in batches by atomicloops.apilog. Unmanaged: DatabaseApiLogBackend
+# creates the table, partitioned by day on PostgreSQL, in API_LOG_DATABASE
+class ApiLog(models.Model):
+    id = models.UUIDField(verbose_name=_('Id'), primary_key=True, db_column="id", default=uuid.uuid4)
+    createdAt = models.DateTimeField(verbose_name=_('Create Date'), db_column='created_at', db_index=True)
+    method = models.CharField(max_length=10, db_column='method')
+    path = models.CharField(max_length=1024, db_column='path')
+    urlName = models.CharField(max_length=255, null=True, db_column='url_name')
+    statusCode = models.SmallIntegerField(db_column='status_code')
+    durationMs = models.FloatField(db_column='duration_ms')
+    userId = models.UUIDField(null=True, db_column='user_id')
+    clientIp = models.CharField(max_length=50, db_column='client_ip')
+    headers = models.TextField(db_column='headers')
+    body = models.TextField(db_column='body')
+    response = models.TextField(db_column='response')
+
+    class Meta:
+        managed = False
+        db_table = 'api_log'
+        ordering = ['-createdAt']
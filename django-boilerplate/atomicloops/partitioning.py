@@ -0,0 +1,262 @@
+# Online migration of a table to PostgreSQL hash partitioning, see `python manage.py partition-tasks`
+import re
+from django.db import connections, transaction
+
+NAME_LIMIT = 63  # PostgreSQL identifier length
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def shadow_name(table):
+    """Partitioned copy of `table` filled while the application keeps using `table`."""
+    return f'{table}_partitioned'
+
+
+def old_name(table):
+    """What `table` is renamed to when the partitioned copy takes its place."""
+    return f'{table}_unpartitioned'
+
+
+def partition_name(table, remainder):
+    return f'{table}_p{remainder}'
+
+
+def sync_name(table):
+    return f'{table}_partition_sync'
+
+
+def suffixed(name, suffix):
+    return f'{name[:NAME_LIMIT - len(suffix)]}{suffix}'
+
+
+def with_column(definition, column):
+    """`definition` ("PRIMARY KEY (id)", "CREATE UNIQUE INDEX ... (a) ...") with `column` added to its column list."""
+    start = definition.index('(')
+    depth = 0
+    for end in range(start, len(definition)):
+        depth += {'(': 1, ')': -1}.get(definition[end], 0)
+        if depth == 0:
+            break
+    columns = [name.strip() for name in definition[start + 1:end].split(',')]
+    if column in columns or column.strip('"') in columns:
+        return definition
+    return f'{definition[:end]}, {column}{definition[end:]}'
+
+
+def table_objects(cursor, table):
+    """
+    ([(name, definition)] of the indexes of `table` backing no constraint,
+     [(name, type, definition)] of its primary key, unique and foreign key constraints).
+    """
+    cursor.execute(
+        'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid '
+        'WHERE x.indrelid = %s::regclass AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid) '
+        'ORDER BY i.relname',
+        [table]
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f') ORDER BY conname",
+        [table]
+    )
+    return indexes, cursor.fetchall()
+
+
+def get_stage(cursor, table):
+    """'unpartitioned', 'migrating' (the partitioned copy is being filled) or 'partitioned'."""
+    cursor.execute(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)), '
+        'to_regclass(%s) IS NOT NULL',
+        [table, shadow_name(table)]
+    )
+    partitioned, migrating = cursor.fetchone()
+    if partitioned:
+        return 'partitioned'
+    return 'migrating' if migrating else 'unpartitioned'
+
+
+def check_postgresql(connection):
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('declarative partitioning needs PostgreSQL')
+
+
+def prepare(table, key, partitions, pk='id', using='default'):
+    """
+    Create the hash partitioned copy of `table` with `partitions` partitions by `key` and a
+    trigger mirroring every write to `table` into it. Unique constraints, the primary key
+    included, get `key` added: PostgreSQL only enforces uniqueness within a partition, so the
+    primary key becomes (pk, key). Django keeps using `pk` alone, uuid4 ids don't collide.
+    """
+    connection = connections[using]
+    check_postgresql(connection)
+    quote = connection.ops.quote_name
+    shadow = shadow_name(table)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        # pending deferred foreign key checks would block the DDL on `table`
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        stage = get_stage(cursor, table)
+        if stage != 'unpartitioned':
+            raise PartitioningError(f'{table} is already {stage}')
+        cursor.execute(
+            f'CREATE TABLE {quote(shadow)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+            f'INCLUDING STORAGE) PARTITION BY HASH ({quote(key)})'
+        )
+        for remainder in range(partitions):
+            cursor.execute(
+                f'CREATE TABLE {quote(partition_name(table, remainder))} PARTITION OF {quote(shadow)} '
+                f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+            )
+
+        # objects get temporary names, swap() gives them the original ones
+        indexes, constraints = table_objects(cursor, table)
+        for name, kind, definition in constraints:
+            if kind in ('p', 'u'):
+                definition = with_column(definition, quote(key))
+            cursor.execute(
+                f'ALTER TABLE {quote(shadow)} ADD CONSTRAINT {quote(suffixed(name, "_new"))} {definition}'
+            )
+        for name, definition in indexes:
+            match = re.match(r'CREATE (UNIQUE )?INDEX \S+ ON \S+ (USING .*)$', definition)
+            unique, rest = match.groups()
+            if unique:
+                rest = with_column(rest, quote(key))
+            cursor.execute(f'CREATE {unique or ""}INDEX {quote(suffixed(name, "_new"))} ON {quote(shadow)} {rest}')
+
+        # an update deletes the old version first, the key may have changed and moved the row
+        cursor.execute(f'''
+            CREATE FUNCTION {quote(sync_name(table))}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP <> 'INSERT' THEN
+                    DELETE FROM {quote(shadow)} WHERE {quote(pk)} = OLD.{quote(pk)} AND {quote(key)} = OLD.{quote(key)};
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    INSERT INTO {quote(shadow)} VALUES (NEW.*) ON CONFLICT DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END $$
+        ''')
+        cursor.execute(
+            f'CREATE TRIGGER {quote(sync_name(table))} AFTER INSERT OR UPDATE OR DELETE ON {quote(table)} '
+            f'FOR EACH ROW EXECUTE FUNCTION {quote(sync_name(table))}()'
+        )
+
+
+def backfill(table, batch_size, after=None, pk='id', using='default'):
+    """
+    Copy the rows of `table` into its partitioned copy in `pk` order, one transaction per batch.
+    Yields (rows copied, last pk) after each batch, pass the last pk as `after` to resume.
+    Rows are read FOR SHARE: a concurrent update waits for the batch, then its trigger replaces
+    the copied version, so a row is never copied after its newer version was mirrored.
+    """
+    connection = connections[using]
+    check_postgresql(connection)
+    quote = connection.ops.quote_name
+    while True:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            if get_stage(cursor, table) != 'migrating':
+                raise PartitioningError(f'{table} has no partitioned copy being filled, run prepare first')
+            lower, params = (f'WHERE {quote(pk)} > %s', [after]) if after is not None else ('', [])
+            cursor.execute(
+                f'SELECT {quote(pk)} FROM {quote(table)} {lower} ORDER BY {quote(pk)} OFFSET %s LIMIT 1',
+                params + [batch_size - 1]
+            )
+            row = cursor.fetchone()
+            upper = row[0] if row else None
+            conditions = ([f'{quote(pk)} > %s'] if after is not None else []) + (
+                [f'{quote(pk)} <= %s'] if upper is not None else []
+            )
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            cursor.execute(
+                f'INSERT INTO {quote(shadow_name(table))} SELECT * FROM {quote(table)} {where} FOR SHARE '
+                f'ON CONFLICT DO NOTHING',
+                params + ([upper] if upper is not None else [])
+            )
+            copied = cursor.rowcount
+        if upper is None:
+            with connection.cursor() as cursor:
+                # planner statistics for the swap, autovacuum doesn't analyze partitioned parents
+                cursor.execute(f'ANALYZE {quote(shadow_name(table))}')
+            yield copied, after
+            return
+        after = upper
+        yield copied, after
+
+
+def drop_sync(cursor, table, quote):
+    cursor.execute(f'DROP TRIGGER IF EXISTS {quote(sync_name(table))} ON {quote(table)}')
+    cursor.execute(f'DROP FUNCTION IF EXISTS {quote(sync_name(table))}()')
+
+
+def swap(table, verify=True, using='default'):
+    """
+    Put the partitioned copy in place of `table`, which is kept as old_name(table) without its
+    foreign keys until drop_old(). `table` is locked for the swap; with `verify` both row counts
+    are compared first and nothing changes when they differ.
+    """
+    connection = connections[using]
+    check_postgresql(connection)
+    quote = connection.ops.quote_name
+    shadow = shadow_name(table)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        if get_stage(cursor, table) != 'migrating':
+            raise PartitioningError(f'{table} has no partitioned copy to swap in, run prepare and backfill first')
+        cursor.execute(f'LOCK TABLE {quote(table)}, {quote(shadow)} IN ACCESS EXCLUSIVE MODE')
+        if verify:
+            cursor.execute(f'SELECT (SELECT count(*) FROM {quote(table)}), (SELECT count(*) FROM {quote(shadow)})')
+            rows, copied = cursor.fetchone()
+            if rows != copied:
+                raise PartitioningError(f'{copied} of {rows} rows copied, run backfill again')
+        drop_sync(cursor, table, quote)
+
+        indexes, constraints = table_objects(cursor, table)
+        for name, kind, _ in constraints:
+            if kind == 'f':
+                # the stale copy must not block deleting the rows it points at
+                cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}')
+            else:
+                cursor.execute(f'ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(name)} TO {quote(suffixed(name, "_old"))}')
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX {quote(name)} RENAME TO {quote(suffixed(name, "_old"))}')
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old_name(table))}')
+        cursor.execute(f'ALTER TABLE {quote(shadow)} RENAME TO {quote(table)}')
+        for name, _, _ in constraints:
+            cursor.execute(f'ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(suffixed(name, "_new"))} TO {quote(name)}')
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX {quote(suffixed(name, "_new"))} RENAME TO {quote(name)}')
+
+
+def abort(table, using='default'):
+    """Drop the partitioned copy and its trigger before the swap, `table` is left as it was."""
+    connection = connections[using]
+    check_postgresql(connection)
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if get_stage(cursor, table) != 'migrating':
+            raise PartitioningError(f'{table} is not being migrated')
+        drop_sync(cursor, table, quote)
+        cursor.execute(f'DROP TABLE {quote(shadow_name(table))}')
+
+
+def drop_old(table, using='default'):
+    connection = connections[using]
+    check_postgresql(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(old_name(table))}')
+
+
+def partitions(table, using='default'):
+    """[(partition, rows estimate)] of `table`, or of its partitioned copy while migrating."""
+    connection = connections[using]
+    check_postgresql(connection)
+    with connection.cursor() as cursor:
+        parent = shadow_name(table) if get_stage(cursor, table) == 'migrating' else table
+        cursor.execute(
+            'SELECT c.relname, greatest(c.reltuples, 0)::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname',
+            [parent]
+        )
+        return cursor.fetchall()
@@ -1,6 +1,46 @@
+from django.apps import apps
+from django.conf import settings
+from django.utils.functional import cached_property
 from rest_framework import permissions
-# from django.conf import settings
-import sys
+
+
+class Principal:
+    """
+    Who a request acts as: user id, role and company id, read once per request (get_principal).
+    Permissions compare these ids with the foreign key attributes of the rows (`userId_id`,
+    `companyId_id`) instead of loading the related rows, and viewsets filter their querysets
+    with them (AtomicViewSet.scope_queryset) so lists and bulk actions are authorized in SQL.
+    """
+
+    def __init__(self, user):
+        self.userId = user.pk if user and user.is_authenticated else None
+        self.role = getattr(user, 'userRole', None)
+        self.isSuperuser = bool(getattr(user, 'is_superuser', False))
+
+    @cached_property
+    def companyId(self):
+        """Id of the company the user owns (PRINCIPAL_COMPANY_MODEL), one query on first use."""
+        if self.userId is None:
+            return None
+        model = apps.get_model(settings.PRINCIPAL_COMPANY_MODEL)
+        return model.objects.filter(userId_id=self.userId).values_list('id', flat=True).order_by('pk').first()
+
+    def is_user(self, user):
+        return self.userId is not None and user.pk == self.userId
+
+    def owns(self, obj, field='userId'):
+        return self.userId is not None and getattr(obj, f'{field}_id', None) == self.userId
+
+    def __repr__(self):
+        return f'<Principal userId={self.userId} role={self.role} isSuperuser={self.isSuperuser}>'
+
+
+def get_principal(request):
+    """The request's Principal, built on first use and kept on the request."""
+    principal = getattr(request, '_principal', None)
+    if principal is None or principal.userId != getattr(request.user, 'pk', None):
+        principal = request._principal = Principal(request.user)
+    return principal
 
 
 class UsersPermission(permissions.BasePermission):
@@ -13,19 +53,9 @@ class UsersPermission(permissions.BasePermission):
 
         if request.method == "POST":
             return True
-        # Instance must have an attribute named email
-        try:
-            authorize = request.user.email == obj.email or request.user.is_superuser
-            if authorize:
-                return True
-            else:
-                False
-        except:
-            _ = sys.exc_info()[0]
-            # with open(settings.exception_error_file, "a") as f:
-            #     f.write(str(e) + "\n")
-            #     f.close()
-            return False
+        # obj is a user
+        principal = get_principal(request)
+        return principal.isSuperuser or principal.is_user(obj)
 
 
 class IsOwnerOrAdminOrReadOnly(permissions.BasePermission):
@@ -36,13 +66,6 @@ class IsOwnerOrAdminOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        # Instance must have an attribute named email
-        try:
-            authorize = request.user.email == obj.userId.email or request.user.is_superuser
-            if authorize:
-                return True
-            else:
-                False
-        except:
-            _ = sys.exc_info()[0]
-            return False
+        # Instance must have a userId foreign key, compared by id without loading the user
+        principal = get_principal(request)
+        return principal.isSuperuser or principal.owns(obj)
@@ -0,0 +1,95 @@
+from importlib import import_module
+from typing import NamedTuple
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# Rows the budget suites create per table, budgets hold for this many rows
+QUERY_BUDGET_ROWS = 20
+
+
+class QueryBudget(NamedTuple):
+    """Most queries and database time (ms) one request to an action may use with QUERY_BUDGET_ROWS rows."""
+    queries: int
+    time: float = 100
+
+
+class RouteAction(NamedTuple):
+    basename: str
+    viewset: type
+    method: str
+    action: str
+    name: str
+    detail: bool
+
+
+def get_query_budget(viewset, action):
+    """Budget of `action` from the `query_budgets` of the viewset or its bases, None if none declares one."""
+    for klass in viewset.__mro__:
+        budget = vars(klass).get('query_budgets', {}).get(action)
+        if budget is not None:
+            return budget
+    return None
+
+
+def router_routes(*urlconfs):
+    """Every (method, action) registered on the `router` of the given urlconf modules."""
+    for urlconf in urlconfs:
+        router = import_module(urlconf).router
+        for _, viewset, basename in router.registry:
+            for route in router.get_routes(viewset):
+                for method, action in route.mapping.items():
+                    if hasattr(viewset, action):
+                        yield RouteAction(
+                            basename, viewset, method, action, route.name.format(basename=basename), route.detail
+                        )
+
+
+class QueryBudgetMixin:
+    """
+    APITestCase mixin calling every router route of `urlconfs` once and failing when an action
+    has no budget or goes over it. The test class creates QUERY_BUDGET_ROWS rows, authenticates
+    in setUp and gives request bodies in route_request. Every call is rolled back.
+    """
+    urlconfs = ()
+    # (basename, action) -> status the call is expected to answer, when it isn't a success
+    expected_status = {}
+
+    def route_object(self, route):
+        """Object detail routes are called with."""
+        return route.viewset.queryset.model.objects.order_by('createdAt').first()
+
+    def route_request(self, route, instance):
+        """Extra APIClient arguments, e.g. data and format, for a call to `route`."""
+        return {}
+
+    def call_route(self, route):
+        instance = self.route_object(route) if route.detail else None
+        url = reverse(route.name, kwargs={'pk': instance.pk} if route.detail else None)
+        call = getattr(self.client, route.method)
+        with CaptureQueriesContext(connection) as queries:
+            response = call(url, HTTP_HOST='localhost', **self.route_request(route, instance))
+            if response.streaming:
+                # streamed rows are read while the body is sent
+                response = HttpResponse(b''.join(response.streaming_content), status=response.status_code)
+        return response, queries
+
+    def assert_query_budgets(self):
+        for route in router_routes(*self.urlconfs):
+            with self.subTest(route=route.name, method=route.method, action=route.action):
+                budget = get_query_budget(route.viewset, route.action)
+                self.assertIsNotNone(budget, f'{route.viewset.__name__}.{route.action} declares no query budget')
+                with transaction.atomic():
+                    response, queries = self.call_route(route)
+                    transaction.set_rollback(True)
+
+                expected = self.expected_status.get((route.basename, route.action))
+                if expected is None:
+                    self.assertLess(response.status_code, 400, response.content[:500])
+                else:
+                    self.assertEqual(response.status_code, expected, response.content[:500])
+                sql = '\n'.join(query['sql'] for query in queries)
+                self.assertLessEqual(len(queries), budget.queries, f'{len(queries)} queries:\n{sql}')
+                elapsed = sum(float(query['time']) for query in queries) * 1000
+                self.assertLessEqual(elapsed, budget.time, f'{elapsed:.1f}ms of queries:\n{sql}')
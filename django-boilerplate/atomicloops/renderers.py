@@ -8,7 +8,7 @@ class AtomicJsonRenderer(JSONRenderer):
             # status_codes = [200, 201, 204, 205]
             if renderer_context['response'].status_code in [200, 201, 205]:
                 data = {'data': data, "error": {}, "isSuccess": True}
-            elif renderer_context['response'].status_code == 204:
+            elif renderer_context['response'].status_code in [204, 304]:
                 return super(AtomicJsonRenderer, self).render(data, accepted_media_type, renderer_context)
             else:
                 if "message" not in data:
@@ -0,0 +1,74 @@
+# Read replicas: DATABASE_REPLICAS aliases serve the reads of safe viewset actions and of
+# reporting jobs, everything else stays on the primary (default)
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Alias reads go to in the current request or task, None for the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def get_replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def read_from_replica():
+    """Send the following reads of this context to a replica, returns the token for reset_reads()."""
+    replicas = get_replicas()
+    return _read_alias.set(random.choice(replicas) if replicas else None)
+
+
+def reset_reads(token):
+    _read_alias.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    """Reads in the block go to a replica, writes stay on the primary."""
+    token = read_from_replica()
+    try:
+        yield _read_alias.get()
+    finally:
+        reset_reads(token)
+
+
+def pin_key(user_id):
+    return f'db-primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Keep the user's reads on the primary for DATABASE_REPLICA_STICKY_SECONDS, replicas may lag their writes."""
+    cache.set(pin_key(user_id), True, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user_id):
+    return bool(cache.get(pin_key(user_id)))
+
+
+class ReplicaRouter:
+    """
+    Reads go to the alias set by replica_reads()/read_from_replica(), the primary otherwise.
+    Writes always go to the primary, also for objects that were read from a replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related objects come from where the instance came from
+            return None
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_replicas():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.templatetags.static import static
+
+# Directories of BASE_DIR that hold no code, skipped by the source hash
+NON_CODE_DIRS = {'logs', 'staticfiles', 'storage', 'db_backup', 'docs', 'config', '__pycache__'}
+
+
+@lru_cache(maxsize=None)
+def code_revision():
+    """
+    CODE_REVISION (the deployed commit, set by the deploy), else a hash of the python sources,
+    which changes with any code change that can change the schema.
+    """
+    if settings.CODE_REVISION:
+        return settings.CODE_REVISION
+    digest = hashlib.blake2b(digest_size=6)
+    for root, dirs, files in os.walk(settings.BASE_DIR):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.') and name not in NON_CODE_DIRS)
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, settings.BASE_DIR).encode())
+                with open(path, 'rb') as source:
+                    digest.update(source.read())
+    return f'src-{digest.hexdigest()}'
+
+
+def schema_artifact(codec_class, revision=None):
+    """Path, relative to STATIC_ROOT, of the generated schema for a codec."""
+    from drf_yasg.codecs import OpenAPICodecYaml
+
+    extension = 'yaml' if issubclass(codec_class, OpenAPICodecYaml) else 'json'
+    return f'{settings.SCHEMA_ARTIFACT_DIR}/openapi-{revision or code_revision()}.{extension}'
+
+
+@lru_cache(maxsize=None)
+def artifact_exists(path):
+    # looked up once per process, generate-schema runs before the server starts
+    return os.path.exists(os.path.join(settings.STATIC_ROOT, path))
+
+
+class CachedSchemaViewMixin:
+    """
+    drf_yasg's SchemaView introspects every view and serializer on each request for the spec.
+    Here the spec is the artifact written by `generate-schema` for the running revision, served
+    by whitenoise, or else rendered once per process and revision and kept in memory. The spec
+    is generated without a request, it doesn't depend on who asks (public schema).
+    """
+    schema_info = None
+    schema_url = None
+
+    _rendered = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def render_schema(cls, renderer_class, revision=None):
+        key = (revision or code_revision(), renderer_class)
+        if key not in cls._rendered:
+            with cls._lock:
+                if key not in cls._rendered:
+                    generator = cls.generator_class(cls.schema_info, url=cls.schema_url)
+                    cls._rendered[key] = renderer_class().render(generator.get_schema(None, public=True))
+        return cls._rendered[key]
+
+    @classmethod
+    def reset_schema(cls):
+        cls._rendered.clear()
+        artifact_exists.cache_clear()
+
+    def get(self, request, version='', format=None):
+        from drf_yasg.renderers import _SpecRenderer
+
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, _SpecRenderer):
+            # the swagger/redoc pages only hold the settings, their script fetches the spec
+            return super().get(request, version, format)
+        artifact = schema_artifact(renderer.codec_class)
+        if artifact_exists(artifact):
+            return redirect(static(artifact))
+        return HttpResponse(
+            self.render_schema(type(renderer)), content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+
+
+def get_cached_schema_view(info, url=None, public=True, **kwargs):
+    """get_schema_view() with the spec cached per code revision, see CachedSchemaViewMixin."""
+    from drf_yasg.views import get_schema_view
+
+    assert public, 'only a public schema is the same for every user and can be cached'
+    view = get_schema_view(info, url=url, public=public, **kwargs)
+    return type('CachedSchemaView', (CachedSchemaViewMixin, view), {'schema_info': info, 'schema_url': url})
+
+
+class LazySchemaView:
+    """
+    Stands in for the schema view class returned by `build()` until it is first used. drf_yasg
+    and its spec validators take a good part of a worker's cold start for pages that are rarely hit.
+    """
+
+    def __init__(self, build):
+        self.build = lru_cache(maxsize=None)(build)
+
+    def __getattr__(self, name):
+        return getattr(self.build(), name)
+
+    def with_ui(self, renderer='swagger', cache_timeout=0, cache_kwargs=None):
+        return self.lazy_view('with_ui', renderer, cache_timeout, cache_kwargs)
+
+    def without_ui(self, cache_timeout=0, cache_kwargs=None):
+        return self.lazy_view('without_ui', cache_timeout, cache_kwargs)
+
+    def lazy_view(self, method, *args):
+        @lru_cache(maxsize=None)
+        def get_view():
+            return getattr(self.build(), method)(*args)
+
+        def view(request, *view_args, **view_kwargs):
+            return get_view()(request, *view_args, **view_kwargs)
+
+        # what as_view() sets on an APIView
+        view.csrf_exempt = True
+        return view
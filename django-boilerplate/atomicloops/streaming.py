@@ -0,0 +1,50 @@
+# Streaming downloads of viewset rows (AtomicViewSet.export): the queryset is read through a
+# server side cursor EXPORT_STREAM_CHUNK_SIZE rows at a time, and each chunk is serialized and
+# sent before the next one is read, so memory stays flat whatever the size of the result
+import csv
+import io
+import json
+from itertools import islice
+from rest_framework.utils.encoders import JSONEncoder
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def chunks(queryset, size):
+    """Lists of at most `size` objects of `queryset`, fetched `size` rows at a time."""
+    objects = queryset.iterator(chunk_size=size)
+    while True:
+        chunk = list(islice(objects, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def to_json(value):
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+
+
+def encode_csv(records, fields):
+    """CSV of `records`, chunks of serialized rows, with a header of `fields`. Nested values are JSON."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields, extrasaction='ignore')
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+    for chunk in records:
+        buffer.seek(0)
+        buffer.truncate()
+        for record in chunk:
+            writer.writerow({
+                name: to_json(value) if isinstance(value, (dict, list)) else value
+                for name, value in record.items()
+            })
+        yield buffer.getvalue().encode()
+
+
+def encode_ndjson(records):
+    """One JSON object per line for each serialized row."""
+    for chunk in records:
+        yield ''.join(f'{to_json(record)}\n' for record in chunk).encode()
@@ -1,82 +1,113 @@
 from src.celery import app
+from celery.signals import task_postrun
 import os
 from django.conf import settings
 import csv
 from django.apps import apps
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
 import random
-import boto3
 import string
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from users.serializers import ExportDataSerializer
+from django.core.mail import EmailMultiAlternatives
+from django.utils.html import strip_tags
+from atomicloops.connections import record_served
+from atomicloops.jobs import release
+from atomicloops.routers import replica_reads
+from utils.storage import get_storage
 
 BASE_DIR = settings.BASE_DIR
 
+# worker side of the database connection metrics, connections themselves are recycled between
+# tasks by Celery's Django fixup (close_if_unusable_or_obsolete, so CONN_MAX_AGE applies)
+task_postrun.connect(record_served, dispatch_uid='atomicloops.connections.record_served')
 
-@app.task(bind=True)
+
+@app.task(bind=True, acks_late=True, soft_time_limit=1800, time_limit=1900)
 def export_data(
-    self, model, app_name, filename=None, userId=None,
+    self, model, app_name, filename=None, userId=None, filterset=None, filters=None, region=None, lock=None,
 ):
-    table = apps.get_model('{}.{}'.format(app_name, model))
-    qs = table.objects.all()
+    """
+    Rows of `app_name.model` as a TSV in storage, filtered with the FilterSet at dotted path `filterset`.
+    The ExportData row with the task's id follows the job, `lock` is its atomicloops.jobs dedupe key.
+    """
+    from users.models import ExportData
 
-    keys = list(qs.first().__dict__.keys())
-    keys.remove('_state')
+    job, _ = ExportData.objects.get_or_create(
+        id=self.request.id, defaults={'userId_id': userId, 'modelName': model, 'filters': filters or {}}
+    )
+    # acks_late redelivers the message of a worker lost after the upload, the file is there already
+    if job.status == 'done':
+        if lock:
+            release(lock, str(job.id))
+        return job.fileUrl
+    job.status = 'running'
+    job.save(update_fields=['status', 'updatedAt'])
+
+    table = apps.get_model('{}.{}'.format(app_name, model))
     filename = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-    # Write to file
-    with open(filename, 'w', newline='') as output_file:
-        dict_writer = csv.DictWriter(output_file, keys, delimiter='\t')
-        dict_writer.writeheader()
-        for item in qs:
-            row = item.__dict__
-            del row['_state']
-            dict_writer.writerow(item.__dict__)
+    try:
+        # the full table scan runs on a read replica when there is one, the ExportData row on the primary
+        with replica_reads():
+            qs = table.objects.all()
+            if filterset:
+                request = HttpRequest()
+                if region:
+                    request.META['HTTP_X_TIMEZONE_REGION'] = region
+                qs = import_string(filterset)(filters, queryset=qs, request=request).qs
 
-    # upload to AWS
-    file_id = self.request.id
-    s3 = boto3.client("s3", region_name=settings.REGION, aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-    aws_path = "export-data/%s-%s.tsv" % (model, file_id)
-    s3.upload_file(
-        filename,
-        settings.S3_BUCKET,
-        aws_path,
-        ExtraArgs={'ACL': 'public-read'})
-    aws_url = f"{settings.AWS_URL}/{aws_path}"
-    data = {
-        'id': file_id,
-        'userId': userId,
-        'modelName': model,
-        'fileUrl': aws_url
-    }
-    serializer = ExportDataSerializer(data=data)
-    if serializer.is_valid():
-        serializer.save()
-    os.remove(filename)
+            keys = [field.attname for field in table._meta.concrete_fields]
+            # Write to file
+            with open(filename, 'w', newline='') as output_file:
+                dict_writer = csv.DictWriter(output_file, keys, delimiter='\t')
+                dict_writer.writeheader()
+                for row in qs.values(*keys).iterator(chunk_size=2000):
+                    dict_writer.writerow(row)
 
+        # upload to AWS
+        aws_path = "export-data/%s-%s.tsv" % (model, job.id)
+        job.fileUrl = get_storage().upload_file(
+            filename,
+            aws_path,
+            extra_args={'ACL': 'public-read'})
+        job.status = 'done'
+    except Exception as error:
+        job.status, job.error = 'failed', repr(error)
+        raise
+    finally:
+        job.save(update_fields=['status', 'fileUrl', 'error', 'updatedAt'])
+        if os.path.exists(filename):
+            os.remove(filename)
+        if lock:
+            release(lock, str(job.id))
+    return job.fileUrl
 
-@app.task(bind=True)
+
+@app.task(bind=True, acks_late=True, soft_time_limit=30, time_limit=60, autoretry_for=(smtplib.SMTPException, OSError),
+          retry_backoff=True, max_retries=3)
 def send_email(self, receiver, subject, message, cc=''):
-    try:
-        # stmp setup to send email
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.set_debuglevel(0)  # 0 for no debugging
-        server.ehlo()  # say hello to the server
-        server.starttls()  # start TLS encryption
-        server.login(settings.EMAIL, settings.PASSWORD)
+    """HTML email through EMAIL_BACKEND, on the email queue. Connection and SMTP errors are retried."""
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=strip_tags(message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[receiver],
+        cc=[address.strip() for address in cc.split(',') if address.strip()],
+    )
+    email.attach_alternative(message, 'text/html')
+    email.send()
+    return True
+
+
+@app.task(bind=True)
+def prune_api_logs(self):
+    """Drop API logs older than API_LOG_RETENTION_DAYS, whole days at a time on partitioned storage."""
+    from datetime import timedelta
+    from django.utils import timezone
+    from atomicloops.apilog import day_start, get_api_log_buffer
 
-        # Email Configuration
-        body = MIMEMultipart("alternative")
-        body["Subject"] = subject
-        body["From"] = settings.EMAIL
-        body["To"] = receiver   # send to single email
-        body.attach(MIMEText(message, 'html'))
-        if cc != "":
-            body['Cc'] = cc
-            rcpt = [receiver] + cc.split(',')
-        else:
-            rcpt = [receiver]
-        server.sendmail(settings.EMAIL, rcpt, body.as_string())
-        return True
-    except:
-        return False
+    buffer = get_api_log_buffer()
+    if buffer is None:
+        return 'API logging is off'
+    before = day_start(timezone.now() - timedelta(days=settings.API_LOG_RETENTION_DAYS))
+    return f'Pruned {buffer.backend.prune(before)} API log partitions before {before:%Y-%m-%d}'
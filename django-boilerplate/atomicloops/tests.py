@@ -1,3 +1,759 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from io import StringIO
+from urllib.parse import urlencode
+from unittest import mock, skipUnless
+from django.core import mail
+from django.core.cache import cache
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.urls import NoReverseMatch, reverse
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from drf_yasg.renderers import SwaggerJSONRenderer
+from rest_framework.test import APITestCase
+from atomicloops.apilog import ApiLogBuffer, DatabaseApiLogBackend, MemoryApiLogBackend, MASK, day_start
+from atomicloops.apilog import get_api_log_buffer, reset_api_log_buffer
+from atomicloops.backup import latest_manifest, write_manifest
+from atomicloops.connections import ConnectionMetrics, ConnectionPool, PoolTimeout, collect, get_metrics
+from atomicloops.connections import record_served, reset_metrics, reset_pools, worker_name
+from atomicloops.jobs import RELEASE_SCRIPT, acquire, release
+from atomicloops.loadtest.dataset import allocate, skewed_weights
+from atomicloops.schema import code_revision
+from atomicloops.querybudget import QueryBudget, get_query_budget, router_routes
+from atomicloops.loadtest.report import compare, load_baselines
+from atomicloops.loadtest.scenarios import SCENARIOS
+from atomicloops.models import ApiLog
+from tasksaathi.models import Company, Task, TaskSummary
+from tasksaathi.views import TaskViewSet
+from src.urls import schema_view
+from users.models import ExportData, Users
+from utils.email import send_email as send_email_later
+from utils import storage
+from utils.storage import LocalStorage, S3Storage, get_storage, reset_storage
 
-# Create your tests here.
+
+class QueryBudgetRegistryTest(SimpleTestCase):
+
+    def test_budgets_are_inherited_and_overridden(self):
+        self.assertEqual(get_query_budget(TaskViewSet, 'export_data'), QueryBudget(1))
+        self.assertEqual(get_query_budget(TaskViewSet, 'my_tasks'), QueryBudget(1))
+        self.assertIsNone(get_query_budget(TaskViewSet, 'unknown'))
+
+    def test_router_routes(self):
+        routes = {(route.name, route.method): route.action for route in router_routes('tasksaathi.urls')}
+        self.assertEqual(routes[('task-detail', 'patch')], 'partial_update')
+        self.assertEqual(routes[('task-update-status', 'patch')], 'update_status')
+        self.assertNotIn(('task-update-status', 'get'), routes)
+
+
+class StartupImportsTest(SimpleTestCase):
+    # imported on first use, not by every worker and command (see profile-startup)
+    lazy = ['celery', 'PIL', 'pillow_heif', 'drf_yasg.codecs', 'boto3']
+
+    def test_heavy_modules_stay_unloaded(self):
+        code = (
+            'import sys, django; django.setup(); from django.urls import get_resolver; '
+            'get_resolver().url_patterns; print(" ".join(sorted(sys.modules)))'
+        )
+        process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                 env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ['DJANGO_SETTINGS_MODULE']})
+        self.assertEqual(process.returncode, 0, process.stderr[-2000:])
+        modules = set(process.stdout.split())
+        self.assertEqual([name for name in self.lazy if name in modules], [])
+
+
+class LoadTestCompareTest(SimpleTestCase):
+    baselines = {'scenarios': {'task-list': {'GET /api/tasks/': {'p50': 10, 'p95': 20, 'p99': 30, 'rps': 100}}}}
+
+    def result(self, p95, rps, errors=None):
+        stats = {'count': 10, 'errors': errors or {}, 'rps': rps, 'p50': 10, 'p95': p95, 'p99': p95}
+        return {'task-list': {'GET /api/tasks/': stats}}
+
+    def test_within_tolerance(self):
+        self.assertEqual(compare(self.result(p95=24, rps=80), self.baselines, tolerance=0.25), [])
+
+    def test_regressions(self):
+        regressions = compare(self.result(p95=26, rps=70, errors={500: 1}), self.baselines, tolerance=0.25)
+        self.assertEqual(len(regressions), 3)
+
+    def test_endpoint_without_baseline(self):
+        self.assertEqual(compare({'task-create': self.result(1000, 1)['task-list']}, self.baselines), [])
+
+
+@override_settings(
+    PUSH_BACKEND='utils.push.FakePushClient',
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    API_LOG_BACKEND=None,
+)
+class LoadTestScenariosTest(LiveServerTestCase):
+
+    def setUp(self):
+        # celery's current app is per thread, in the live server thread it isn't the eager test app
+        self.enterContext(mock.patch('tasksaathi.signals.notify_task_change'))
+
+    def test_every_scenario_runs_cleanly(self):
+        # a scenario broken by an API change shows up as failed requests
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        baselines = os.path.join(directory, 'baselines.json')
+        out = StringIO()
+        call_command('loadtest', url=self.live_server_url, requests=2, concurrency=1, tasks=20,
+                     baselines=baselines, save_baselines=True, stdout=out)
+        self.assertEqual(set(load_baselines(baselines)['scenarios']), set(SCENARIOS))
+        self.assertNotIn('errors', out.getvalue())
+
+        call_command('loadtest', url=self.live_server_url, requests=2, concurrency=1, tasks=20,
+                     baselines=baselines, tolerance=100, stdout=out)
+        self.assertFalse(Users.objects.filter(email__startswith='loadtest-').exists())
+
+
+class GenerateDataTest(TestCase):
+
+    def generate(self, **kwargs):
+        options = {'companies': 4, 'employees': 40, 'tasks': 400, 'seed': 1, 'workers': 1,
+                   'end': datetime.date(2024, 6, 30)}
+        call_command('generate-data', purge=True, stdout=StringIO(), **{**options, **kwargs})
+        return list(Task.objects.order_by('id').values_list('id', 'title', 'status', 'assignedTo', 'createdAt'))
+
+    def test_allocate(self):
+        self.assertEqual(allocate(10, [1, 1, 1], minimum=1), [4, 3, 3])
+        self.assertEqual(sum(allocate(1000, skewed_weights(7, 1.5))), 1000)
+        with self.assertRaises(ValueError):
+            allocate(2, [1, 1, 1], minimum=1)
+
+    def test_reproducible(self):
+        tasks = self.generate()
+        self.assertEqual(len(tasks), 400)
+        self.assertEqual(self.generate(batch_size=7), tasks)
+        self.assertNotEqual(self.generate(seed=2), tasks)
+
+    def test_skew_and_summaries(self):
+        self.generate(skew=1.5)
+        sizes = list(Company.objects.annotate(count=Count('tasks')).order_by('-count').values_list('count', flat=True))
+        self.assertEqual(len(sizes), 4)
+        self.assertGreater(sizes[0], 2 * sizes[-1])
+        self.assertEqual(TaskSummary.objects.aggregate(total=Sum('total'))['total'], 400)
+
+        self.generate(skew=0)
+        sizes = Company.objects.annotate(count=Count('tasks')).values_list('count', flat=True)
+        self.assertEqual(set(sizes), {100})
+
+
+@override_settings(
+    API_LOG_BACKEND='atomicloops.apilog.MemoryApiLogBackend',
+    API_LOG_FLUSH_INTERVAL=3600,
+    API_LOG_SAMPLE_RATE=1.0,
+    API_LOG_SAMPLE_RATES={'users-list': 0},
+)
+class ApiLogTest(APITestCase):
+
+    def setUp(self):
+        reset_api_log_buffer()
+        self.addCleanup(reset_api_log_buffer)
+        self.user = Users.objects.create_user(email='apilog@example.com', password='secret-password',
+                                              firstName='Api', lastName='Log')
+
+    def entries(self):
+        buffer = get_api_log_buffer()
+        buffer.flush()
+        return buffer.backend.entries
+
+    def test_sampled_out_route(self):
+        self.client.force_authenticate(self.user)
+        self.client.get('/users/')
+        self.client.get('/users-devices/')
+        entries = self.entries()
+        self.assertEqual([entry['urlName'] for entry in entries], ['users-devices-list'])
+        self.assertEqual(entries[0]['userId'], self.user.id)
+        self.assertEqual(entries[0]['statusCode'], 200)
+
+    @override_settings(API_LOG_SAMPLE_RATE=0)
+    def test_errors_are_always_logged_and_masked(self):
+        response = self.client.post('/login/', {'email': 'apilog@example.com', 'password': 'wrong'},
+                                    format='json', HTTP_AUTHORIZATION='Bearer abc')
+        self.assertGreaterEqual(response.status_code, 400)
+        [entry] = self.entries()
+        self.assertEqual(entry['urlName'], 'token-obtain-pair')
+        self.assertIn(MASK, entry['body'])
+        self.assertNotIn('wrong', entry['body'])
+        self.assertNotIn('abc', entry['headers'])
+        self.assertIsNone(entry['userId'])
+
+    def test_query_string_is_masked(self):
+        self.client.force_authenticate(self.user)
+        self.client.get('/users-devices/', {'token': 'secret-jwt', 'page': 2})
+        [entry] = self.entries()
+        self.assertNotIn('secret-jwt', entry['path'])
+        self.assertIn('page=2', entry['path'])
+
+    def test_full_queue_drops(self):
+        with override_settings(API_LOG_QUEUE_SIZE=2):
+            buffer = ApiLogBuffer(MemoryApiLogBackend())
+        for _ in range(3):
+            buffer.put({})
+        self.assertEqual(buffer.dropped, 1)
+
+
+class SchemaViewTest(TestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        self.enterContext(override_settings(STATIC_ROOT=self.static_root))
+        schema_view.reset_schema()
+        self.addCleanup(schema_view.reset_schema)
+
+    def test_generated_once_per_revision(self):
+        with mock.patch.object(schema_view.generator_class, 'get_schema', autospec=True,
+                               side_effect=schema_view.generator_class.get_schema) as get_schema:
+            first = self.client.get('/postman.json/', HTTP_ACCEPT='application/json')
+            second = self.client.get('/postman.json/', HTTP_ACCEPT='application/json')
+        self.assertEqual(get_schema.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertIn('/api/tasks/', first.json()['paths'])
+        self.assertEqual(self.client.get('/swagger/').status_code, 200)
+
+    def test_artifact_is_served_as_static_file(self):
+        call_command('generate-schema', stdout=StringIO())
+        response = self.client.get('/postman.json/', HTTP_ACCEPT='application/json')
+        artifact = f'schema/openapi-{code_revision()}.json'
+        self.assertRedirects(response, f'/static/{artifact}', fetch_redirect_response=False)
+        self.assertRedirects(self.client.get('/swagger/?format=openapi'), f'/static/{artifact}',
+                             fetch_redirect_response=False)
+        with open(os.path.join(self.static_root, artifact), 'rb') as generated:
+            self.assertEqual(generated.read(), schema_view.render_schema(SwaggerJSONRenderer))
+
+    def test_old_revisions_are_pruned(self):
+        for revision in ('a', 'b', 'c'):
+            call_command('generate-schema', revision=revision, keep=1, stdout=StringIO())
+        files = sorted(os.listdir(os.path.join(self.static_root, 'schema')))
+        self.assertEqual(files, ['openapi-b.json', 'openapi-b.yaml', 'openapi-c.json', 'openapi-c.yaml'])
+
+
+class DatabaseApiLogBackendTest(TransactionTestCase):
+    path = '/apilog-backend-test/'
+
+    def entry(self, created):
+        return {
+            'id': uuid.uuid4(), 'createdAt': created, 'method': 'GET', 'path': self.path, 'urlName': None,
+            'statusCode': 200, 'durationMs': 1.5, 'userId': None, 'clientIp': '127.0.0.1', 'headers': '{}',
+            'body': '', 'response': '{"data": []}',
+        }
+
+    def test_write_and_prune(self):
+        backend = DatabaseApiLogBackend()
+        logs = ApiLog.objects.filter(path=self.path)
+        today = day_start(timezone.now())
+        backend.write([self.entry(today - datetime.timedelta(days=3)), self.entry(today + datetime.timedelta(hours=1))])
+        backend.write([self.entry(today + datetime.timedelta(hours=2))])
+        self.assertEqual(logs.count(), 3)
+        self.assertEqual(logs.first().body, '')
+
+        backend.prune(today - datetime.timedelta(days=1))
+        self.assertEqual(logs.filter(createdAt__lt=today).count(), 0)
+        self.assertEqual(logs.count(), 2)
+        # partitions dropped by prune are created again on demand
+        backend.write([self.entry(today - datetime.timedelta(days=3))])
+        self.assertEqual(logs.count(), 3)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def pool(self, **options):
+        return ConnectionPool(**{'max_size': 2, 'timeout': 5, 'max_lifetime': 60, 'max_idle': 60, **options},
+                              metrics=ConnectionMetrics())
+
+    def test_connections_are_reused_within_max_size(self):
+        pool = self.pool()
+        first, second = pool.get(mock.Mock), pool.get(mock.Mock)
+        waiting = {}
+        thread = threading.Thread(target=lambda: waiting.update(connection=pool.get(mock.Mock)))
+        thread.start()
+        time.sleep(0.05)
+        # both connections are out, the third checkout waits for one to come back
+        self.assertEqual(waiting, {})
+        pool.put(first)
+        thread.join()
+        self.assertIs(waiting['connection'], first)
+        pool.put(second)
+        self.assertIs(pool.get(mock.Mock), second)
+
+        metrics = pool.metrics.snapshot()
+        self.assertEqual((metrics['opened'], metrics['checkouts'], metrics['reused'], metrics['waits']), (2, 4, 2, 1))
+        self.assertGreaterEqual(metrics['wait_max'], 0.04)
+
+    def test_checkout_times_out(self):
+        pool = self.pool(max_size=1, timeout=0.05)
+        pool.get(mock.Mock)
+        with self.assertRaises(PoolTimeout):
+            pool.get(mock.Mock)
+        self.assertEqual(pool.metrics.snapshot()['timeouts'], 1)
+
+    def test_broken_and_old_connections_are_replaced(self):
+        pool = self.pool(max_size=1)
+        broken = pool.get(mock.Mock)
+        pool.put(broken, usable=False)
+        broken.close.assert_called_once()
+        dead = pool.get(mock.Mock)
+        pool.put(dead)
+        # the health check fails, a new connection takes the slot
+        replacement = pool.get(mock.Mock, check=lambda connection: False)
+        self.assertIsNot(replacement, dead)
+        dead.close.assert_called_once()
+        pool.max_lifetime = 0
+        pool.put(replacement)
+        replacement.close.assert_called_once()
+        self.assertEqual(pool.metrics.snapshot()['open'], 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'the pooling backend is PostgreSQL only')
+class PooledConnectionTest(TransactionTestCase):
+
+    def tearDown(self):
+        reset_pools()
+        reset_metrics()
+
+    def wrapper(self):
+        from atomicloops.backends.postgresql.base import DatabaseWrapper
+        return DatabaseWrapper({
+            **connection.settings_dict, 'OPTIONS': {'atomic_pool': {'max_size': 2}}, 'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': True,
+        }, alias='pooled')
+
+    def backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_connections_go_back_to_the_pool(self):
+        first = self.wrapper()
+        pid = self.backend_pid(first)
+        # left in a transaction, rolled back on the way into the pool
+        with first.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT txid_current()')
+        first.close()
+
+        second = self.wrapper()
+        self.assertEqual(self.backend_pid(second), pid)
+        self.assertTrue(second.get_autocommit())
+        second.close()
+        metrics = get_metrics('pooled').snapshot()
+        self.assertEqual((metrics['opened'], metrics['reused'], metrics['open']), (1, 1, 1))
+
+    def test_dead_connections_are_replaced(self):
+        first = self.wrapper()
+        pid = self.backend_pid(first)
+        first.close()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+
+        second = self.wrapper()
+        self.assertNotEqual(self.backend_pid(second), pid)
+        second.close()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'sqlite keeps in-memory test databases open')
+class CeleryConnectionReuseTest(TransactionTestCase):
+
+    def run_task(self):
+        from celery.fixups.django import DjangoWorkerFixup
+        from src.celery import app
+        fixup = DjangoWorkerFixup(app)
+        task = mock.Mock(request=mock.Mock(is_eager=False))
+        fixup.on_task_prerun(task)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            pid = cursor.fetchone()[0]
+        fixup.on_task_postrun(task)
+        return pid
+
+    @mock.patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True})
+    def test_tasks_share_a_connection_until_it_breaks(self):
+        connection.close()
+        pid = self.run_task()
+        self.assertEqual(self.run_task(), pid)
+        other = connection.copy()
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+        other.close()
+        # the health check at the start of the next task replaces it
+        self.assertNotEqual(self.run_task(), pid)
+
+
+class ConnectionMetricsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+
+    @override_settings(DATABASE_METRICS_INTERVAL=60)
+    def test_workers_publish_their_metrics(self):
+        get_metrics('default').record_open(0.004)
+        record_served()
+        record_served()
+        self.assertEqual([worker['served'] for worker in collect()], [1])
+
+        out = StringIO()
+        call_command('connection-stats', stdout=out)
+        self.assertIn(worker_name(), out.getvalue())
+        self.assertIn('4.0ms', out.getvalue())
+
+
+class CeleryTopologyTest(SimpleTestCase):
+
+    def test_tasks_are_routed_to_their_queue(self):
+        from src.celery import app
+        queues = {
+            'atomicloops.tasks.send_email': 'email',
+            'tasksaathi.tasks.send_task_notifications': 'notifications',
+            'atomicloops.tasks.export_data': 'bulk',
+            'tasksaathi.tasks.reconcile_task_summaries': 'bulk',
+            'src.celery.debug_task': 'celery',
+        }
+        for name, queue in queues.items():
+            with self.subTest(name):
+                self.assertEqual(app.amqp.router.route({}, name)['queue'].name, queue)
+
+    def test_send_email(self):
+        from atomicloops.tasks import send_email
+        with mock.patch('atomicloops.tasks.send_email.delay') as delay:
+            send_email_later('to@test.com', 'Verification otp', '<p>123456</p>')
+        delay.assert_called_once_with('to@test.com', 'Verification otp', '<p>123456</p>', '')
+
+        send_email.apply(args=('to@test.com', 'Verification otp', '<p>123456</p>', 'a@test.com, b@test.com'))
+        message = mail.outbox[-1]
+        self.assertEqual((message.to, message.cc, message.body), (['to@test.com'], ['a@test.com', 'b@test.com'], '123456'))
+        self.assertEqual(message.alternatives, [('<p>123456</p>', 'text/html')])
+
+
+class StorageTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        reset_storage()
+        self.addCleanup(reset_storage)
+
+    def test_s3_client_built_once_on_first_use(self):
+        # nothing is imported or built until a file goes to S3
+        code = (
+            'import sys, django; django.setup(); from utils.storage import get_storage; '
+            'storage = get_storage(); print("boto3" in sys.modules, storage._client is None)'
+        )
+        process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                 env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ['DJANGO_SETTINGS_MODULE']})
+        self.assertEqual(process.returncode, 0, process.stderr[-2000:])
+        self.assertEqual(process.stdout.split(), ['False', 'True'])
+
+        s3 = S3Storage()
+        with mock.patch('boto3.client') as client, override_settings(REGION='eu-west-1', AWS_ACCESS_KEY_ID='id',
+                                                                        AWS_SECRET_ACCESS_KEY='secret'):
+            threads = [threading.Thread(target=lambda: s3.client) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        client.assert_called_once()
+        self.assertIs(s3.client, client.return_value)
+
+    def test_local_upload_and_url(self):
+        source = os.path.join(self.directory, 'report.csv')
+        with open(source, 'w') as f:
+            f.write('id,title\n')
+        with override_settings(STORAGE_BACKEND='utils.storage.LocalStorage', LOCAL_STORAGE_URL='http://localhost/storage',
+                               LOCAL_STORAGE_DIR=os.path.join(self.directory, 'storage')):
+            backend = get_storage()
+            self.assertIsInstance(backend, LocalStorage)
+            self.assertIs(get_storage(), backend)
+            url = backend.upload_file(source, 'exports/2024/report.csv')
+        self.assertEqual(url, 'http://localhost/storage/exports/2024/report.csv')
+        with open(os.path.join(self.directory, 'storage', 'exports', '2024', 'report.csv')) as f:
+            self.assertEqual(f.read(), 'id,title\n')
+
+    def test_forked_children_build_their_own(self):
+        with override_settings(STORAGE_BACKEND='utils.storage.LocalStorage'):
+            get_storage()
+            pid = os.fork()
+            if pid == 0:
+                # the child must not reuse the parent's clients
+                os._exit(0 if storage._storage is None else 1)
+            _, code = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(code), 0)
+        self.assertIsNotNone(storage._storage)
+
+
+@override_settings(STORAGE_BACKEND='utils.storage.LocalStorage', LOCAL_STORAGE_URL='http://localhost/storage')
+class ExportJobTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create_superuser(email='admin@test.com', password='test', firstName='Ad',
+                                                   lastName='Min')
+        for level in (1, 2, 2):
+            Users.objects.create_user(email=f'user{uuid.uuid4().hex[:8]}@test.com', password='test', firstName='U',
+                                      lastName='U', level=level)
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_dir)
+        self.enterContext(override_settings(LOCAL_STORAGE_DIR=self.storage_dir))
+        reset_storage()
+        self.addCleanup(reset_storage)
+        cache.clear()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, method='post', **params):
+        url = f"{reverse('users-export-data')}?{urlencode(params)}"
+        return getattr(self.client, method)(url, HTTP_HOST='localhost')
+
+    def test_running_export_is_returned_instead_of_queued_again(self):
+        with mock.patch('atomicloops.tasks.export_data.apply_async') as apply_async:
+            first, again = self.export(level=2), self.export(level=2)
+            other = self.export(level=1)
+        self.assertEqual((first.status_code, again.status_code, other.status_code), (202, 200, 202))
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(again.data['status'], 'pending')
+        self.assertNotEqual(other.data['id'], first.data['id'])
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(apply_async.call_args_list[0].kwargs['task_id'], first.data['id'])
+        self.assertEqual(ExportData.objects.count(), 2)
+
+    def test_export_status_and_file(self):
+        response = self.export(level=2)
+        self.assertEqual(response.status_code, 202)
+        job = self.export('get', id=response.data['id']).data
+        self.assertEqual((job['status'], job['filters']), ('done', {'level': '2'}))
+        path = os.path.join(self.storage_dir, 'export-data', f"Users-{job['id']}.tsv")
+        with open(path) as export:
+            rows = export.read().splitlines()
+        self.assertEqual(len(rows), 3)
+        self.assertIn('email', rows[0].split('\t'))
+
+        # finished exports release their lock, asking again exports the rows as they are now
+        self.assertEqual(self.export(level=2).status_code, 202)
+        self.assertEqual(len(self.export('get').data), 2)
+        self.assertEqual(self.export('get', id=uuid.uuid4()).status_code, 404)
+        self.assertEqual(self.export(level='high').status_code, 400)
+
+    def test_lock_is_only_released_by_its_holder(self):
+        self.assertEqual(acquire('jobs:test', 'first', 60), 'first')
+        release('jobs:test', 'late')
+        self.assertEqual(acquire('jobs:test', 'second', 60), 'first')
+        release('jobs:test', 'first')
+        self.assertEqual(acquire('jobs:test', 'second', 60), 'second')
+
+        # on Redis the check and the delete are one script
+        client = mock.Mock()
+        with mock.patch('atomicloops.jobs.get_lock_client', return_value=client):
+            release('jobs:test', 'second')
+        client.eval.assert_called_once_with(RELEASE_SCRIPT, 1, cache.make_key('jobs:test'), 'second')
+
+    def test_failed_export(self):
+        with mock.patch('atomicloops.tasks.get_storage', side_effect=OSError('storage down')):
+            response = self.export()
+        job = ExportData.objects.get(pk=response.data['id'])
+        self.assertEqual((job.status, job.error, job.fileUrl), ('failed', "OSError('storage down')", None))
+        self.assertEqual(self.export().status_code, 202)
+
+
+class StreamingExportTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(email='employer@test.com', password='test', firstName='Emp',
+                                                 lastName='Loyer', userRole='EMPLOYER')
+        cls.employee = Users.objects.create_user(email='employee@test.com', password='test', firstName='Emp',
+                                                 lastName='Loyee')
+        other = Users.objects.create_user(email='other@test.com', password='test', firstName='Oth', lastName='Er',
+                                          userRole='EMPLOYER')
+        company = Company.objects.create(name='Test', userId=cls.employer)
+        other_company = Company.objects.create(name='Other', userId=other)
+        with mock.patch('tasksaathi.signals.notify_task_change'):
+            for index, status in enumerate(('pending', 'completed', 'completed', 'completed')):
+                Task.objects.create(title=f'Task{index}', status=status, assignedTo=cls.employer,
+                                    createdBy=cls.employer, companyId=company)
+            Task.objects.create(title='Assigned', status='completed', assignedTo=cls.employee, createdBy=cls.employer,
+                                companyId=company)
+            Task.objects.create(title='Foreign', status='completed', assignedTo=cls.employee, createdBy=other,
+                                companyId=other_company)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.employer)
+
+    def export(self, **params):
+        headers = params.pop('headers', {})
+        return self.client.get(f"{reverse('task-export')}?{urlencode(params)}", HTTP_HOST='localhost', **headers)
+
+    @override_settings(EXPORT_STREAM_CHUNK_SIZE=2)
+    def test_csv_of_the_filtered_list(self):
+        response = self.export(status='completed')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="task.csv"')
+        # the header, then one piece per chunk of two rows
+        parts = list(response.streaming_content)
+        self.assertEqual(len(parts), 3)
+        rows = list(csv.DictReader(b''.join(parts).decode().splitlines()))
+        self.assertEqual(sorted(row['title'] for row in rows), ['Assigned', 'Task1', 'Task2', 'Task3'])
+
+        rows = list(csv.DictReader(b''.join(self.export(search='Task2').streaming_content).decode().splitlines()))
+        self.assertEqual([row['title'] for row in rows], ['Task2'])
+
+    def test_gzipped_ndjson(self):
+        response = self.export(exportFormat='ndjson', status='pending', headers={'HTTP_ACCEPT_ENCODING': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines], ['Task0'])
+
+    def test_validates(self):
+        self.assertEqual(self.export(exportFormat='xlsx').status_code, 400)
+        self.assertEqual(self.export(dueDateFrom='soon').status_code, 400)
+        # an empty result is just the header
+        self.assertEqual(b''.join(self.export(search='nobody').streaming_content).count(b'\n'), 1)
+        with override_settings(EXPORT_STREAM_MAX_ROWS=4):
+            self.assertEqual(self.export().status_code, 400)
+            self.assertEqual(self.export(status='completed').status_code, 200)
+
+    def test_rows_of_the_users_scope(self):
+        def titles(**params):
+            return sorted(row['title'] for row in csv.DictReader(
+                b''.join(self.export(**params).streaming_content).decode().splitlines()
+            ))
+
+        # the employer gets their company's rows, filtered, never another company's
+        self.assertEqual(titles(status='completed'), ['Assigned', 'Task1', 'Task2', 'Task3'])
+        # the employee only the tasks assigned to them, in any company
+        self.client.force_authenticate(self.employee)
+        self.assertEqual(titles(), ['Assigned', 'Foreign'])
+        self.assertEqual(titles(search='Foreign'), ['Foreign'])
+
+    def test_throttled_and_opt_in(self):
+        with override_settings(EXPORT_STREAM_RATE='2/hour'):
+            self.assertEqual([self.export().status_code for _ in range(3)], [200, 200, 429])
+        # viewsets without StreamingExportMixin have no export route
+        with self.assertRaises(NoReverseMatch):
+            reverse('users-export')
+
+
+class LatestManifestTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def backup(self, name, **manifest):
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+        write_manifest(path, manifest)
+        return path
+
+    def test_picked_by_snapshot_time_not_name(self):
+        self.assertEqual(latest_manifest(self.directory), (None, None))
+        # an --output name sorting after the newer backup, and a backup without snapshotAt
+        self.backup('zz-before-migration', startedAt='2024-06-01T00:00:00+00:00',
+                    snapshotAt='2024-06-01T00:00:01+00:00', finishedAt='2024-06-01T00:10:00+00:00')
+        self.backup('20240501T000000Z', startedAt='2024-05-01T00:00:00+00:00', finishedAt='2024-05-01T00:10:00+00:00')
+        latest = self.backup('20240602T000000Z', startedAt='2024-06-02T00:00:00+00:00',
+                             snapshotAt='2024-06-02T00:00:01+00:00', finishedAt='2024-06-02T00:10:00+00:00')
+        os.makedirs(os.path.join(self.directory, 'zzz-unfinished'))
+        path, manifest = latest_manifest(self.directory)
+        self.assertEqual(path, latest)
+        self.assertEqual(manifest['snapshotAt'], '2024-06-02T00:00:01+00:00')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BackupRestoreTest(TransactionTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(BACKUP_DIR=directory))
+        self.enterContext(mock.patch('tasksaathi.signals.notify_task_change'))
+        self.employer = Users.objects.create_user(email='employer@test.com', password='test', firstName='Emp',
+                                                  lastName='Loyer', userRole='EMPLOYER')
+        self.company = Company.objects.create(name='Test', userId=self.employer)
+        self.tasks = [self.create_task(f'task {index}') for index in range(5)]
+
+    def create_task(self, title):
+        return Task.objects.create(title=title, description='backup', assignedTo=self.employer,
+                                   createdBy=self.employer, companyId=self.company,
+                                   dueDate=datetime.date(2024, 6, 1))
+
+    def rows(self):
+        return {model: list(model.objects.order_by('id').values()) for model in (Company, Task, TaskSummary)}
+
+    def backup(self, *args, **kwargs):
+        call_command('db-backup', 'tasksaathi', *args, compression='gzip', jobs=2, stdout=StringIO(), **kwargs)
+        return latest_manifest(settings.BACKUP_DIR)
+
+    def restore(self, *args, **kwargs):
+        call_command('db-restore', *args, jobs=2, stdout=StringIO(), **kwargs)
+
+    def test_incremental_restored_on_its_base(self):
+        self.backup(output=os.path.join(settings.BACKUP_DIR, 'full'))
+        Task.objects.filter(id=self.tasks[0].id).update(title='changed', updatedAt=timezone.now())
+        self.tasks[1].status = 'completed'
+        self.tasks[1].save()
+        self.create_task('added')
+        expected = self.rows()
+        path, _ = self.backup(incremental=True)
+
+        # the database is lost after the incremental backup
+        Task.objects.all().delete()
+        self.restore('full')
+        self.assertEqual(Task.objects.count(), 5)
+        self.assertEqual(Task.objects.get(id=self.tasks[0].id).title, 'task 0')
+        self.restore(path)
+        self.assertEqual(self.rows(), expected)
+
+    def test_corrupted_dump_is_refused(self):
+        path, manifest = self.backup()
+        entry = {entry['model']: entry for entry in manifest['tables']}['tasksaathi.Task']
+        with gzip.open(os.path.join(path, entry['file']), 'ab') as f:
+            f.write(b'"tampered"\n')
+        Task.objects.filter(id=self.tasks[0].id).update(title='kept')
+        with self.assertRaisesMessage(CommandError, 'Checksum mismatch'):
+            self.restore(path)
+        self.assertEqual(Task.objects.get(id=self.tasks[0].id).title, 'kept')
+
+    def test_full_round_trip(self):
+        expected = self.rows()
+        _, manifest = self.backup()
+        self.assertFalse(manifest['incremental'])
+        self.assertEqual({entry['model']: entry['rows'] for entry in manifest['tables']}['tasksaathi.Task'], 5)
+
+        Task.objects.filter(id=self.tasks[0].id).update(title='changed')
+        self.tasks[1].delete()
+        self.create_task('added')
+        self.restore()
+        self.assertEqual(self.rows(), expected)
+
+    def test_incremental_holds_the_changed_rows(self):
+        self.backup(output=os.path.join(settings.BACKUP_DIR, 'full'))
+        Task.objects.filter(id=self.tasks[0].id).update(title='changed', updatedAt=timezone.now())
+        self.create_task('added')
+        expected = self.rows()
+
+        path, manifest = self.backup(incremental=True)
+        self.assertEqual((manifest['incremental'], manifest['baseBackup']), (True, 'full'))
+        tasks = {entry['model']: entry for entry in manifest['tables']}['tasksaathi.Task']
+        self.assertEqual((tasks['incremental'], tasks['rows']), (True, 2))
+
+        # upserted on top of the current rows
+        Task.objects.filter(id=self.tasks[0].id).update(title='changed again')
+        self.restore(path)
+        self.assertEqual(self.rows(), expected)
@@ -0,0 +1,47 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+
+# Atomic Async API View
+class AtomicAsyncAPIView(APIView):
+    """
+    APIView for handlers written as coroutines (`async def post`). Django serves it as an
+    async view: under uvicorn (src.asgi) it runs on the event loop, under a WSGI worker
+    Django runs it through async_to_sync as before.
+
+    Authentication, permissions, throttling and body parsing are sync DRF code that may hit
+    the database or spool an upload to disk, so they run in a worker thread. Handlers must do
+    the same for their own blocking work: the async ORM methods (afirst, asave, ...) or
+    sync_to_async for serializers, and sync_to_async(..., thread_sensitive=False) for network
+    calls that don't touch the database, such as storage uploads.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # parse now, in the worker thread, instead of on first access to request.data in the handler
+        request.data
+
+    async def dispatch(self, request, *args, **kwargs):
+        # APIView.dispatch with the sync steps moved off the event loop
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # options() and http_method_not_allowed() are inherited sync methods
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
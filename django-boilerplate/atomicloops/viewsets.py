@@ -4,13 +4,141 @@ from rest_framework import status
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from rest_framework.decorators import action
-from users.models import Users
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import UserRateThrottle
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.text import compress_sequence
+from django.utils.http import parse_etags, quote_etag
+from django.utils import timezone
+from users.models import Users, ExportData
+from users.serializers import ExportDataSerializer
 import django
-from atomicloops.tasks import export_data
+import hashlib
+from contextlib import nullcontext
+from atomicloops.permissions import get_principal
+from atomicloops.querybudget import QueryBudget
+from atomicloops.routers import is_pinned, read_from_replica, replica_reads, reset_reads
+from atomicloops.streaming import CONTENT_TYPES, chunks, encode_csv, encode_ndjson
+
+
+def touched(model):
+    """
+    updatedAt for writes that skip auto_now, queryset.update() and bulk_update(): list ETags and
+    delta sync (?updatedSince) only see rows whose updatedAt moved. {} for models without one.
+    """
+    if any(field.name == 'updatedAt' for field in model._meta.concrete_fields):
+        return {'updatedAt': timezone.now()}
+    return {}
+
+
+def touch(instances):
+    """Set touched() on model instances before a bulk_update() of their fields."""
+    for instance in instances:
+        for name, value in touched(type(instance)).items():
+            setattr(instance, name, value)
+
+
+class PrincipalScopeMixin:
+    """
+    get_queryset filtered by scope_queryset with the request's Principal, so list, detail lookups
+    and bulk actions only reach rows the user may act on, authorized in SQL rather than row by row.
+    """
+    # Foreign key to the user owning a row, or 'pk' when the rows are users: unsafe methods only
+    # reach the principal's own rows, superusers every row. None leaves the queryset unscoped.
+    owner_field = None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # schema generation runs the view without a user
+        if getattr(self, 'swagger_fake_view', False):
+            return queryset.none()
+        return self.scope_queryset(queryset, get_principal(self.request))
+
+    def scope_queryset(self, queryset, principal):
+        """Rows `principal` may act on with this request, override for per role scopes."""
+        if self.owner_field is None or principal.isSuperuser or self.request.method in SAFE_METHODS:
+            return queryset
+        lookup = 'pk' if self.owner_field == 'pk' else f'{self.owner_field}_id'
+        return queryset.filter(**{lookup: principal.userId})
+
+
+class ReplicaReadMixin:
+    """
+    Serves replica_actions from a read replica (DATABASE_REPLICAS), unless the user wrote
+    in the last DATABASE_REPLICA_STICKY_SECONDS and must see their own writes.
+    """
+    replica_actions = ('list', 'retrieve', 'export')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.replica_token = read_from_replica() if self.use_replica(request) else None
+
+    def use_replica(self, request):
+        if not (settings.DATABASE_REPLICAS and request.method in SAFE_METHODS and self.action in self.replica_actions):
+            return False
+        return not (request.user.is_authenticated and is_pinned(request.user.pk))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, 'replica_token', None) is not None:
+            reset_reads(self.replica_token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ExportRateThrottle(UserRateThrottle):
+    """Streaming exports per user, EXPORT_STREAM_RATE."""
+    scope = 'export'
+
+    def get_rate(self):
+        return settings.EXPORT_STREAM_RATE
+
+
+class StreamingExportMixin:
+    """
+    GET export/: streaming download of the rows `list` would return, with its filters, search and
+    ordering, as ?exportFormat=csv (default) or ndjson, gzipped for clients sending Accept-Encoding:
+    gzip. Scoped like `list` for the signed-in user, throttled and refused above
+    EXPORT_STREAM_MAX_ROWS rows; viewsets opt in by adding the mixin.
+    """
+    query_budgets = {
+        # the row count and one server side cursor, EXPORT_STREAM_CHUNK_SIZE rows per fetch
+        'export': QueryBudget(2),
+    }
+
+    @action(detail=False, methods=['get'], url_path='export', throttle_classes=[ExportRateThrottle])
+    def export(self, request, *args, **kwargs):
+        export_format = request.query_params.get('exportFormat', 'csv')
+        if export_format not in CONTENT_TYPES:
+            return Response({"message": f"exportFormat must be one of {', '.join(CONTENT_TYPES)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset())
+        if queryset.count() > settings.EXPORT_STREAM_MAX_ROWS:
+            return Response({"message": f"More than {settings.EXPORT_STREAM_MAX_ROWS} rows, narrow the filters or use export-data"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        fields = [name for name, field in self.get_serializer().fields.items() if not field.write_only]
+        # the rows are read after the view returned, outside the replica block of ReplicaReadMixin
+        replica = getattr(self, 'replica_token', None) is not None
+
+        def records():
+            with replica_reads() if replica else nullcontext():
+                for chunk in chunks(queryset, settings.EXPORT_STREAM_CHUNK_SIZE):
+                    yield self.get_serializer(chunk, many=True).data
+
+        content = encode_csv(records(), fields) if export_format == 'csv' else encode_ndjson(records())
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[export_format])
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response.streaming_content = compress_sequence(response.streaming_content)
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Content-Disposition'] = f'attachment; filename="{self.basename}.{export_format}"'
+        return response
 
 
 # Atomic View
-class AtomicViewSet(ModelViewSet):
+class AtomicViewSet(ReplicaReadMixin, PrincipalScopeMixin, ModelViewSet):
     # renderer_classes = AtomicJsonRenderer
 
     # # TODO  write queryset
@@ -25,6 +153,95 @@ class AtomicViewSet(ModelViewSet):
     #     if self.request.user_level == 5:
     #         return self.serializer_class.Meta.model.objects.exclude(userId__user_level=0)
     #     return self.serializer_class.Meta.model.objects.exclude(userId__is_active=False).exclude(userId__user_level=0)
+
+    # Conditional GET: list and retrieve send an ETag built from the latest value of these
+    # fields (plus the row count for lists) and answer If-None-Match with 304 without
+    # serializing. Add related paths, e.g. 'userId__updatedAt', when the serializer renders them.
+    etag_fields = ('updatedAt',)
+
+    # Most queries and database time one request may spend per action, with QUERY_BUDGET_ROWS
+    # rows per table. The app test suites call every routed action and fail on a missing or
+    # exceeded budget (atomicloops.querybudget), subclasses declare budgets for their own actions.
+    query_budgets = {
+        # count, page and the ETag aggregate
+        'list': QueryBudget(3),
+        'retrieve': QueryBudget(1),
+        'create': QueryBudget(2),
+        'update': QueryBudget(3),
+        'partial_update': QueryBudget(2),
+        'destroy': QueryBudget(3),
+        # the bulk actions below check and write row by row, these hold for 3 rows of one FK each
+        'multiple_create': QueryBudget(9),
+        'multiple_update': QueryBudget(11),
+        'multiple_delete': QueryBudget(10),
+        'import_data': QueryBudget(9),
+        # saves the job row and queues the export, or reads the job
+        'export_data': QueryBudget(1),
+    }
+
+    def get_etag(self, *fingerprint):
+        # Scoped per user and per full path so pagination, filters and search get their own tag
+        key = '|'.join(str(part) for part in (self.request.user.pk, self.request.get_full_path(), *fingerprint))
+        return quote_etag(hashlib.md5(key.encode(), usedforsecurity=False).hexdigest())
+
+    def get_list_etag(self, queryset):
+        if not self.etag_fields:
+            return None
+        aggregates = {f'etag{index}': Max(field) for index, field in enumerate(self.etag_fields)}
+        values = queryset.order_by().aggregate(etagCount=Count('pk'), **aggregates)
+        return self.get_etag(*values.values())
+
+    def get_instance_etag(self, instance):
+        if not self.etag_fields:
+            return None
+        fingerprint = []
+        for field in self.etag_fields:
+            value = instance
+            for name in field.split('__'):
+                value = getattr(value, name, None)
+            fingerprint.append(value)
+        return self.get_etag(*fingerprint)
+
+    def not_modified(self, etag):
+        """304 response if the request's If-None-Match matches etag, else None."""
+        if etag is None or self.request.method not in ('GET', 'HEAD'):
+            return None
+        etags = parse_etags(self.request.META.get('HTTP_IF_NONE_MATCH', ''))
+        # weak comparison, as Django's ConditionalGetMiddleware does
+        if '*' in etags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in etags]:
+            return self.with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+        return None
+
+    def with_etag(self, response, etag):
+        if etag is not None:
+            response['ETag'] = etag
+            # let browsers keep the body but always revalidate it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag = self.get_list_etag(queryset)
+        response = self.not_modified(etag)
+        if response is not None:
+            return response
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.with_etag(self.get_paginated_response(serializer.data), etag)
+        serializer = self.get_serializer(queryset, many=True)
+        return self.with_etag(Response(serializer.data), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self.get_instance_etag(instance)
+        response = self.not_modified(etag)
+        if response is not None:
+            return response
+        serializer = self.get_serializer(instance)
+        return self.with_etag(Response(serializer.data), etag)
+
     def validate_data(self, data):
         serializer_class = self.serializer_class or self.get_serializer_class()
         if serializer_class.Meta.model == Users:
@@ -41,17 +258,22 @@ class AtomicViewSet(ModelViewSet):
 
     def validate_ids(self, data, field="id", unique=True):
         # new_data = []
-        serializer_class = self.serializer_class or self.get_serializer_class()
+        # rows outside the user's scope don't exist for them
+        queryset = self.get_queryset()
         for item in data:
             if "id" not in item:
                 raise serializers.ValidationError(f'Id Not provided {item}')
 
-            if not serializer_class.Meta.model.objects.filter(id=item['id']).exists():
+            if not queryset.filter(id=item['id']).exists():
                 raise serializers.ValidationError(f'Id does not Exists {item}')
             else:
-                serializer_class.Meta.model.objects.filter(id=item['id']).update(**item)
+                self.update_item(queryset, item)
         return [x[field] for x in data]
 
+    def update_item(self, queryset, item):
+        """Write one multiple-update item. A bulk UPDATE, models with save signals override this."""
+        queryset.filter(id=item['id']).update(**{**item, **touched(queryset.model)})
+
     @action(detail=False, methods=['post'], url_path='multiple-update')
     def multiple_update(self, request, *args, **kwargs):
         try:
@@ -65,9 +287,10 @@ class AtomicViewSet(ModelViewSet):
             if len(request.data) > 100:
                 raise ValidationError('Number of list elements must not be greater than 100')
             ids = self.validate_ids(request.data)
-            instances = serializer_class.Meta.model.objects.filter(id__in=ids)
+            instances = list(self.get_queryset().filter(id__in=ids))
             fields = [f.name for f in serializer_class.Meta.model._meta.concrete_fields]
             fields.remove('id')
+            touch(instances)
             _ = serializer_class.Meta.model.objects.bulk_update(instances, fields)
             serializer = serializer_class(instances, many=True, partial=True, context={'request': self.request, 'view': self})
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -95,7 +318,6 @@ class AtomicViewSet(ModelViewSet):
 
     @action(detail=False, methods=['post'], url_path='multiple-delete')
     def multiple_delete(self, request, *args, **kwargs):
-        serializer_class = self.serializer_class or self.get_serializer_class()
         if not request.user.is_superuser:
             return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
         if not isinstance(request.data, list):
@@ -105,7 +327,7 @@ class AtomicViewSet(ModelViewSet):
         if len(request.data) > 100:
             raise ValidationError('Number of list elements must not be greater than 100')
         ids = self.validate_ids(request.data)
-        instances = serializer_class.Meta.model.objects.filter(id__in=ids)
+        instances = self.get_queryset().filter(id__in=ids)
         instances.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -159,8 +381,10 @@ class AtomicViewSet(ModelViewSet):
             return Response(serializers.data, status=status.HTTP_201_CREATED)
         return Response(serializers.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    # export data api
-    @action(detail=False, methods=['post'], url_path='export-data')
+    # export data api: POST queues an export of the rows matching the filterset's query parameters,
+    # or returns the same export while it is pending or running; GET ?id= is a job's status and
+    # file, GET alone the user's latest exports of this model
+    @action(detail=False, methods=['get', 'post'], url_path='export-data')
     def export_data(self, request, *args, **kwargs):
         if not request.user.is_superuser:
             return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
@@ -169,5 +393,28 @@ class AtomicViewSet(ModelViewSet):
         model = serializer_class.Meta.model.__name__
         app_name = serializer_class.Meta.model._meta.app_label
 
-        export_data.delay(model, app_name, userId=request.user.id)
-        return Response('In process!', status=status.HTTP_200_OK)
+        if request.method == 'GET':
+            jobs = ExportData.objects.filter(userId=request.user, modelName=model).order_by('-createdAt')
+            if request.query_params.get('id'):
+                try:
+                    job = jobs.get(pk=request.query_params['id'])
+                except (ExportData.DoesNotExist, django.core.exceptions.ValidationError):
+                    return Response({"message": "Export not found"}, status=status.HTTP_404_NOT_FOUND)
+                return Response(ExportDataSerializer(job).data)
+            return Response(ExportDataSerializer(jobs[:20], many=True).data)
+
+        filterset, filters = None, {}
+        filterset_class = getattr(self, 'filterset_class', None)
+        if filterset_class is not None:
+            filters = {name: request.query_params[name] for name in filterset_class.base_filters
+                       if name in request.query_params}
+            form = filterset_class(filters, queryset=serializer_class.Meta.model.objects.none(), request=request).form
+            if not form.is_valid():
+                return Response(form.errors, status=status.HTTP_400_BAD_REQUEST)
+            filterset = f'{filterset_class.__module__}.{filterset_class.__qualname__}'
+
+        from atomicloops.jobs import enqueue_export
+        job, created = enqueue_export(model, app_name, user_id=request.user.id, filterset=filterset, filters=filters,
+                                      region=request.META.get('HTTP_X_TIMEZONE_REGION'))
+        return Response(ExportDataSerializer(job).data,
+                        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
@@ -1,5 +1,5 @@
 #!/bin/bash
-modes="  start-dev\n  stop-dev\n  start-prod\n  stop-prod\n  interactive-dev\n  interactive-prod\n  check-syntax\n  start-deploy\n  migrate\n  sync-vault\n  check-setup\n  db-backup"
+modes="  start-dev\n  stop-dev\n  start-prod\n  stop-prod\n  interactive-dev\n  interactive-prod\n  check-syntax\n  start-deploy\n  migrate\n  sync-vault\n  check-setup\n  db-backup\n  db-restore"
 mode=$1
 project_name="tasksaathi-backend"
 
@@ -40,6 +40,8 @@ elif [ "$mode" == "check-setup" ]; then
     docker exec -it --user root ${project_name}-backend python manage.py check-setup
 elif [ "$mode" == "db-backup" ]; then
     docker exec -it --user root ${project_name}-backend python manage.py db-backup
+elif [ "$mode" == "db-restore" ]; then
+    docker exec -it --user root ${project_name}-backend python manage.py db-restore ${@:2}
 else
     echo -e $"Invalid mode \nPlease enter one of the following mode:\n${modes}"
 fi
\ No newline at end of file
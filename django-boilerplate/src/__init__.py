@@ -1,3 +1,10 @@
-from .celery import app as celery_app
-
 __all__ = ('celery_app',)
+
+
+def __getattr__(name):
+    # celery is imported on first use (a task module, the worker's -A src), not by every
+    # process that loads the settings
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -17,4 +17,10 @@ if ENV is not None and ENV == "prod":
 else:
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings.dev')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after setup, it needs the app registry
+from tasksaathi.streams import TaskEventsApp  # noqa: E402
+
+# /api/tasks/events/ is served by TaskEventsApp, everything else by Django
+application = TaskEventsApp(django_application)
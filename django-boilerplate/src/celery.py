@@ -1,21 +1,42 @@
 import os
 from celery import Celery
 from celery import shared_task
-from django.conf import settings
+from celery.schedules import crontab
 # Set the default Django settings module for the 'celery' program.
 ENV = os.getenv('ENV', None)
 if ENV is not None and ENV == "prod":
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings.prod')
 else:
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings.dev')
-app = Celery('src', )
-app = Celery('tasks', broker=settings.CELERY_BROKER_URL, backend='rpc://')
+# broker, queues, routes and limits come from the CELERY_* settings. There is no result backend,
+# tasks that produce something store it themselves (ExportData)
+app = Celery('src')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django apps.py
 app.autodiscover_tasks()
 
+# periodic tasks, here rather than in the settings so that loading the settings doesn't import celery
+app.conf.beat_schedule = {
+    'demo-task': {
+        'task': 'src.celery.debug_task',
+        'schedule': crontab(hour="*/12")  # 12 hours
+    },
+    'reconcile-task-summaries': {
+        'task': 'tasksaathi.tasks.reconcile_task_summaries',
+        'schedule': crontab(hour=0, minute=5)  # nightly, right after tasks become overdue
+    },
+    'prune-task-tombstones': {
+        'task': 'tasksaathi.tasks.prune_task_tombstones',
+        'schedule': crontab(hour=1, minute=0)
+    },
+    'prune-api-logs': {
+        'task': 'atomicloops.tasks.prune_api_logs',
+        'schedule': crontab(hour=1, minute=30)
+    },
+}
+
 
 # @app.task(bind=True)
 @shared_task
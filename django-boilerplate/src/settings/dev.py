@@ -6,18 +6,28 @@ DEBUG = True
 ALLOWED_HOSTS = ["localhost", "127.0.0.1", "0.0.0.0"]
 
 DATABASES = {
-    "default": {
+    "default": database_settings({
         "ENGINE": credentials['dev']['DB_ENGINE'],
         "NAME": credentials['dev']['DB_NAME'],
         "USER": credentials['dev']['DB_USER'],
         "PASSWORD": credentials['dev']['DB_PASSWORD'],
         "HOST": credentials['dev']['DB_HOST'],  # set in docker-compose.yml
         "PORT": credentials['dev']['DB_PORT'],  # default postgres port
-    },
+    }),
 }
 
+# The primary itself in development, reads only go to it with DATABASE_REPLICAS = ['replica'].
+# The test runner creates it as a database of its own for the routing tests.
+DATABASES['replica'] = {**DATABASES['default']}
+if 'sqlite' not in DATABASES['default']['ENGINE']:
+    DATABASES['replica']['TEST'] = {'NAME': f"test_{DATABASES['default']['NAME']}_replica"}
+
 EMAIL = credentials['dev']["EMAIL"]
 PASSWORD = credentials['dev']["PASSWORD"]
+# the SMTP account of EMAIL_BACKEND (atomicloops.tasks.send_email, reminders)
+EMAIL_HOST_USER = EMAIL
+EMAIL_HOST_PASSWORD = PASSWORD
+DEFAULT_FROM_EMAIL = EMAIL
 
 # AWS credentials
 # DEV SECRET KEYS
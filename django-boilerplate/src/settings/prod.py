@@ -13,18 +13,31 @@ CORS_ALLOWED_ORIGINS = [
 
 
 DATABASES = {
-    "default": {
+    "default": database_settings({
         "ENGINE": credentials['prod']['DB_ENGINE'],
         "NAME": credentials['prod']['DB_NAME'],
         "USER": credentials['prod']['DB_USER'],
         "PASSWORD": credentials['prod']['DB_PASSWORD'],
         "HOST": credentials['prod']['DB_HOST'],  # set in docker-compose.yml
         "PORT": credentials['prod']['DB_PORT'],  # default postgres port
-    },
+    }),
 }
 
+# Streaming read replica, when the vault has one (DATABASE_REPLICAS in base.py)
+if credentials['prod'].get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        "HOST": credentials['prod']['DB_REPLICA_HOST'],
+        "PORT": credentials['prod'].get('DB_REPLICA_PORT', credentials['prod']['DB_PORT']),
+    }
+    DATABASE_REPLICAS = ['replica']
+
 EMAIL = credentials['prod']["EMAIL"]
 PASSWORD = credentials['prod']["PASSWORD"]
+# the SMTP account of EMAIL_BACKEND (atomicloops.tasks.send_email, reminders)
+EMAIL_HOST_USER = EMAIL
+EMAIL_HOST_PASSWORD = PASSWORD
+DEFAULT_FROM_EMAIL = EMAIL
 
 # AWS credentials
 
@@ -14,34 +14,45 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
+from django.views.static import serve
 from django.conf import settings
 from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from atomicloops.schema import LazySchemaView, get_cached_schema_view
 from rest_framework import views, generics
 # from django_otp.admin import OTPAdminSite
 
 
 # admin.site.__class__ = OTPAdminSite
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Snippets API",
-        default_version='v1',
-        url='http://example.net:8080/',
-        description="Test description",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@snippets.local"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=[permissions.AllowAny],
-)
+
+def build_schema_view():
+    from drf_yasg import openapi
+
+    return get_cached_schema_view(
+        openapi.Info(
+            title="Snippets API",
+            default_version='v1',
+            url='http://example.net:8080/',
+            description="Test description",
+            terms_of_service="https://www.google.com/policies/terms/",
+            contact=openapi.Contact(email="contact@snippets.local"),
+            license=openapi.License(name="BSD License"),
+        ),
+        public=True,
+        permission_classes=[permissions.AllowAny],
+    )
+
+
+# the spec is the generate-schema artifact or cached in memory, drf_yasg is imported by the
+# first request to it, see atomicloops.schema
+schema_view = LazySchemaView(build_schema_view)
 
 
 class Home(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
+    # no serializer to document
+    swagger_schema = None
 
     def get(self, request, *args, **kwargs):
         return views.Response(
@@ -65,4 +76,5 @@ urlpatterns = [
 if settings.DEBUG:
     urlpatterns += [
         path('__debug__/', include('debug_toolbar.urls')),
+        re_path(r'^storage/(?P<path>.*)$', serve, {'document_root': settings.LOCAL_STORAGE_DIR}),
     ]
@@ -1,15 +1,35 @@
 from django.contrib import admin
-from .models import Company, Task
+from atomicloops.admin import AtomicModelAdmin
+from .models import Company, Task, TaskSummary, TaskTombstone
 
 @admin.register(Company)
-class CompanyAdmin(admin.ModelAdmin):
+class CompanyAdmin(AtomicModelAdmin):
     list_display = ('name', 'userId', 'isVerified', 'createdAt', 'updatedAt')
     list_filter = ('isVerified',)
+    list_select_related = ('userId',)
     search_fields = ('name',)
+    autocomplete_fields = ('userId',)
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(AtomicModelAdmin):
     list_display = ('title', 'status', 'priority', 'dueDate', 'assignedTo', 'createdBy', 'companyId')
-    list_filter = ('status', 'priority')
+    # a date filter instead of date_hierarchy, whose links come from a DISTINCT over the whole table
+    list_filter = ('status', 'priority', 'createdAt')
+    list_select_related = ('assignedTo', 'createdBy', 'companyId')
     search_fields = ('title', 'description')
-    date_hierarchy = 'createdAt'
\ No newline at end of file
+    autocomplete_fields = ('assignedTo', 'createdBy', 'companyId')
+
+
+@admin.register(TaskSummary)
+class TaskSummaryAdmin(AtomicModelAdmin):
+    list_display = ('companyId', 'assignedTo', 'total', 'pending', 'inProgress', 'completed', 'overdue', 'updatedAt')
+    list_select_related = ('companyId', 'assignedTo')
+    readonly_fields = TaskSummary.COUNTER_FIELDS
+    autocomplete_fields = ('companyId', 'assignedTo')
+
+
+@admin.register(TaskTombstone)
+class TaskTombstoneAdmin(AtomicModelAdmin):
+    list_display = ('taskId', 'reason', 'companyId', 'assignedTo', 'createdAt')
+    list_filter = ('reason',)
+    search_fields = ('taskId',)
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class TasksaathiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'tasksaathi'
\ No newline at end of file
+    name = 'tasksaathi'
+
+    def ready(self):
+        from . import signals  # noqa: F401
\ No newline at end of file
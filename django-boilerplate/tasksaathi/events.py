@@ -0,0 +1,249 @@
+# Task change events pushed to dashboards over /api/tasks/events/
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Buffered events per connection, a client that falls further behind gets a resync event
+SUBSCRIPTION_QUEUE_SIZE = 100
+
+
+def company_channel(company_id):
+    return f"tasks.company.{company_id}"
+
+
+def user_channel(user_id):
+    return f"tasks.user.{user_id}"
+
+
+def task_channels(values):
+    return {company_channel(values['companyId_id']), user_channel(values['assignedTo_id'])}
+
+
+class Subscription:
+    """
+    One client connection's view of a set of channels. Messages are delivered by the
+    broker from any thread onto this connection's event loop.
+    """
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = set(channels)
+        self.queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        self.loop = None
+        self.overflowed = False
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        await self.broker.attach(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.broker.detach(self)
+
+    def deliver(self, message):
+        # always called on self.loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait({'event': 'resync'})
+
+    async def get(self):
+        message = await self.queue.get()
+        if message.get('event') == 'resync':
+            self.overflowed = False
+        return message
+
+
+class BaseBroker:
+    """
+    Process wide fan out of channel messages to local subscriptions. Backends only
+    implement publish() and the hooks called when a channel gains its first or
+    loses its last local subscriber, so a process holds one upstream subscription
+    per channel no matter how many connections listen on it.
+    """
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def publish_many(self, messages):
+        for channel, message in messages:
+            self.publish(channel, message)
+
+    async def channel_added(self, channel):
+        pass
+
+    async def channel_removed(self, channel):
+        pass
+
+    async def attach(self, subscription):
+        added = []
+        with self.lock:
+            for channel in subscription.channels:
+                if not self.subscriptions[channel]:
+                    added.append(channel)
+                self.subscriptions[channel].add(subscription)
+        for channel in added:
+            await self.channel_added(channel)
+
+    async def detach(self, subscription):
+        removed = []
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].discard(subscription)
+                if not self.subscriptions[channel]:
+                    del self.subscriptions[channel]
+                    removed.append(channel)
+        for channel in removed:
+            await self.channel_removed(channel)
+
+    def dispatch(self, channel, message):
+        with self.lock:
+            targets = list(self.subscriptions.get(channel, ()))
+        for subscription in targets:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+
+    def connection_count(self):
+        with self.lock:
+            return len({subscription for subscriptions in self.subscriptions.values() for subscription in subscriptions})
+
+
+class InMemoryBroker(BaseBroker):
+    """Single process broker for tests and runserver, publish() delivers directly."""
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+
+class RedisBroker(BaseBroker):
+    """
+    Redis pub/sub broker. Publishing uses a lazily created sync client (signals run in
+    sync code), listening uses one redis.asyncio pub/sub connection per process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.url = settings.TASK_EVENTS_REDIS_URL
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.pubsub = None
+        self.reader = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import redis
+                    self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    def publish_many(self, messages):
+        pipeline = self.client.pipeline(transaction=False)
+        for channel, message in messages:
+            pipeline.publish(channel, json.dumps(message))
+        pipeline.execute()
+
+    async def channel_added(self, channel):
+        if self.pubsub is None:
+            import redis.asyncio
+            self.pubsub = redis.asyncio.Redis.from_url(self.url).pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(channel)
+        if self.reader is None:
+            self.reader = asyncio.create_task(self.read())
+
+    async def channel_removed(self, channel):
+        if self.pubsub is not None:
+            await self.pubsub.unsubscribe(channel)
+
+    async def read(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except Exception:
+                logger.exception('Task events reader failed, reconnecting')
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            channel = message['channel'].decode() if isinstance(message['channel'], bytes) else message['channel']
+            self.dispatch(channel, json.loads(message['data']))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process wide broker configured by TASK_EVENTS_BROKER."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = getattr(settings, 'TASK_EVENTS_BROKER', 'tasksaathi.events.RedisBroker')
+                _broker = import_string(backend)()
+    return _broker
+
+
+def reset_broker():
+    global _broker, _broker_lock
+    _broker = None
+    _broker_lock = threading.Lock()
+
+
+# redis connections are not fork safe, so prefork children build their own
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_broker)
+
+
+def task_message(event, task_id, values):
+    return {
+        'event': event,
+        'id': str(task_id),
+        'status': values['status'],
+        'priority': values['priority'],
+        'dueDate': str(values['dueDate']) if values['dueDate'] else None,
+        'companyId': str(values['companyId_id']),
+        'assignedTo': str(values['assignedTo_id']),
+    }
+
+
+def publish_task_changes(changes):
+    """
+    Publish `task.updated` to the company and assignee of each changed task and
+    `task.removed` to the channels that no longer see it. `changes` is an iterable of
+    (task_id, old_values, new_values), new_values is None for a deleted task.
+    Failures are logged, a missed event only delays dashboards until their next sync.
+    """
+    messages = []
+    for task_id, old_values, new_values in changes:
+        current = task_channels(new_values) if new_values is not None else set()
+        if new_values is not None:
+            message = task_message('task.updated', task_id, new_values)
+            messages += [(channel, message) for channel in sorted(current)]
+        if old_values is not None:
+            message = task_message('task.removed', task_id, old_values)
+            messages += [(channel, message) for channel in sorted(task_channels(old_values) - current)]
+    if not messages:
+        return
+    try:
+        get_broker().publish_many(messages)
+    except Exception:
+        logger.exception('Publishing %s task events failed', len(messages))
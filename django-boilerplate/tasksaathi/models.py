@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction, connections, IntegrityError
+from django.db.models import F
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from atomicloops.models import AtomicBaseModel
 from users.models import Users
@@ -38,6 +40,43 @@ class Company(AtomicBaseModel):
         return self.name
 
 
+class TaskQuerySet(models.QuerySet):
+
+    def transition_status(self, status):
+        """
+        Set `status` on every task of this queryset not already in it, in one scoped UPDATE.
+        Returns the changed rows as dicts with the previous status, for the summary counters.
+        """
+        columns = ('id', 'status', 'priority', 'dueDate', 'companyId_id', 'assignedTo_id')
+        scoped = self.exclude(status=status).order_by()
+        now = timezone.now()
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            with transaction.atomic(using=self.db):
+                rows = list(scoped.select_for_update().values(*columns))
+                self.model._base_manager.using(self.db).filter(id__in=[row['id'] for row in rows]).update(
+                    status=status, updatedAt=now
+                )
+            return rows
+
+        # PostgreSQL: UPDATE ... FROM (scoped subquery) RETURNING gives back the old status in one statement
+        opts = self.model._meta
+        quote = connection.ops.quote_name
+        column = {field.attname: quote(field.column) for field in opts.concrete_fields}
+        subquery, params = scoped.select_for_update().values('id', 'companyId_id', 'status').query.sql_with_params()
+        returning = ', '.join('old.status' if name == 'status' else f"task.{column[name]}" for name in columns)
+        # joining on the company too lets a table partitioned by company (partition-tasks) prune partitions
+        sql = (
+            f"UPDATE {quote(opts.db_table)} AS task SET {column['status']} = %s, {column['updatedAt']} = %s "
+            f"FROM ({subquery}) AS old (id, company, status) "
+            f"WHERE task.{column['id']} = old.id AND task.{column['companyId_id']} = old.company "
+            f"RETURNING {returning}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [status, now, *params])
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
 class Task(AtomicBaseModel):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -59,11 +98,152 @@ class Task(AtomicBaseModel):
     assignedTo = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='assigned_tasks')
     createdBy = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='created_tasks')
     companyId = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='tasks')
+
+    objects = TaskQuerySet.as_manager()
     
     class Meta:
         db_table = "task"
         verbose_name_plural = "tasks"
         managed = True
+        indexes = [
+            # the delta sync keyset (sync.changed_since) within an employer's or an employee's scope
+            models.Index(fields=["companyId", "updatedAt", "id"], name="task_company_sync"),
+            models.Index(fields=["assignedTo", "updatedAt", "id"], name="task_assignee_sync"),
+        ]
         
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values so the summary signals can diff without a query
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
+class TaskSummary(AtomicBaseModel):
+    """
+    Per company, per assignee task counters backing the dashboard summary.
+    Kept up to date from Task save/delete signals and reconciled nightly.
+    """
+    STATUS_COUNTERS = {
+        'pending': 'pending',
+        'in_progress': 'inProgress',
+        'completed': 'completed',
+    }
+    PRIORITY_COUNTERS = {
+        'low': 'lowPriority',
+        'medium': 'mediumPriority',
+        'high': 'highPriority',
+    }
+    COUNTER_FIELDS = ('total', *STATUS_COUNTERS.values(), *PRIORITY_COUNTERS.values(), 'overdue')
+
+    companyId = models.ForeignKey(
+        Company,
+        verbose_name=_("Company Id"),
+        related_name="task_summaries",
+        db_column="company_id",
+        on_delete=models.CASCADE,
+    )
+    assignedTo = models.ForeignKey(
+        Users,
+        verbose_name=_("Assigned To"),
+        related_name="task_summaries",
+        db_column="assigned_to",
+        on_delete=models.CASCADE,
+    )
+    total = models.IntegerField(verbose_name=_("Total"), default=0, db_column="total")
+    pending = models.IntegerField(verbose_name=_("Pending"), default=0, db_column="pending")
+    inProgress = models.IntegerField(verbose_name=_("In Progress"), default=0, db_column="in_progress")
+    completed = models.IntegerField(verbose_name=_("Completed"), default=0, db_column="completed")
+    lowPriority = models.IntegerField(verbose_name=_("Low Priority"), default=0, db_column="low_priority")
+    mediumPriority = models.IntegerField(verbose_name=_("Medium Priority"), default=0, db_column="medium_priority")
+    highPriority = models.IntegerField(verbose_name=_("High Priority"), default=0, db_column="high_priority")
+    overdue = models.IntegerField(verbose_name=_("Overdue"), default=0, db_column="overdue")
+
+    class Meta:
+        db_table = "task_summary"
+        verbose_name_plural = "task summaries"
+        managed = True
+        constraints = [
+            models.UniqueConstraint(fields=["companyId", "assignedTo"], name="task_summary_company_assignee"),
+        ]
+
+    @classmethod
+    def counters(cls, status, priority, due_date, today=None):
+        """Counter increments contributed by one task with the given values."""
+        today = today or timezone.localdate()
+        counters = {'total': 1}
+        if status in cls.STATUS_COUNTERS:
+            counters[cls.STATUS_COUNTERS[status]] = 1
+        if priority in cls.PRIORITY_COUNTERS:
+            counters[cls.PRIORITY_COUNTERS[priority]] = 1
+        if due_date is not None and due_date < today and status != 'completed':
+            counters['overdue'] = 1
+        return counters
+
+    @classmethod
+    def apply_delta(cls, company_id, assignee_id, delta):
+        """Add `delta` ({counter: n}) to the row of (company_id, assignee_id), creating it if needed."""
+        delta = {key: value for key, value in delta.items() if value}
+        if not delta:
+            return
+        rows = cls.objects.filter(companyId_id=company_id, assignedTo_id=assignee_id)
+        updates = {key: F(key) + value for key, value in delta.items()}
+        if rows.update(updatedAt=timezone.now(), **updates):
+            return
+        if all(value < 0 for value in delta.values()):
+            # nothing to take away from, e.g. the assignee or company is being deleted with its summary
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(companyId_id=company_id, assignedTo_id=assignee_id, **delta)
+        except IntegrityError:
+            # created concurrently
+            rows.update(updatedAt=timezone.now(), **updates)
+
+
+class TaskTombstone(AtomicBaseModel):
+    """
+    Compact log of tasks that left someone's view, so delta sync clients can drop them.
+    Holds the values the task had before it was deleted, reassigned or moved, as plain
+    ids so rows outlive the company and users. Pruned after TASK_TOMBSTONE_RETENTION_DAYS.
+    """
+    REASON_CHOICES = (
+        ('deleted', 'Deleted'),
+        ('reassigned', 'Reassigned'),
+        ('moved', 'Moved'),
+    )
+
+    taskId = models.UUIDField(verbose_name=_("Task Id"), db_column="task_id")
+    companyId = models.UUIDField(verbose_name=_("Company Id"), db_column="company_id")
+    assignedTo = models.UUIDField(verbose_name=_("Assigned To"), db_column="assigned_to")
+    reason = models.CharField(verbose_name=_("Reason"), max_length=20, choices=REASON_CHOICES, db_column="reason")
+
+    class Meta:
+        db_table = "task_tombstone"
+        verbose_name_plural = "task tombstones"
+        managed = True
+        indexes = [
+            models.Index(fields=["companyId", "createdAt"], name="task_tombstone_company"),
+            models.Index(fields=["assignedTo", "createdAt"], name="task_tombstone_assignee"),
+        ]
+
+    @classmethod
+    def record(cls, task_id, old_values, new_values=None):
+        """Log the tombstones implied by a task going from old_values to new_values (None when deleted)."""
+        if new_values is None:
+            reason = 'deleted'
+        elif old_values['companyId_id'] != new_values['companyId_id']:
+            reason = 'moved'
+        elif old_values['assignedTo_id'] != new_values['assignedTo_id']:
+            reason = 'reassigned'
+        else:
+            return None
+        return cls.objects.create(
+            taskId=task_id,
+            companyId=old_values['companyId_id'],
+            assignedTo=old_values['assignedTo_id'],
+            reason=reason,
+        )
@@ -0,0 +1,46 @@
+# Push notifications for task assignment and status changes, sent by tasks.send_task_notifications
+
+ASSIGNED = 'assigned'
+STATUS = 'status'
+
+MESSAGES = {
+    ASSIGNED: {
+        'en': ('New task assigned', '{title}'),
+        'fr': ('Nouvelle tâche assignée', '{title}'),
+    },
+    STATUS: {
+        'en': ('Task status updated', '{title} is now {status}'),
+        'fr': ('Statut de tâche mis à jour', '{title} : {status}'),
+    },
+}
+
+STATUS_LABELS = {
+    'en': {'pending': 'pending', 'in_progress': 'in progress', 'completed': 'completed'},
+    'fr': {'pending': 'en attente', 'in_progress': 'en cours', 'completed': 'terminée'},
+}
+
+
+def task_notifications(event, tasks):
+    """(user_ids, {language: (title, body)}, data) for each task dict, as users.notifications expects."""
+    for task in tasks:
+        if event == ASSIGNED:
+            user_ids = {task['assignedTo_id']}
+        else:
+            user_ids = {task['assignedTo_id'], task['createdBy_id']}
+        messages = {
+            language: (title, body.format(
+                title=task['title'], status=STATUS_LABELS[language].get(task['status'], task['status'])
+            ))
+            for language, (title, body) in MESSAGES[event].items()
+        }
+        data = {'event': f'task.{event}', 'taskId': str(task['id']), 'status': task['status']}
+        yield user_ids, messages, data
+
+
+def notification_event(old_values, new_values):
+    """Which notification, if any, a saved task should trigger."""
+    if old_values is None or old_values['assignedTo_id'] != new_values['assignedTo_id']:
+        return ASSIGNED
+    if old_values['status'] != new_values['status']:
+        return STATUS
+    return None
@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from atomicloops.permissions import get_principal
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -9,11 +10,12 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
             
-        # Write permissions are only allowed to the owner
-        if hasattr(obj, 'userId'):
-            return obj.userId == request.user
-        elif hasattr(obj, 'createdBy'):
-            return obj.createdBy == request.user
+        # Write permissions are only allowed to the owner, compared by foreign key id
+        principal = get_principal(request)
+        if hasattr(obj, 'userId_id'):
+            return principal.owns(obj)
+        elif hasattr(obj, 'createdBy_id'):
+            return principal.owns(obj, 'createdBy')
         return False
 
 class IsCompanyUser(permissions.BasePermission):
@@ -24,6 +26,7 @@ class IsCompanyUser(permissions.BasePermission):
         return request.user and request.user.is_authenticated
         
     def has_object_permission(self, request, view, obj):
-        if hasattr(obj, 'companyId'):
-            return obj.companyId.userId == request.user
-        return obj.userId == request.user
\ No newline at end of file
+        principal = get_principal(request)
+        if hasattr(obj, 'companyId_id'):
+            return principal.companyId is not None and obj.companyId_id == principal.companyId
+        return principal.owns(obj)
\ No newline at end of file
@@ -6,7 +6,7 @@ from users.serializers import UsersSerializer
 
 
 class CompanySerializer(AtomicSerializer):
-    userName = serializers.CharField(source='userId.username', read_only=True)
+    userName = serializers.SerializerMethodField(read_only=True)
     userEmail = serializers.CharField(source='userId.email', read_only=True)
     
     class Meta:
@@ -32,6 +32,9 @@ class CompanySerializer(AtomicSerializer):
             "isVerified",
         ]
 
+    def get_userName(self, obj):
+        return f"{obj.userId.firstName} {obj.userId.lastName}"
+
 
 class TaskSerializer(AtomicSerializer):
     assignedToName = serializers.SerializerMethodField(read_only=True)
@@ -0,0 +1,96 @@
+import logging
+from collections import Counter
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .events import publish_task_changes
+from .models import Task, TaskSummary, TaskTombstone
+from .notifications import notification_event
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ('status', 'priority', 'dueDate', 'companyId_id', 'assignedTo_id')
+
+
+def _summary_values(values):
+    return {field: values[field] for field in SUMMARY_FIELDS}
+
+
+def _contribution(values):
+    """{(company_id, assignee_id): counters} for a task with the given values."""
+    key = (values['companyId_id'], values['assignedTo_id'])
+    return key, Counter(TaskSummary.counters(values['status'], values['priority'], values['dueDate']))
+
+
+def apply_summary_changes(changes):
+    """
+    Update the task summary counters for tasks going from old values to new values.
+    `changes` is an iterable of (old_values, new_values), either may be None.
+    Deltas are merged so every (company, assignee) row is updated once.
+    """
+    deltas = {}
+    for old_values, new_values in changes:
+        if old_values is not None:
+            key, counters = _contribution(old_values)
+            deltas.setdefault(key, Counter()).subtract(counters)
+        if new_values is not None:
+            key, counters = _contribution(new_values)
+            deltas.setdefault(key, Counter()).update(counters)
+    for (company_id, assignee_id), delta in deltas.items():
+        TaskSummary.apply_delta(company_id, assignee_id, delta)
+
+
+def apply_summary_change(old_values, new_values):
+    apply_summary_changes([(old_values, new_values)])
+
+
+def notify_task_change(event, task_ids):
+    """Queue push notifications, a broker outage must not fail the request that changed the tasks."""
+    # celery is imported by the first change, not with the signal handlers at startup
+    from .tasks import send_task_notifications
+
+    try:
+        send_task_notifications.delay(event, [str(task_id) for task_id in task_ids])
+    except Exception:
+        logger.exception('Queueing %s notifications for %s tasks failed', event, len(task_ids))
+
+
+@receiver(pre_save, sender=Task)
+def task_pre_save(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_values', None)
+    if instance._state.adding or (loaded is not None and all(field in loaded for field in SUMMARY_FIELDS)):
+        return
+    # Instance was not loaded from the database (or only partially), read the stored values
+    stored = Task.objects.filter(pk=instance.pk).values(*SUMMARY_FIELDS).first()
+    instance._loaded_values = {**(loaded or {}), **(stored or {})} if stored else None
+
+
+@receiver(post_save, sender=Task)
+def task_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = None if created else getattr(instance, '_loaded_values', None)
+    old_values = _summary_values(loaded) if loaded else None
+    new_values = {field: getattr(instance, field) for field in SUMMARY_FIELDS}
+    apply_summary_change(old_values, new_values)
+    if old_values is not None:
+        TaskTombstone.record(instance.pk, old_values, new_values)
+    change = (instance.pk, old_values, new_values)
+    transaction.on_commit(lambda: publish_task_changes([change]))
+    event = notification_event(old_values, new_values)
+    if event is not None:
+        transaction.on_commit(lambda: notify_task_change(event, [instance.pk]))
+    instance._loaded_values = {**(loaded or {}), **new_values}
+
+
+@receiver(post_delete, sender=Task)
+def task_post_delete(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded and all(field in loaded for field in SUMMARY_FIELDS):
+        values = _summary_values(loaded)
+    else:
+        values = {field: getattr(instance, field) for field in SUMMARY_FIELDS}
+    apply_summary_change(values, None)
+    TaskTombstone.record(instance.pk, values)
+    change = (instance.pk, values, None)
+    transaction.on_commit(lambda: publish_task_changes([change]))
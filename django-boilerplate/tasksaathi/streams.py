@@ -0,0 +1,204 @@
+# Server-Sent Events endpoint for task changes.
+# Under uvicorn (src.asgi) TaskEventsApp serves it outside the Django middleware stack, the
+# task_events view is the same stream for runserver and the test client.
+import asyncio
+import io
+import json
+import secrets
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from atomicloops.authentication import AtomicJWTAuthentication
+from .events import Subscription, company_channel, get_broker, user_channel
+from .models import Company
+
+# Comment lines keep proxies and load balancers from closing idle streams
+KEEPALIVE_SECONDS = 25
+RETRY_MILLISECONDS = 5000
+
+
+def error_body(message):
+    return {'data': {}, 'error': {'message': message}, 'isSuccess': False}
+
+
+def error(message, status):
+    return JsonResponse(error_body(message), status=status)
+
+
+def ticket_key(ticket):
+    return f'streams:ticket:{ticket}'
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def task_events_ticket(request):
+    """
+    Ticket opening the task events stream once, within TASK_EVENTS_TICKET_SECONDS. EventSource
+    can't set headers and query strings end up in access logs, so the JWT never goes in the URL.
+    """
+    ticket = secrets.token_urlsafe(32)
+    seconds = settings.TASK_EVENTS_TICKET_SECONDS
+    cache.set(ticket_key(ticket), str(request.user.pk), seconds)
+    return Response({'ticket': ticket, 'expiresIn': seconds})
+
+
+def redeem_ticket(ticket):
+    key = ticket_key(ticket)
+    user_id = cache.get(key)
+    # of two requests reading the same ticket only the one that deletes it gets through
+    if user_id is None or not cache.delete(key):
+        raise AuthenticationFailed('Invalid or expired ticket')
+    user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise AuthenticationFailed('User not found')
+    return user
+
+
+def authenticate(request):
+    """JWT from the Authorization header or a task_events_ticket in the `ticket` query parameter."""
+    auth = AtomicJWTAuthentication()
+    header = auth.get_header(request)
+    if header:
+        raw_token = auth.get_raw_token(header)
+        return auth.get_user(auth.get_validated_token(raw_token)) if raw_token else None
+    ticket = request.GET.get('ticket')
+    return redeem_ticket(ticket) if ticket else None
+
+
+def get_channels(user):
+    """Same scope as TaskViewSet.get_queryset: employers follow their company, employees their tasks."""
+    if user.userRole == "EMPLOYER":
+        company_id = Company.objects.filter(userId=user).values_list('id', flat=True).first()
+        return [company_channel(company_id)] if company_id else []
+    if user.userRole == "EMPLOYEE":
+        return [user_channel(user.id)]
+    return []
+
+
+def get_stream_user_channels(request):
+    """(user, channels) for the request, releasing the database connection afterwards."""
+    try:
+        user = authenticate(request)
+        return user, get_channels(user) if user is not None else []
+    finally:
+        # Streams stay open for hours, they must not each pin a database connection
+        for connection in connections.all(initialized_only=True):
+            if not connection.in_atomic_block:
+                connection.close()
+
+
+async def event_stream(subscription):
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    async with subscription:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {message['event']}\ndata: {json.dumps(message)}\n\n"
+
+
+async def open_stream(request, thread_sensitive=True):
+    """(channels, None) for an authorised request, else (None, (message, status))."""
+    try:
+        user, channels = await sync_to_async(get_stream_user_channels, thread_sensitive=thread_sensitive)(request)
+    except (InvalidToken, TokenError, APIException) as e:
+        return None, (str(e), 401)
+    if user is None:
+        return None, ('Authentication credentials were not provided.', 401)
+    if not channels:
+        return None, ('No company found for this user', 404)
+    return channels, None
+
+
+async def task_events(request):
+    """Stream task.updated / task.removed / resync events for the caller's tasks."""
+    channels, failure = await open_stream(request)
+    if failure:
+        return error(*failure)
+
+    response = StreamingHttpResponse(event_stream(Subscription(get_broker(), channels)),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx would otherwise buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class TaskEventsApp:
+    """
+    ASGI wrapper serving the task events stream directly and everything else through Django.
+    Behind Django's handler every open stream would keep its own sync middleware thread alive
+    for its whole life, here the auth lookup runs on the shared executor and an idle stream
+    costs a socket, a queue and a coroutine.
+    """
+
+    # run the auth lookup on the shared executor instead of a per request thread
+    thread_sensitive = False
+
+    def __init__(self, application):
+        self.application = application
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.get_path():
+            return await self.stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    def get_path(self):
+        if self.path is None:
+            self.path = reverse('task-events')
+        return self.path
+
+    async def stream(self, scope, receive, send):
+        request = ASGIRequest(scope, io.BytesIO())
+        headers = cors_headers(request.META.get('HTTP_ORIGIN'))
+        channels, failure = await open_stream(request, thread_sensitive=self.thread_sensitive)
+        if failure:
+            message, status = failure
+            await send({
+                'type': 'http.response.start', 'status': status,
+                'headers': headers + [(b'content-type', b'application/json')],
+            })
+            await send({'type': 'http.response.body', 'body': json.dumps(error_body(message)).encode()})
+            return
+
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': headers + [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        sender = asyncio.create_task(self.send_events(send, Subscription(get_broker(), channels)))
+        try:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        finally:
+            sender.cancel()
+
+    async def send_events(self, send, subscription):
+        async for chunk in event_stream(subscription):
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+
+def cors_headers(origin):
+    # corsheaders' middleware doesn't run for TaskEventsApp
+    if not origin:
+        return []
+    allow_all = getattr(settings, 'CORS_ORIGIN_ALLOW_ALL', False) or getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False)
+    if allow_all or origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', []):
+        return [(b'access-control-allow-origin', origin.encode()), (b'vary', b'Origin')]
+    return []
@@ -1,8 +1,16 @@
 from celery import shared_task
+# shared tasks are sent with the current app, src no longer imports the project's eagerly
+import src.celery  # noqa: F401
 from django.core.mail import send_mail
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import Task
+from atomicloops.routers import replica_reads
+from users.notifications import send_notifications
+from .models import Task, TaskSummary, TaskTombstone
+from .notifications import task_notifications
 
 @shared_task
 def send_task_reminder_emails():
@@ -10,7 +18,9 @@ def send_task_reminder_emails():
     Send reminder emails for tasks due in the next 24 hours
     """
     tomorrow = datetime.now().date() + timedelta(days=1)
-    tasks_due_soon = Task.objects.filter(dueDate=tomorrow, status='pending')
+    # a report over every company, a replica lagging a little is fine
+    with replica_reads():
+        tasks_due_soon = list(Task.objects.filter(dueDate=tomorrow, status='pending').select_related('assignedTo'))
     
     for task in tasks_due_soon:
         if task.assignedTo.email:
@@ -22,7 +32,7 @@ def send_task_reminder_emails():
                 fail_silently=False,
             )
     
-    return f"Sent {tasks_due_soon.count()} task reminder emails"
+    return f"Sent {len(tasks_due_soon)} task reminder emails"
 
 @shared_task
 def clean_completed_tasks(days=30):
@@ -39,4 +49,85 @@ def clean_completed_tasks(days=30):
     # In a real implementation, you might move these to an archive table
     # For now, we'll just log the count
     
-    return f"Processed {count} old completed tasks"
\ No newline at end of file
+    return f"Processed {count} old completed tasks"
+
+
+@shared_task
+def reconcile_task_summaries():
+    """
+    Rebuild the task summary counters from the task table: one INSERT ... SELECT ... GROUP BY
+    ... ON CONFLICT DO UPDATE, then one DELETE of the rows no task backs any more. Also picks up
+    tasks that became overdue since the last run.
+    """
+    today = timezone.localdate()
+    counters = {
+        'total': Count('id'),
+        'overdue': Count('id', filter=Q(dueDate__lt=today) & ~Q(status='completed')),
+    }
+    for value, field in TaskSummary.STATUS_COUNTERS.items():
+        counters[field] = Count('id', filter=Q(status=value))
+    for value, field in TaskSummary.PRIORITY_COUNTERS.items():
+        counters[field] = Count('id', filter=Q(priority=value))
+    snapshot = (
+        Task.objects.order_by()
+        .values(summaryCompany=F('companyId'), summaryAssignee=F('assignedTo'))
+        .annotate(**counters)
+    )
+    select, params = snapshot.query.sql_with_params()
+
+    quote = connection.ops.quote_name
+    meta = TaskSummary._meta
+    fields = ('id', 'createdAt', 'updatedAt', 'companyId', 'assignedTo', *TaskSummary.COUNTER_FIELDS)
+    column = {field: quote(meta.get_field(field).column) for field in fields}
+    new_id = 'md5(random()::text || clock_timestamp()::text)::uuid' if connection.vendor == 'postgresql' \
+        else 'lower(hex(randomblob(16)))'
+    counter_columns = [column[field] for field in TaskSummary.COUNTER_FIELDS]
+    upsert = f"""
+        INSERT INTO {quote(meta.db_table)}
+            ({column['id']}, {column['createdAt']}, {column['updatedAt']}, {column['companyId']},
+             {column['assignedTo']}, {', '.join(counter_columns)})
+        SELECT {new_id}, %s, %s, snapshot.{quote('summaryCompany')}, snapshot.{quote('summaryAssignee')},
+               {', '.join(f'snapshot.{quote(field)}' for field in TaskSummary.COUNTER_FIELDS)}
+        FROM ({select}) snapshot
+        WHERE true
+        ON CONFLICT ({column['companyId']}, {column['assignedTo']}) DO UPDATE SET
+            {', '.join(f'{name} = EXCLUDED.{name}' for name in [column['updatedAt'], *counter_columns])}
+    """
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # signals add their deltas with UPDATE (ROW EXCLUSIVE), this waits for the transactions
+            # that did and holds off new ones until the snapshot below is written back, so counts
+            # read here and deltas applied meanwhile can't overwrite each other
+            cursor.execute(f'LOCK TABLE {quote(meta.db_table)} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute(upsert, (now, now, *params))
+        reconciled = cursor.rowcount
+        # rows of assignees that no longer have any task in the company
+        TaskSummary.objects.filter(
+            ~Exists(Task.objects.filter(companyId=OuterRef('companyId'), assignedTo=OuterRef('assignedTo')))
+        ).delete()
+
+    return f"Reconciled {reconciled} task summaries"
+
+
+@shared_task
+def prune_task_tombstones():
+    """
+    Delete tombstones older than the delta sync retention window.
+    Clients with an older cursor get 410 and resync from scratch.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.TASK_TOMBSTONE_RETENTION_DAYS)
+    count, _ = TaskTombstone.objects.filter(createdAt__lt=cutoff).delete()
+    return f"Pruned {count} task tombstones"
+
+
+@shared_task(ignore_result=True)
+def send_task_notifications(event, task_ids):
+    """
+    Push an assignment or status notification for each task to its users' devices.
+    Routed to the notifications queue (CELERY_TASK_ROUTES) so slow FCM calls don't hold
+    up the default workers.
+    """
+    tasks = Task.objects.filter(id__in=task_ids).values('id', 'title', 'status', 'assignedTo_id', 'createdBy_id')
+    stats = send_notifications(task_notifications(event, tasks))
+    return f"Sent {event} notifications for {len(task_ids)} tasks: {stats}"
\ No newline at end of file
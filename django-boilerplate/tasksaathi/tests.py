@@ -0,0 +1,993 @@
+import asyncio
+import io
+import threading
+import uuid
+from datetime import timedelta
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db.models import F
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from rest_framework.views import APIView
+from atomicloops.partitioning import get_stage
+from atomicloops.permissions import IsOwnerOrAdminOrReadOnly
+from atomicloops.querybudget import QUERY_BUDGET_ROWS, QueryBudgetMixin
+from atomicloops.routers import is_pinned, replica_reads
+from users.models import Users, UsersDevices
+from users.notifications import send_notifications
+from utils.push import FAILED, INVALID_TOKEN, MULTICAST_LIMIT, SENT, get_push_client, reset_push_client
+from rest_framework_simplejwt.tokens import AccessToken
+from .events import SUBSCRIPTION_QUEUE_SIZE, Subscription, company_channel, get_broker, publish_task_changes, reset_broker, user_channel
+from .models import Company, Task, TaskSummary, TaskTombstone
+from .notifications import ASSIGNED, STATUS
+from .permissions import IsCompanyUser
+from .streams import TaskEventsApp
+from .sync import encode_cursor
+from .tasks import reconcile_task_summaries, send_task_notifications
+
+EMPLOYER_ID = uuid.UUID('00000000-0000-4000-8000-000000000001')
+COMPANY_ID = uuid.UUID('00000000-0000-4000-8000-000000000002')
+
+
+class TaskStatusQueryBudgetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.employee = Users.objects.create_user(
+            email='employee@test.com', password='test', firstName='Emp', lastName='Loyee'
+        )
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+
+    def setUp(self):
+        self.client.force_authenticate(self.employer)
+
+    def create_tasks(self, count):
+        for index in range(count):
+            Task.objects.create(
+                title=f'task {index}', assignedTo=self.employee, createdBy=self.employer, companyId=self.company
+            )
+        return list(Task.objects.order_by('createdAt').values_list('id', flat=True))
+
+    def summary(self):
+        return TaskSummary.objects.get(companyId=self.company, assignedTo=self.employee)
+
+    def bulk_status(self, ids, status):
+        return self.client.post(
+            '/api/tasks/bulk-status/', {'ids': [str(pk) for pk in ids], 'status': status},
+            format='json', HTTP_HOST='localhost'
+        )
+
+    def test_update_status_query_budget(self):
+        task_id = self.create_tasks(1)[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/tasks/{task_id}/update-status/', {'status': 'completed'},
+                format='json', HTTP_HOST='localhost'
+            )
+        self.assertEqual(response.status_code, 200)
+        # company lookup, task fetch, UPDATE, summary counters (2 rows) and savepoints
+        self.assertLessEqual(len(queries), 8)
+        update = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "task" ')]
+        self.assertEqual(len(update), 1)
+        self.assertNotIn('"title"', update[0])
+        self.assertEqual(self.summary().completed, 1)
+
+    def test_bulk_status_query_budget_is_constant(self):
+        ids = self.create_tasks(60)
+        with CaptureQueriesContext(connection) as small:
+            response = self.bulk_status(ids[:5], 'completed')
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as large:
+            response = self.bulk_status(ids[5:], 'completed')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ids']), 55)
+        self.assertLessEqual(len(large), 10)
+        self.assertEqual(len(small), len(large))
+
+        summary = self.summary()
+        self.assertEqual((summary.total, summary.pending, summary.completed), (60, 0, 60))
+
+    def test_bulk_status_skips_unchanged_and_foreign_tasks(self):
+        ids = self.create_tasks(3)
+        other = Users.objects.create_user(
+            email='other@test.com', password='test', firstName='Oth', lastName='Er', userRole='EMPLOYER'
+        )
+        other_company = Company.objects.create(name='Other', userId=other)
+        foreign = Task.objects.create(title='foreign', assignedTo=other, createdBy=other, companyId=other_company)
+        self.bulk_status(ids[:1], 'completed')
+
+        response = self.bulk_status(ids + [foreign.id], 'completed')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['ids']), set(ids[1:]))
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'pending')
+        self.assertEqual(self.summary().completed, 3)
+
+    def test_bulk_status_validation(self):
+        self.assertEqual(self.bulk_status([], 'completed').status_code, 400)
+        self.assertEqual(self.bulk_status(['not-a-uuid'], 'completed').status_code, 400)
+        self.assertEqual(self.bulk_status(self.create_tasks(1), 'unknown').status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+@mock.patch('tasksaathi.signals.notify_task_change')
+class TaskSummaryReconcileTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.employees = [
+            Users.objects.create_user(email=f'employee{index}@test.com', password='test', firstName='Emp',
+                                      lastName=f'{index}')
+            for index in range(2)
+        ]
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+
+    def expected(self):
+        counters = {}
+        for task in Task.objects.all():
+            row = counters.setdefault((task.companyId_id, task.assignedTo_id), dict.fromkeys(TaskSummary.COUNTER_FIELDS, 0))
+            for field, value in TaskSummary.counters(task.status, task.priority, task.dueDate).items():
+                row[field] += value
+        return counters
+
+    def summaries(self):
+        # rows emptied by deltas stay at zero until the next reconcile
+        return {
+            (row.pop('companyId'), row.pop('assignedTo')): row
+            for row in TaskSummary.objects.filter(total__gt=0).values('companyId', 'assignedTo', *TaskSummary.COUNTER_FIELDS)
+        }
+
+    def test_rebuilds_counters_in_sql(self, notify):
+        for index, (status, priority) in enumerate([('pending', 'high'), ('completed', 'low'), ('in_progress', 'medium')]):
+            Task.objects.create(title=f'task {index}', status=status, priority=priority, assignedTo=self.employees[index % 2],
+                                createdBy=self.employer, companyId=self.company)
+        # overdue since, drifted counters and a row no task backs any more
+        Task.objects.filter(status='pending').update(dueDate=timezone.localdate() - timedelta(days=1))
+        TaskSummary.objects.update(total=F('total') + 5, overdue=0)
+        TaskSummary.objects.create(companyId=self.company, assignedTo=self.employer, total=2, pending=2)
+
+        with CaptureQueriesContext(connection) as queries:
+            reconcile_task_summaries()
+        # the lock on PostgreSQL, the upsert and the delete, whatever the number of rows
+        statements = [query['sql'].split()[0] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(statements, ['LOCK', 'INSERT', 'DELETE'] if connection.vendor == 'postgresql' else ['INSERT', 'DELETE'])
+        self.assertEqual(self.summaries(), self.expected())
+        self.assertEqual(self.summaries()[(self.company.id, self.employees[0].id)]['overdue'], 1)
+
+    def test_deltas_after_reconcile_add_up(self, notify):
+        task = Task.objects.create(title='task', assignedTo=self.employees[0], createdBy=self.employer,
+                                   companyId=self.company)
+        reconcile_task_summaries()
+        task.assignedTo = self.employees[1]
+        task.status = 'completed'
+        task.save()
+        self.assertEqual(self.summaries(), self.expected())
+
+    def test_deleting_an_assignee_does_not_recreate_summaries(self, notify):
+        for index in range(2):
+            Task.objects.create(title=f'task {index}', assignedTo=self.employees[0], createdBy=self.employer,
+                                companyId=self.company)
+        reconcile_task_summaries()
+        # the summary row can go in the cascade before the tasks, leaving only negative deltas
+        self.employees[0].delete()
+        self.assertFalse(TaskSummary.objects.filter(assignedTo_id=self.employees[0].id).exists())
+        self.assertEqual(self.summaries(), self.expected())
+
+
+@mock.patch('tasksaathi.signals.notify_task_change')
+class TaskSummaryViewTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER',
+            is_superuser=True,
+        )
+        cls.first = Users.objects.create_user(email='first@test.com', password='test', firstName='F', lastName='E')
+        cls.second = Users.objects.create_user(email='second@test.com', password='test', firstName='S', lastName='E')
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+
+    def create_task(self, assignee, **values):
+        return Task.objects.create(title='task', assignedTo=assignee, createdBy=self.employer, companyId=self.company,
+                                   **values)
+
+    def summary(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/tasks/summary/', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_summary_shape(self, notify):
+        self.create_task(self.first, priority='high', dueDate=timezone.localdate() - timedelta(days=1))
+        self.create_task(self.first, status='completed', priority='low')
+        self.create_task(self.second, status='in_progress')
+        self.assertEqual(self.summary(self.employer), {
+            'total': 3,
+            'byStatus': {'pending': 1, 'in_progress': 1, 'completed': 1},
+            'byPriority': {'low': 1, 'medium': 1, 'high': 1},
+            'overdue': 1,
+        })
+        self.assertEqual(self.summary(self.first), {
+            'total': 2,
+            'byStatus': {'pending': 1, 'in_progress': 0, 'completed': 1},
+            'byPriority': {'low': 1, 'medium': 0, 'high': 1},
+            'overdue': 1,
+        })
+
+    def test_multiple_update_moves_counters(self, notify):
+        task = self.create_task(self.first)
+        self.client.force_authenticate(self.employer)
+        response = self.client.post(
+            '/api/tasks/multiple-update/',
+            [{'id': str(task.id), 'status': 'completed', 'assignedTo': str(self.second.id)}],
+            format='json', HTTP_HOST='localhost',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.summary(self.first)['total'], 0)
+        second = self.summary(self.second)
+        self.assertEqual((second['total'], second['byStatus']['completed'], second['byStatus']['pending']), (1, 1, 0))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'the reconcile lock is PostgreSQL only')
+@mock.patch('tasksaathi.signals.notify_task_change')
+class TaskSummaryReconcileLockTest(TransactionTestCase):
+
+    def test_deltas_committed_during_reconcile_are_kept(self, notify):
+        employer = Users.objects.create_user(email='employer@test.com', password='test', firstName='Emp',
+                                             lastName='Loyer', userRole='EMPLOYER')
+        company = Company.objects.create(name='Test', userId=employer)
+        Task.objects.create(title='first', assignedTo=employer, createdBy=employer, companyId=company)
+        done = threading.Event()
+
+        def reconcile():
+            try:
+                reconcile_task_summaries()
+            finally:
+                connection.close()
+                done.set()
+
+        with transaction.atomic():
+            # the signal's delta is applied, the task not committed yet
+            Task.objects.create(title='second', assignedTo=employer, createdBy=employer, companyId=company)
+            thread = threading.Thread(target=reconcile)
+            thread.start()
+            self.assertFalse(done.wait(1), 'reconcile did not wait for the open delta')
+        thread.join(10)
+        self.assertEqual(TaskSummary.objects.get(companyId=company, assignedTo=employer).total, 2)
+
+
+class RouteQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    urlconfs = ('tasksaathi.urls',)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create_user(
+            email='admin@test.com', password='test', firstName='Ad', lastName='Min', userRole='EMPLOYER',
+            is_staff=True, is_superuser=True,
+        )
+        cls.company = Company.objects.create(name='Test', userId=cls.admin)
+        cls.employees = [
+            Users.objects.create_user(email=f'employee{index}@test.com', password='test', firstName='Emp',
+                                      lastName=f'{index}')
+            for index in range(QUERY_BUDGET_ROWS)
+        ]
+        cls.others = [
+            Company.objects.create(name=f'Other {index}', userId=employee)
+            for index, employee in enumerate(cls.employees[1:])
+        ]
+        # half of them the employer's own, so my-tasks has rows too
+        cls.tasks = [
+            Task.objects.create(
+                title=f'task {index}', description='budget', companyId=cls.company, createdBy=cls.admin,
+                assignedTo=cls.admin if index % 2 else cls.employees[index],
+            )
+            for index in range(QUERY_BUDGET_ROWS)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        self.enterContext(mock.patch('tasksaathi.signals.notify_task_change'))
+        self.enterContext(mock.patch('atomicloops.tasks.export_data'))
+
+    def route_object(self, route):
+        return self.company if route.basename == 'company' else self.tasks[0]
+
+    def task_data(self, index=0):
+        return {
+            'title': f'new {index}', 'description': 'budget', 'companyId': str(self.company.id),
+            'createdBy': str(self.admin.id), 'assignedTo': str(self.employees[index].id),
+        }
+
+    def company_data(self, index=0):
+        return {'name': f'New {index}', 'userId': str(self.employees[index].id)}
+
+    def tsv(self, rows):
+        # import-data splits columns on a literal backslash t
+        lines = ['\\t'.join(row) for row in [list(rows[0]), *[list(row.values()) for row in rows]]]
+        return {'data': {'file': SimpleUploadedFile('import.tsv', '\n'.join(lines).encode())}, 'format': 'multipart'}
+
+    def route_request(self, route, instance):
+        build = self.task_data if route.basename == 'task' else self.company_data
+        objects = self.tasks if route.basename == 'task' else self.others
+        body = {
+            'create': build(),
+            'update': build(),
+            'partial_update': {'title' if route.basename == 'task' else 'name': 'renamed'},
+            'multiple_create': [build(index) for index in range(3)],
+            'multiple_update': [{'id': str(item.id), 'name' if route.basename == 'company' else 'title': 'renamed'}
+                                for item in objects[:3]],
+            'multiple_delete': [{'id': str(item.id)} for item in objects[:3]],
+            'update_status': {'status': 'completed'},
+            'bulk_status': {'ids': [str(task.id) for task in self.tasks], 'status': 'completed'},
+        }.get(route.action)
+        if route.action == 'import_data':
+            return self.tsv([build(index) for index in range(3)])
+        return {} if body is None else {'data': body, 'format': 'json'}
+
+    def test_every_route_within_budget(self):
+        self.assert_query_budgets()
+
+
+class ConditionalGetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+        cls.task = Task.objects.create(
+            title='task', assignedTo=cls.employer, createdBy=cls.employer, companyId=cls.company
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.employer)
+
+    def get(self, url, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, HTTP_HOST='localhost', **headers)
+
+    def test_list_not_modified(self):
+        response = self.get('/api/tasks/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('/api/tasks/', etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # company scope and the fingerprint aggregate, no page or count queries
+        self.assertLessEqual(len(queries), 2)
+        self.assertNotIn('JOIN', queries[-1]['sql'])
+
+        Task.objects.create(title='new', assignedTo=self.employer, createdBy=self.employer, companyId=self.company)
+        self.assertEqual(self.get('/api/tasks/', etag).status_code, 200)
+        self.assertNotEqual(self.get('/api/tasks/?search=task', etag).status_code, 304)
+
+    def test_list_changed_by_multiple_update(self):
+        self.employer.is_superuser = True
+        self.employer.save()
+        etag = self.get('/api/tasks/')['ETag']
+        response = self.client.post('/api/tasks/multiple-update/', [{'id': str(self.task.id), 'title': 'bulk'}],
+                                    format='json', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        response = self.get('/api/tasks/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['title'], 'bulk')
+
+    def test_retrieve_not_modified(self):
+        url = f'/api/tasks/{self.task.id}/'
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, etag).status_code, 304)
+        self.task.title = 'changed'
+        self.task.save()
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+    def test_my_company_tracks_owner_changes(self):
+        url = '/api/companies/my-company/'
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, etag).status_code, 304)
+        self.employer.lastName = 'Changed'
+        self.employer.save()
+        self.assertEqual(self.get(url, etag).status_code, 200)
+
+
+class DeltaSyncTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.first = Users.objects.create_user(email='first@test.com', password='test', firstName='F', lastName='E')
+        cls.second = Users.objects.create_user(email='second@test.com', password='test', firstName='S', lastName='E')
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+
+    def create_task(self, title, assignee):
+        return Task.objects.create(title=title, assignedTo=assignee, createdBy=self.employer, companyId=self.company)
+
+    def sync(self, user, cursor):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/tasks/', {'updatedSince': cursor}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_initial_then_delta(self):
+        kept = self.create_task('kept', self.first)
+        changed = self.create_task('changed', self.first)
+        gone = self.create_task('gone', self.first)
+        initial = self.sync(self.first, '0')
+        self.assertEqual(len(initial['results']), 3)
+        self.assertFalse(initial['hasMore'])
+
+        # Push the cursor past the overlap window of the first sync
+        Task.objects.update(updatedAt=F('updatedAt') - timedelta(minutes=1))
+        TaskTombstone.objects.all().delete()
+        cursor = self.sync(self.first, '0')['cursor']
+
+        changed.title = 'changed again'
+        changed.save()
+        moved = self.create_task('moved', self.first)
+        moved.assignedTo = self.second
+        moved.save()
+        gone_id = gone.id
+        gone.delete()
+
+        delta = self.sync(self.first, cursor)
+        self.assertEqual([row['id'] for row in delta['results']], [str(changed.id)])
+        self.assertEqual(set(delta['deleted']), {moved.id, gone_id})
+        self.assertNotIn(kept.id, delta['deleted'])
+
+        # The employer still sees the reassigned task, only the deletion is a tombstone
+        employer = self.sync(self.employer, cursor)
+        self.assertEqual(set(employer['deleted']), {gone_id})
+        self.assertEqual({row['id'] for row in employer['results']}, {str(changed.id), str(moved.id)})
+
+    def test_bulk_updated_rows_are_in_the_delta(self):
+        task = self.create_task('bulk', self.first)
+        # Push the cursor past the overlap window of the first sync
+        Task.objects.update(updatedAt=F('updatedAt') - timedelta(minutes=1))
+        cursor = self.sync(self.first, '0')['cursor']
+
+        self.employer.is_superuser = True
+        self.employer.save()
+        self.client.force_authenticate(self.employer)
+        response = self.client.post('/api/tasks/multiple-update/', [{'id': str(task.id), 'title': 'bulk updated'}],
+                                    format='json', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        delta = self.sync(self.first, cursor)
+        self.assertEqual([row['title'] for row in delta['results']], ['bulk updated'])
+
+    def test_bulk_reassigned_rows_are_tombstoned(self):
+        task = self.create_task('bulk', self.first)
+        Task.objects.update(updatedAt=F('updatedAt') - timedelta(minutes=1))
+        cursor = self.sync(self.first, '0')['cursor']
+
+        self.employer.is_superuser = True
+        self.employer.save()
+        self.client.force_authenticate(self.employer)
+        response = self.client.post('/api/tasks/multiple-update/', [{'id': str(task.id), 'assignedTo': str(self.second.id)}],
+                                    format='json', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        delta = self.sync(self.first, cursor)
+        self.assertEqual((delta['results'], delta['deleted']), ([], [task.id]))
+        self.assertEqual([row['id'] for row in self.sync(self.second, cursor)['results']], [str(task.id)])
+
+    def test_pages_share_timestamps(self):
+        for index in range(7):
+            self.create_task(f'task {index}', self.first)
+        Task.objects.update(updatedAt=timezone.now() - timedelta(minutes=1))
+        seen, cursor, has_more = [], '0', True
+        with mock.patch('tasksaathi.views.SYNC_PAGE_SIZE', 3):
+            while has_more:
+                data = self.sync(self.first, cursor)
+                seen += [row['id'] for row in data['results']]
+                cursor, has_more = data['cursor'], data['hasMore']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_invalid_and_expired_cursor(self):
+        self.client.force_authenticate(self.first)
+        response = self.client.get('/api/tasks/', {'updatedSince': 'nope'}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 400)
+        expired = encode_cursor(timezone.now() - timedelta(days=365))
+        response = self.client.get('/api/tasks/', {'updatedSince': expired}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 410)
+
+
+
+@override_settings(TASK_EVENTS_BROKER='tasksaathi.events.InMemoryBroker')
+class TaskEventsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.first = Users.objects.create_user(email='first@test.com', password='test', firstName='F', lastName='E')
+        cls.second = Users.objects.create_user(email='second@test.com', password='test', firstName='S', lastName='E')
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+
+    def setUp(self):
+        reset_broker()
+        self.addCleanup(reset_broker)
+
+    def values(self, assignee, status='pending'):
+        return {
+            'status': status, 'priority': 'medium', 'dueDate': None,
+            'companyId_id': self.company.id, 'assignedTo_id': assignee.id,
+        }
+
+    async def next_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), timeout=2)
+        return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+    async def test_reassignment_routes_to_old_and_new_assignee(self):
+        broker = get_broker()
+        company = Subscription(broker, [company_channel(self.company.id)])
+        first = Subscription(broker, [user_channel(self.first.id)])
+        second = Subscription(broker, [user_channel(self.second.id)])
+        async with company, first, second:
+            publish_task_changes([(uuid.uuid4(), self.values(self.first), self.values(self.second, 'completed'))])
+            self.assertEqual((await asyncio.wait_for(company.get(), 1))['event'], 'task.updated')
+            self.assertEqual((await asyncio.wait_for(first.get(), 1))['event'], 'task.removed')
+            message = await asyncio.wait_for(second.get(), 1)
+            self.assertEqual((message['event'], message['status']), ('task.updated', 'completed'))
+        self.assertEqual(broker.connection_count(), 0)
+
+    async def test_slow_subscriber_gets_resync(self):
+        async with Subscription(get_broker(), [user_channel(self.first.id)]) as subscription:
+            publish_task_changes([(uuid.uuid4(), None, self.values(self.first))] * (SUBSCRIPTION_QUEUE_SIZE + 10))
+            await asyncio.sleep(0)
+            events = [(await subscription.get())['event'] for _ in range(subscription.queue.qsize())]
+        self.assertEqual(events[-1], 'resync')
+        self.assertEqual(len(events), SUBSCRIPTION_QUEUE_SIZE)
+
+    async def get_ticket(self, user):
+        response = await self.async_client.post('/api/tasks/events/ticket/', HTTP_HOST='localhost',
+                                                 headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']['ticket']
+
+    async def test_stream_requires_token(self):
+        response = await self.async_client.get('/api/tasks/events/', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/tasks/events/', {'ticket': 'nope'}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_jwt_stays_out_of_the_url(self):
+        token = str(AccessToken.for_user(self.employer))
+        response = await self.async_client.get('/api/tasks/events/', {'token': token}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post('/api/tasks/events/ticket/', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_ticket_opens_one_stream(self):
+        ticket = await self.get_ticket(self.employer)
+        response = await self.async_client.get('/api/tasks/events/', {'ticket': ticket}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        await aiter(response.streaming_content).aclose()
+        response = await self.async_client.get('/api/tasks/events/', {'ticket': ticket}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_delivers_company_events(self):
+        ticket = await self.get_ticket(self.employer)
+        response = await self.async_client.get('/api/tasks/events/', {'ticket': ticket}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await self.next_event(stream)).startswith('retry:'))
+
+        task = await sync_to_async(Task.objects.create)(
+            title='task', assignedTo=self.first, createdBy=self.employer, companyId=self.company
+        )
+        waiting = asyncio.ensure_future(self.next_event(stream))
+        await asyncio.sleep(0.05)
+        publish_task_changes([(task.id, None, self.values(self.first))])
+        event = await waiting
+        self.assertIn('event: task.updated', event)
+        self.assertIn(str(task.id), event)
+        await stream.aclose()
+
+    async def test_asgi_app_streams_outside_django(self):
+        async def django_app(scope, receive, send):
+            raise AssertionError('the events path must not reach Django')
+
+        ticket = await self.get_ticket(self.employer)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/tasks/events/', 'root_path': '',
+            'query_string': f'ticket={ticket}'.encode(), 'headers': [(b'origin', b'http://localhost:3000')],
+        }
+        disconnect, sent = asyncio.Event(), []
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def wait_for_messages(count):
+            while len(sent) < count:
+                await asyncio.sleep(0.01)
+
+        # test data only exists in this thread's transaction
+        events_app = TaskEventsApp(django_app)
+        events_app.thread_sensitive = True
+        app = asyncio.ensure_future(events_app(scope, receive, send))
+        await asyncio.wait_for(wait_for_messages(2), 2)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'access-control-allow-origin', b'http://localhost:3000'), sent[0]['headers'])
+        publish_task_changes([(uuid.uuid4(), None, self.values(self.first))])
+        await asyncio.wait_for(wait_for_messages(3), 2)
+        self.assertIn(b'event: task.updated', sent[2]['body'])
+        disconnect.set()
+        await asyncio.wait_for(app, 1)
+        self.assertEqual(get_broker().connection_count(), 0)
+
+
+@override_settings(TASK_EVENTS_BROKER='tasksaathi.events.InMemoryBroker')
+class EventsLoadTestCommandTest(TransactionTestCase):
+
+    def setUp(self):
+        import socket
+        import uvicorn
+        from django.core.asgi import get_asgi_application
+        reset_broker()
+        self.addCleanup(reset_broker)
+        employer = Users.objects.create_user(email='employer@test.com', password='test', firstName='Emp',
+                                             lastName='Loyer', userRole='EMPLOYER')
+        Company.objects.create(name='Test', userId=employer)
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        # the command publishes through this process' broker, so the server runs in a thread of it
+        self.server = uvicorn.Server(uvicorn.Config(TaskEventsApp(get_asgi_application()), host='127.0.0.1',
+                                                    port=self.port, log_level='warning', lifespan='off'))
+        thread = threading.Thread(target=self.server.run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(setattr, self.server, 'should_exit', True)
+        while not self.server.started:
+            thread.join(0.05)
+
+    def test_streams_open_and_receive(self):
+        out = io.StringIO()
+        call_command('events-loadtest', url=f'http://127.0.0.1:{self.port}/api/tasks/events/',
+                     email='employer@test.com', connections=5, concurrency=5, hold=0.2, publish=True, stdout=out)
+        self.assertIn('Opened 5/5 streams', out.getvalue())
+        self.assertIn('Fan out to 5/5 streams', out.getvalue())
+
+
+@override_settings(PUSH_BACKEND='utils.push.FakePushClient')
+class TaskNotificationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.employee = Users.objects.create_user(email='first@test.com', password='test', firstName='F', lastName='E')
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+
+    def setUp(self):
+        reset_push_client()
+        self.addCleanup(reset_push_client)
+
+    def add_devices(self, user, language, tokens):
+        UsersDevices.objects.bulk_create([
+            UsersDevices(userId=user, deviceId=token, token=token, deviceType='android', language=language)
+            for token in tokens
+        ])
+
+    def test_signals_queue_assignment_and_status(self):
+        with mock.patch('tasksaathi.tasks.send_task_notifications.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                task = Task.objects.create(
+                    title='task', assignedTo=self.employee, createdBy=self.employer, companyId=self.company
+                )
+            with self.captureOnCommitCallbacks(execute=True):
+                task.description = 'no notification'
+                task.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                task.status = 'completed'
+                task.save()
+        self.assertEqual(
+            [call.args for call in delay.call_args_list],
+            [(ASSIGNED, [str(task.id)]), (STATUS, [str(task.id)])],
+        )
+
+    def test_fan_out_batches_per_language_and_prunes(self):
+        self.add_devices(self.employee, 'en', [f'en-{index}' for index in range(MULTICAST_LIMIT + 20)])
+        self.add_devices(self.employee, 'fr', ['fr-1', 'invalid-fr'])
+        self.add_devices(self.employer, 'de', ['de-1', 'invalid-de'])
+        task = Task.objects.create(
+            title='Report', assignedTo=self.employee, createdBy=self.employer, companyId=self.company, status='completed'
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            send_task_notifications(STATUS, [str(task.id)])
+        # task, devices, prune (select + delete of the devices)
+        self.assertLessEqual(len(queries), 5)
+
+        sent = get_push_client().sent
+        self.assertTrue(all(len(batch['tokens']) <= MULTICAST_LIMIT for batch in sent))
+        by_title = {}
+        for batch in sent:
+            by_title.setdefault(batch['body'], set()).update(batch['tokens'])
+        # the German device falls back to the default language
+        self.assertEqual(len(by_title['Report is now completed']), MULTICAST_LIMIT + 22)
+        self.assertEqual(by_title['Report : terminée'], {'fr-1', 'invalid-fr'})
+        self.assertFalse(UsersDevices.objects.filter(token__startswith='invalid').exists())
+        self.assertEqual(UsersDevices.objects.count(), MULTICAST_LIMIT + 22)
+
+    def test_failed_batch_does_not_stop_the_fan_out(self):
+        self.add_devices(self.employee, 'en', ['en-1', 'invalid-en'])
+        self.add_devices(self.employee, 'fr', ['fr-1'])
+        client = get_push_client()
+        send_multicast = client.send_multicast
+
+        def flaky(tokens, title, body, data=None):
+            if 'fr-1' in tokens:
+                raise ConnectionError('FCM unreachable')
+            return send_multicast(tokens, title, body, data)
+
+        with mock.patch.object(client, 'send_multicast', side_effect=flaky), self.assertLogs('users.notifications', 'ERROR'):
+            stats = send_notifications([([self.employee.id], {'en': ('Report', 'done'), 'fr': ('Rapport', 'terminé')}, {})])
+        self.assertEqual(stats, {SENT: 1, INVALID_TOKEN: 1, FAILED: 1, 'batches': 2})
+        self.assertFalse(UsersDevices.objects.filter(token='invalid-en').exists())
+
+
+@mock.patch('tasksaathi.signals.notify_task_change')
+class AdminChangelistTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create_superuser(email='admin@test.com', password='test', firstName='Ad', lastName='Min')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            employer = Users.objects.create_user(email=f'{uuid.uuid4().hex}@test.com', password='test',
+                                                 firstName='Emp', lastName='Loyer', userRole='EMPLOYER')
+            company = Company.objects.create(name='Company', userId=employer)
+            Task.objects.create(title='Task', assignedTo=employer, createdBy=employer, companyId=company)
+            UsersDevices.objects.create(userId=employer, deviceId=uuid.uuid4().hex, token='token', deviceType='web')
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_grow_with_rows(self, notify):
+        urls = ['/admin/tasksaathi/task/', '/admin/tasksaathi/company/', '/admin/tasksaathi/tasksummary/',
+                '/admin/users/usersdevices/']
+        self.add_rows(2)
+        before = {url: self.changelist_queries(url) for url in urls}
+        self.add_rows(QUERY_BUDGET_ROWS)
+        self.assertEqual({url: self.changelist_queries(url) for url in urls}, before)
+
+    def test_foreign_keys_are_not_selects_of_every_row(self, notify):
+        self.add_rows(2)
+        task = Task.objects.first()
+
+        def options():
+            response = self.client.get(f'/admin/tasksaathi/task/{task.pk}/change/')
+            self.assertEqual(response.status_code, 200)
+            return response.content.decode().count('<option value=')
+
+        before = options()
+        self.add_rows(QUERY_BUDGET_ROWS)
+        # the autocomplete widgets only render the selected user and company
+        self.assertEqual(options(), before)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=0)
+    def test_estimated_count(self, notify):
+        from atomicloops.admin import EstimatedCountPaginator
+
+        self.add_rows(5)
+        paginator = EstimatedCountPaginator(Task.objects.order_by('pk'), 2)
+        filtered = EstimatedCountPaginator(Task.objects.filter(status='pending').order_by('pk'), 2)
+        if connection.vendor != 'postgresql':
+            self.assertEqual((paginator.count, filtered.count), (5, 5))
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE task')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 5)
+        self.assertNotIn('COUNT', queries[0]['sql'].upper())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertGreater(filtered.count, 0)
+        self.assertIn('EXPLAIN', queries[0]['sql'])
+
+
+@mock.patch('tasksaathi.signals.notify_task_change')
+class PrincipalScopeTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.employee = Users.objects.create_user(
+            email='employee@test.com', password='test', firstName='Emp', lastName='Loyee'
+        )
+        cls.other = Users.objects.create_user(
+            email='other@test.com', password='test', firstName='Oth', lastName='Er', userRole='EMPLOYER'
+        )
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+        cls.other_company = Company.objects.create(name='Other', userId=cls.other)
+
+    def create_task(self, company, assignee):
+        return Task.objects.create(title='Task', assignedTo=assignee, createdBy=company.userId, companyId=company)
+
+    def test_object_permissions_compare_ids(self, notify):
+        own = [self.create_task(self.company, self.employee) for _ in range(QUERY_BUDGET_ROWS)]
+        foreign = self.create_task(self.other_company, self.other)
+        tasks = list(Task.objects.filter(pk__in=[task.pk for task in own + [foreign]]))
+        devices = [UsersDevices(userId_id=self.employer.pk), UsersDevices(userId_id=self.other.pk)]
+        factory = APIRequestFactory()
+        request = factory.patch('/')
+        force_authenticate(request, self.employer)
+        request = APIView().initialize_request(request)
+
+        # the company id is read once for the request, the rows' foreign keys are never loaded
+        with self.assertNumQueries(1):
+            allowed = [IsCompanyUser().has_object_permission(request, None, task) for task in tasks]
+            owned = [IsOwnerOrAdminOrReadOnly().has_object_permission(request, None, device) for device in devices]
+        self.assertEqual(allowed.count(True), QUERY_BUDGET_ROWS)
+        self.assertEqual(owned, [True, False])
+
+    def test_lists_are_scoped_in_sql(self, notify):
+        own = self.create_task(self.company, self.employee)
+        self.create_task(self.other_company, self.other)
+
+        self.client.force_authenticate(self.employee)
+        response = self.client.get('/api/tasks/', HTTP_HOST='localhost')
+        self.assertEqual([task['id'] for task in response.data['results']], [str(own.id)])
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(f'/api/tasks/{own.id}/', HTTP_HOST='localhost').status_code, 404)
+
+    def test_writes_reach_only_own_rows(self, notify):
+        self.client.force_authenticate(self.other)
+        response = self.client.patch(
+            f'/api/companies/{self.company.id}/', {'name': 'Taken'}, format='json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.patch(
+            f'/api/companies/{self.other_company.id}/', {'name': 'Renamed'}, format='json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 200)
+        # reads stay open to every signed in user
+        self.assertEqual(self.client.get(f'/api/companies/{self.company.id}/', HTTP_HOST='localhost').status_code, 200)
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.name, 'Test')
+
+
+@mock.patch('tasksaathi.signals.notify_task_change')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(APITestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        # the same rows on both databases, only the task title tells where a read went
+        for alias in ('default', 'replica'):
+            self.employer = Users.objects.db_manager(alias).create_user(
+                id=EMPLOYER_ID, email='employer@test.com', password='test', firstName='Emp', lastName='Loyer',
+                userRole='EMPLOYER'
+            )
+            self.company = Company.objects.using(alias).create(id=COMPANY_ID, name='Test', userId=self.employer)
+        self.task = Task.objects.create(
+            title='primary', assignedTo=self.employer, createdBy=self.employer, companyId=self.company
+        )
+        Task.objects.using('replica').create(
+            id=self.task.id, title='replica', assignedTo_id=EMPLOYER_ID, createdBy_id=EMPLOYER_ID, companyId_id=COMPANY_ID
+        )
+        self.client.force_authenticate(self.employer)
+
+    def get_title(self):
+        return self.client.get(f'/api/tasks/{self.task.id}/', HTTP_HOST='localhost').data['title']
+
+    def test_safe_reads_go_to_the_replica(self, notify):
+        self.assertEqual(self.get_title(), 'replica')
+
+    def test_writes_pin_the_user_to_the_primary(self, notify):
+        response = self.client.patch(
+            f'/api/tasks/{self.task.id}/', {'status': 'in_progress'}, format='json', HTTP_HOST='localhost'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(is_pinned(self.employer.pk))
+        # the user reads their own write
+        self.assertEqual(self.get_title(), 'primary')
+        cache.clear()
+        self.assertEqual(self.get_title(), 'replica')
+
+    def test_objects_read_from_the_replica_are_saved_on_the_primary(self, notify):
+        with replica_reads():
+            task = Task.objects.get(pk=self.task.pk)
+            task.status = 'completed'
+            task.save()
+        self.assertEqual(task.title, 'replica')
+        self.assertEqual(Task.objects.get(pk=self.task.pk).status, 'completed')
+        self.assertEqual(Task.objects.using('replica').get(pk=self.task.pk).status, 'pending')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'declarative partitioning needs PostgreSQL')
+class TaskPartitioningTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employer = Users.objects.create_user(
+            email='employer@test.com', password='test', firstName='Emp', lastName='Loyer', userRole='EMPLOYER'
+        )
+        cls.other = Users.objects.create_user(
+            email='other@test.com', password='test', firstName='Oth', lastName='Er', userRole='EMPLOYER'
+        )
+        cls.company = Company.objects.create(name='Test', userId=cls.employer)
+        cls.other_company = Company.objects.create(name='Other', userId=cls.other)
+
+    def create_task(self, company):
+        return Task.objects.create(title='Task', assignedTo=company.userId, createdBy=company.userId, companyId=company)
+
+    def partition_tasks(self, *args):
+        call_command('partition-tasks', *args, stdout=io.StringIO())
+
+    def test_online_migration(self):
+        tasks = [self.create_task(self.company) for _ in range(5)] + [self.create_task(self.other_company)]
+        self.partition_tasks('prepare', '--partitions', '4')
+
+        # written while the rows are copied, the trigger mirrors them
+        created = self.create_task(self.company)
+        moved = tasks[0]
+        moved.companyId = self.other_company
+        moved.save()
+        tasks[1].delete()
+        self.partition_tasks('backfill', '--batch-size', '2')
+        self.partition_tasks('swap')
+
+        with connection.cursor() as cursor:
+            self.assertEqual(get_stage(cursor, 'task'), 'partitioned')
+            cursor.execute("SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conname = 'task_pkey'")
+            self.assertEqual(cursor.fetchone()[0], 'PRIMARY KEY (id, "companyId_id")')
+        self.assertEqual(Task.objects.count(), 6)
+        self.assertEqual(Task.objects.get(pk=moved.pk).companyId_id, self.other_company.pk)
+
+        self.client.force_authenticate(self.employer)
+        ids = {str(task.pk) for task in tasks[2:5]} | {str(created.pk)}
+        response = self.client.get('/api/tasks/', HTTP_HOST='localhost')
+        self.assertEqual({task['id'] for task in response.data['results']}, ids)
+        response = self.client.post(
+            '/api/tasks/bulk-status/', {'ids': list(ids) + [str(moved.pk)], 'status': 'completed'},
+            format='json', HTTP_HOST='localhost'
+        )
+        self.assertEqual({str(pk) for pk in response.data['ids']}, ids)
+
+        self.partition_tasks('drop-old')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('task_unpartitioned')")
+            self.assertIsNone(cursor.fetchone()[0])
+
+    def test_swap_refuses_an_incomplete_copy(self):
+        self.create_task(self.company)
+        self.partition_tasks('prepare', '--partitions', '2')
+        with self.assertRaises(CommandError):
+            self.partition_tasks('swap')
+        self.partition_tasks('abort')
+        with connection.cursor() as cursor:
+            self.assertEqual(get_stage(cursor, 'task'), 'unpartitioned')
@@ -1,11 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CompanyViewSet, TaskViewSet
+from .streams import task_events, task_events_ticket
 
 router = DefaultRouter()
 router.register(r'companies', CompanyViewSet)
 router.register(r'tasks', TaskViewSet)
 
 urlpatterns = [
+    # before the router so it isn't taken for a task id
+    path('tasks/events/', task_events, name='task-events'),
+    path('tasks/events/ticket/', task_events_ticket, name='task-events-ticket'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
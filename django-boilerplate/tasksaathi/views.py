@@ -1,74 +1,206 @@
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from atomicloops.viewsets import AtomicViewSet
-from .models import Company, Task
+from atomicloops.permissions import get_principal
+from atomicloops.querybudget import QueryBudget
+from atomicloops.viewsets import AtomicViewSet, StreamingExportMixin
+from .models import Company, Task, TaskSummary, TaskTombstone
 from .serializers import CompanySerializer, TaskSerializer
 from .filters import CompanyFilter, TaskFilter
-from django.db.models import Q
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
+from django.utils import timezone
+from .events import publish_task_changes
+from .notifications import STATUS
+from .signals import apply_summary_changes, notify_task_change
+from .sync import InvalidCursor, changed_since, decode_cursor, is_expired, next_cursor
+import uuid
+
+BULK_STATUS_LIMIT = 1000
+SYNC_PAGE_SIZE = 500
 
 
 class CompanyViewSet(AtomicViewSet):
-    queryset = Company.objects.all()
+    queryset = Company.objects.select_related('userId')
     serializer_class = CompanySerializer
     filterset_class = CompanyFilter
     permission_classes = [IsAuthenticated]
+    # anyone signed in reads companies, only the owner (or a superuser) changes one
+    owner_field = 'userId'
     search_fields = ["name"]
     ordering_fields = ("createdAt", "updatedAt", "name")
-    
+    etag_fields = ("updatedAt", "userId__updatedAt")
+    replica_actions = ('list', 'retrieve', 'export', 'my_company')
+    query_budgets = {
+        'my_company': QueryBudget(1),
+        # deleting a company deletes its tasks one by one for the summary and tombstone signals
+        'destroy': QueryBudget(45, time=200),
+    }
+
     @action(detail=False, methods=["get"], url_path='my-company')
     def my_company(self, request):
         """Get the company associated with the current user"""
-        company = self.queryset.filter(userId=request.user).first()
+        company = self.queryset.filter(userId_id=request.user.pk).first()
         if company:
+            etag = self.get_instance_etag(company)
+            response = self.not_modified(etag)
+            if response is not None:
+                return response
             serializer = self.get_serializer(company)
-            return Response(serializer.data)
+            return self.with_etag(Response(serializer.data), etag)
         return Response({"message": "No company found for this user"}, status=status.HTTP_404_NOT_FOUND)
 
 
-class TaskViewSet(AtomicViewSet):
-    queryset = Task.objects.all()
+class TaskViewSet(StreamingExportMixin, AtomicViewSet):
+    # the serializer renders assignee, creator and company names
+    queryset = Task.objects.select_related('assignedTo', 'createdBy', 'companyId')
     serializer_class = TaskSerializer
     filterset_class = TaskFilter
     permission_classes = [IsAuthenticated]
     search_fields = ["title", "description"]
     ordering_fields = ("createdAt", "updatedAt", "title", "dueDate", "status", "priority")
-    
-    def get_queryset(self):
+    # the task's own updatedAt only, joining users and companies into the aggregate costs every
+    # list request more than a renamed assignee or company showing late until a task changes
+    etag_fields = ("updatedAt",)
+    replica_actions = ('list', 'retrieve', 'export', 'my_tasks', 'company_tasks', 'summary')
+    query_budgets = {
+        # company scope, count, page and the ETag aggregate
+        'list': QueryBudget(4),
+        'retrieve': QueryBudget(2),
+        # three foreign keys to validate, the insert and the summary counter
+        'create': QueryBudget(5),
+        'update': QueryBudget(6),
+        'partial_update': QueryBudget(3),
+        'destroy': QueryBudget(5),
+        'multiple_create': QueryBudget(21),
+        'multiple_update': QueryBudget(17),
+        'multiple_delete': QueryBudget(15),
+        'import_data': QueryBudget(21),
+        'my_tasks': QueryBudget(1),
+        'company_tasks': QueryBudget(2),
+        'summary': QueryBudget(2),
+        # company scope, the row count and the cursor
+        'export': QueryBudget(3),
+        'update_status': QueryBudget(4),
+        # one counter UPDATE per assignee of the moved tasks
+        'bulk_status': QueryBudget(18),
+    }
+
+    def scope_queryset(self, queryset, principal):
         """Filter tasks based on user role"""
-        user = self.request.user
-        
         # If user is an employer, show all tasks in their company
-        if user.userRole == "EMPLOYER":
-            company = Company.objects.filter(userId=user).first()
-            if company:
-                return self.queryset.filter(companyId=company)
-        
+        if principal.role == "EMPLOYER":
+            if principal.companyId:
+                return queryset.filter(companyId_id=principal.companyId)
+
         # If user is an employee, show only tasks assigned to them
-        elif user.userRole == "EMPLOYEE":
-            return self.queryset.filter(assignedTo=user)
-            
-        return self.queryset.none()
-    
+        elif principal.role == "EMPLOYEE":
+            return queryset.filter(assignedTo_id=principal.userId)
+
+        return queryset.none()
+
+    def update_item(self, queryset, item):
+        values = {name: value for name, value in item.items() if name != 'id'}
+        # multiple-delete checks its ids through here too, with nothing to write
+        if not values:
+            return
+        # saved one by one, the task signals keep summaries, tombstones and events in step
+        task = queryset.get(id=item['id'])
+        for name, value in values.items():
+            field = Task._meta.get_field(name)
+            setattr(task, field.attname, field.to_python(value))
+        task.save()
+
+    def get_tombstones(self):
+        """Tombstones of tasks that left the current user's view"""
+        principal = get_principal(self.request)
+        if principal.role == "EMPLOYER":
+            if principal.companyId:
+                # a reassignment inside the company doesn't hide the task from its employer
+                return TaskTombstone.objects.filter(companyId=principal.companyId).exclude(reason='reassigned')
+        elif principal.role == "EMPLOYEE":
+            return TaskTombstone.objects.filter(assignedTo=principal.userId)
+        return TaskTombstone.objects.none()
+
+    def use_replica(self, request):
+        # a lagging replica could hide changes from the sync cursor for good
+        return super().use_replica(request) and 'updatedSince' not in request.query_params
+
+    def list(self, request, *args, **kwargs):
+        if 'updatedSince' in request.query_params:
+            return self.delta_sync(request)
+        return super().list(request, *args, **kwargs)
+
+    def delta_sync(self, request):
+        """
+        Tasks changed after the cursor, ids of tasks deleted or moved out of view and the next cursor.
+        Start with updatedSince=0, drop `deleted` before applying `results`, and keep
+        following `cursor` while `hasMore` is true.
+        """
+        try:
+            moment, last_id = decode_cursor(request.query_params['updatedSince'])
+        except InvalidCursor:
+            return Response({"message": "Invalid updatedSince cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        if is_expired(moment):
+            return Response(
+                {"message": "Cursor expired, sync again with updatedSince=0"}, status=status.HTTP_410_GONE
+            )
+
+        started_at = timezone.now()
+        page = list(changed_since(self.get_queryset(), moment, last_id)[:SYNC_PAGE_SIZE])
+        deleted = []
+        if moment is not None:
+            deleted = self.get_tombstones().filter(createdAt__gte=moment).values_list('taskId', flat=True).distinct()
+        cursor, has_more = next_cursor(page, SYNC_PAGE_SIZE, started_at)
+        serializer = self.get_serializer(page, many=True)
+        return Response({
+            "results": serializer.data,
+            "deleted": list(deleted),
+            "cursor": cursor,
+            "hasMore": has_more,
+        })
+
     @action(detail=False, methods=["get"], url_path='my-tasks')
     def my_tasks(self, request):
         """Get tasks assigned to the current user"""
-        tasks = self.queryset.filter(assignedTo=request.user)
+        tasks = self.queryset.filter(assignedTo_id=request.user.pk)
         serializer = self.get_serializer(tasks, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=["get"], url_path='company-tasks')
     def company_tasks(self, request):
         """Get all tasks for the user's company"""
-        company = Company.objects.filter(userId=request.user).first()
-        if not company:
+        company_id = get_principal(request).companyId
+        if not company_id:
             return Response({"message": "No company found for this user"}, status=status.HTTP_404_NOT_FOUND)
             
-        tasks = self.queryset.filter(companyId=company)
+        tasks = self.queryset.filter(companyId_id=company_id)
         serializer = self.get_serializer(tasks, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=["get"], url_path='summary')
+    def summary(self, request):
+        """Task counts by status, priority and overdue for the dashboards"""
+        principal = get_principal(request)
+        if principal.role == "EMPLOYER":
+            if not principal.companyId:
+                return Response({"message": "No company found for this user"}, status=status.HTTP_404_NOT_FOUND)
+            summaries = TaskSummary.objects.filter(companyId_id=principal.companyId)
+        elif principal.role == "EMPLOYEE":
+            summaries = TaskSummary.objects.filter(assignedTo_id=principal.userId)
+        else:
+            summaries = TaskSummary.objects.none()
+
+        totals = summaries.aggregate(**{field: Coalesce(Sum(field), 0) for field in TaskSummary.COUNTER_FIELDS})
+        return Response({
+            "total": totals["total"],
+            "byStatus": {value: totals[field] for value, field in TaskSummary.STATUS_COUNTERS.items()},
+            "byPriority": {value: totals[field] for value, field in TaskSummary.PRIORITY_COUNTERS.items()},
+            "overdue": totals["overdue"],
+        })
+
     @action(detail=True, methods=["patch"], url_path='update-status')
     def update_status(self, request, pk=None):
         """Update the status of a task"""
@@ -79,7 +211,37 @@ class TaskViewSet(AtomicViewSet):
             return Response({"message": "Invalid status value"}, status=status.HTTP_400_BAD_REQUEST)
             
         task.status = status_value
-        task.save()
+        task.save(update_fields=['status', 'updatedAt'])
         
         serializer = self.get_serializer(task)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    @action(detail=False, methods=["post"], url_path='bulk-status')
+    def bulk_status(self, request):
+        """Move many tasks to one status, returns the ids that actually changed"""
+        ids = request.data.get('ids')
+        status_value = request.data.get('status')
+
+        if not status_value or status_value not in dict(Task.STATUS_CHOICES):
+            return Response({"message": "Invalid status value"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(ids, list) or ids == []:
+            return Response({"message": "ids must be a non empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > BULK_STATUS_LIMIT:
+            return Response(
+                {"message": f"Number of ids must not be greater than {BULK_STATUS_LIMIT}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = [uuid.UUID(str(value)) for value in ids]
+        except ValueError:
+            return Response({"message": "Invalid id in ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # get_queryset scopes the UPDATE to the user's company or assigned tasks
+        with transaction.atomic():
+            rows = self.get_queryset().filter(id__in=ids).transition_status(status_value)
+            changes = [(row['id'], row, {**row, 'status': status_value}) for row in rows]
+            apply_summary_changes((old, new) for _, old, new in changes)
+            transaction.on_commit(lambda: publish_task_changes(changes))
+            if rows:
+                transaction.on_commit(lambda: notify_task_change(STATUS, [row['id'] for row in rows]))
+        return Response({"ids": [row['id'] for row in rows], "status": status_value})
\ No newline at end of file
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 from django.contrib import admin
+from atomicloops.admin import AtomicModelAdmin
 
 from .models import Users, UsersDevices, ExportData
 
 
 @admin.register(Users)
-class UsersAdmin(admin.ModelAdmin):
+class UsersAdmin(AtomicModelAdmin):
     list_display = (
         'id',
         'createdAt',
@@ -28,11 +29,13 @@ class UsersAdmin(admin.ModelAdmin):
         'is_superuser',
         'isVerified'
     )
+    # also what the user autocomplete widgets of other admins search
+    search_fields = ('email', 'firstName', 'lastName')
     raw_id_fields = ('groups', 'user_permissions')
 
 
 @admin.register(UsersDevices)
-class UsersDevicesAdmin(admin.ModelAdmin):
+class UsersDevicesAdmin(AtomicModelAdmin):
     list_display = (
         'id',
         'createdAt',
@@ -42,15 +45,24 @@ class UsersDevicesAdmin(admin.ModelAdmin):
         'token',
         'deviceType',
     )
-    list_filter = ('createdAt', 'updatedAt', 'userId')
+    # no userId filter, its sidebar lists every user
+    list_filter = ('createdAt', 'updatedAt', 'deviceType')
+    list_select_related = ('userId',)
+    search_fields = ('userId__email', 'deviceId')
+    raw_id_fields = ('userId',)
 
 
 @admin.register(ExportData)
-class ExportDataAdmin(admin.ModelAdmin):
+class ExportDataAdmin(AtomicModelAdmin):
     list_display = (
         'id',
         'createdAt',
         'updatedAt',
         'userId',
+        'modelName',
+        'status',
         'fileUrl',
     )
+    list_filter = ('status',)
+    list_select_related = ('userId',)
+    raw_id_fields = ('userId',)
@@ -103,6 +103,23 @@ LANGUAGE_CHOICES = (
 )
 
 
+class UsersDevicesQuerySet(models.QuerySet):
+
+    def register(self, user, deviceId, token, deviceType, language, info=None):
+        """
+        Create the (user, deviceId) device or refresh its token, type, language and info,
+        in one INSERT ... ON CONFLICT DO UPDATE. Returns the stored device.
+        """
+        device = self.model(userId=user, deviceId=deviceId, token=token, deviceType=deviceType, language=language,
+                            info=info)
+        # an app that doesn't send info keeps the stored one
+        update_fields = ['token', 'deviceType', 'language', 'updatedAt', *(['info'] if info is not None else [])]
+        self.bulk_create([device], update_conflicts=True, unique_fields=['userId', 'deviceId'],
+                         update_fields=update_fields)
+        # on a conflict the instance keeps its unsaved id, read back the row the upsert kept
+        return self.get(userId=user, deviceId=deviceId)
+
+
 # user devices
 class UsersDevices(AtomicBaseModel):
     userId = models.ForeignKey(Users, verbose_name=_('User Id'), related_name="users_devices", db_column="user_id", on_delete=models.CASCADE,)
@@ -112,17 +129,34 @@ class UsersDevices(AtomicBaseModel):
     info = models.CharField(verbose_name=_('Info'), max_length=500, db_column='device_info', null=True)
     language = models.CharField(verbose_name=_('Language'), max_length=10, db_column='language')
 
+    objects = UsersDevicesQuerySet.as_manager()
+
     class Meta:
         db_table = "users_devices"
         verbose_name_plural = "users_device"
         managed = True
+        constraints = [
+            # one row per installed app, re-registering updates it (see UsersDevicesView.register)
+            models.UniqueConstraint(fields=['userId', 'deviceId'], name='users_devices_user_device'),
+        ]
+
+
+EXPORT_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
 
 
-# Export data table
+# Export data table, one row per export job (atomicloops.jobs), its id is the Celery task id
 class ExportData(AtomicBaseModel):
-    userId = models.ForeignKey(Users, verbose_name=_('User Id'), related_name="export_data", db_column="user_id", on_delete=models.CASCADE,)
+    userId = models.ForeignKey(Users, verbose_name=_('User Id'), related_name="export_data", db_column="user_id", on_delete=models.CASCADE, null=True, blank=True)
     modelName = models.CharField(verbose_name=_('Model Name'), max_length=500, db_column="model_name")
-    fileUrl = models.URLField(verbose_name=_('File Url'), max_length=512, db_column="file_url",)
+    fileUrl = models.URLField(verbose_name=_('File Url'), max_length=512, db_column="file_url", null=True, blank=True)
+    status = models.CharField(verbose_name=_('Status'), max_length=20, db_column="status", choices=EXPORT_STATUS_CHOICES, default='pending')
+    filters = models.JSONField(verbose_name=_('Filters'), db_column="filters", default=dict, blank=True)
+    error = models.TextField(verbose_name=_('Error'), db_column="error", null=True, blank=True)
 
     class Meta:
         db_table = "export_data"
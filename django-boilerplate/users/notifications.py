@@ -0,0 +1,76 @@
+# Push notification fan out to UsersDevices
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from utils.push import FAILED, INVALID_TOKEN, MULTICAST_LIMIT, SENT, get_push_client
+from .models import UsersDevices
+
+logger = logging.getLogger(__name__)
+
+
+def device_tokens(user_ids):
+    """{user_id: {language: {token, ...}}} for every registered device of user_ids, in one query."""
+    tokens = defaultdict(lambda: defaultdict(set))
+    rows = UsersDevices.objects.filter(userId__in=user_ids).values_list('userId_id', 'language', 'token')
+    for user_id, language, token in rows.iterator(chunk_size=2000):
+        if token:
+            tokens[user_id][language].add(token)
+    return tokens
+
+
+def build_batches(notifications, tokens):
+    """
+    Split every notification into multicast batches of at most MULTICAST_LIMIT tokens
+    sharing one language. `notifications` are (user_ids, {language: (title, body)}, data);
+    devices in a language without a translation get the default language.
+    """
+    batches = []
+    for user_ids, messages, data in notifications:
+        by_language = defaultdict(set)
+        for user_id in user_ids:
+            for language, user_tokens in tokens.get(user_id, {}).items():
+                if language not in messages:
+                    language = settings.PUSH_DEFAULT_LANGUAGE
+                by_language[language] |= user_tokens
+        for language, language_tokens in by_language.items():
+            title, body = messages[language]
+            language_tokens = sorted(language_tokens)
+            for start in range(0, len(language_tokens), MULTICAST_LIMIT):
+                batches.append((language_tokens[start:start + MULTICAST_LIMIT], title, body, data))
+    return batches
+
+
+def send_notifications(notifications):
+    """
+    Push every notification to its users' devices and delete the devices whose token
+    FCM reports as invalid, with one query to load the devices and one to prune them.
+    A batch whose send raises counts as failed for all its tokens.
+    Returns per result counts plus the number of multicast batches.
+    """
+    notifications = list(notifications)
+    user_ids = {user_id for users, _, _ in notifications for user_id in users}
+    batches = build_batches(notifications, device_tokens(user_ids))
+    client = get_push_client()
+    stats = Counter({SENT: 0, INVALID_TOKEN: 0, FAILED: 0})
+    invalid = set()
+
+    def send(batch):
+        tokens, title, body, data = batch
+        try:
+            return tokens, client.send_multicast(tokens, title, body, data)
+        except Exception:
+            # one failed batch must not drop the results, and the invalid tokens, of the others
+            logger.exception('Push multicast to %d tokens failed', len(tokens))
+            return tokens, [FAILED] * len(tokens)
+
+    # firebase-admin sends one multicast's tokens concurrently already, this overlaps batches too
+    with ThreadPoolExecutor(max_workers=settings.PUSH_MAX_WORKERS) as executor:
+        for tokens, results in executor.map(send, batches):
+            stats.update(results)
+            invalid.update(token for token, result in zip(tokens, results) if result == INVALID_TOKEN)
+
+    if invalid:
+        UsersDevices.objects.filter(token__in=invalid).delete()
+    stats['batches'] = len(batches)
+    return dict(stats)
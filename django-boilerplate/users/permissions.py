@@ -1,6 +1,5 @@
 from rest_framework import permissions
-# from django.conf import settings
-import sys
+from atomicloops.permissions import get_principal
 
 
 class UsersPermission(permissions.BasePermission):
@@ -17,22 +16,11 @@ class UsersPermission(permissions.BasePermission):
                 return True
             return False
 
-        print("I am here", flush=True)
         if request.method == "POST":
             return True
-        # Instance must have an attribute named email
-        try:
-            authorize = request.user.email == obj.email or request.user.is_superuser
-            if authorize:
-                return True
-            else:
-                False
-        except:
-            _ = sys.exc_info()[0]
-            # with open(settings.exception_error_file, "a") as f:
-            #     f.write(str(e) + "\n")
-            #     f.close()
-            return False
+        # obj is a user
+        principal = get_principal(request)
+        return principal.isSuperuser or principal.is_user(obj)
 
 
 class IsOwnerOrAdminOrReadOnly(permissions.BasePermission):
@@ -44,13 +32,6 @@ class IsOwnerOrAdminOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        # Instance must have an attribute named email
-        try:
-            authorize = request.user.email == obj.userId.email or request.user.is_superuser
-            if authorize:
-                return True
-            else:
-                False
-        except:
-            _ = sys.exc_info()[0]
-            return False
+        # Instance must have a userId foreign key, compared by id without loading the user
+        principal = get_principal(request)
+        return principal.isSuperuser or principal.owns(obj)
@@ -78,6 +78,20 @@ class UsersDevicesSerializer(AtomicSerializer):
         list_fields = fields
 
 
+class RegisterDeviceSerializer(serializers.ModelSerializer):
+    # the device always belongs to the caller, see UsersDevicesView.register
+    class Meta:
+        model = UsersDevices
+        fields = (
+            'deviceId',
+            'token',
+            'deviceType',
+            'language',
+            'info',
+        )
+        extra_kwargs = {'info': {'required': False}}
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     companyName = serializers.CharField(required=False, write_only=True, allow_blank=True)
     contactNumber = serializers.CharField(required=False, write_only=True, allow_blank=True)
@@ -186,7 +200,10 @@ class ExportDataSerializer(serializers.ModelSerializer):
             'updatedAt',
             'userId',
             'modelName',
-            'fileUrl'
+            'fileUrl',
+            'status',
+            'filters',
+            'error',
         )
 
 
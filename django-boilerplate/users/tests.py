@@ -1,3 +1,157 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
+from kombu.exceptions import OperationalError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from atomicloops.querybudget import QUERY_BUDGET_ROWS, QueryBudgetMixin
+from utils.email import send_email
+from utils.storage import reset_storage
+from .models import Users, UsersDevices
 
-# Create your tests here.
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RouteQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    urlconfs = ('users.urls',)
+    # users are only created through register
+    expected_status = {
+        ('users', 'create'): 405,
+        ('users', 'multiple_create'): 405,
+        ('users', 'import_data'): 400,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create_superuser(email='admin@test.com', password='test', firstName='Ad',
+                                                   lastName='Min')
+        cls.users = [
+            Users.objects.create_user(email=f'user{index}@test.com', password='test', firstName='U',
+                                      lastName=f'{index}')
+            for index in range(QUERY_BUDGET_ROWS)
+        ]
+        cls.devices = [
+            UsersDevices.objects.create(userId=user, deviceId=f'phone-{index}', token=f'token-{index}',
+                                        deviceType='android', language='en')
+            for index, user in enumerate(cls.users)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        self.enterContext(mock.patch('atomicloops.tasks.export_data'))
+
+    def route_object(self, route):
+        return self.devices[0] if route.basename == 'users-devices' else self.users[0]
+
+    def route_request(self, route, instance):
+        if route.basename == 'users-devices':
+            device = {'deviceId': 'tablet', 'token': 'token', 'deviceType': 'ipad', 'language': 'fr'}
+            body = {
+                'create': {**device, 'userId': str(self.admin.id)},
+                'update': {**device, 'userId': str(self.admin.id)},
+                'partial_update': {'token': 'refreshed'},
+                'register': device,
+            }.get(route.action)
+        else:
+            body = {
+                'update': {'firstName': 'New', 'lastName': 'Name'},
+                'partial_update': {'firstName': 'New'},
+                'multiple_update': [{'id': str(user.id), 'firstName': 'New'} for user in self.users[:3]],
+                'multiple_delete': [{'id': str(user.id)} for user in self.users[:3]],
+                'update_admin_user': [{'id': str(user.id), 'is_staff': True} for user in self.users[:3]],
+            }.get(route.action)
+        return {} if body is None else {'data': body, 'format': 'json'}
+
+    def test_every_route_within_budget(self):
+        self.assert_query_budgets()
+
+
+class RegisterDeviceTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create_user(email='device@test.com', password='test', firstName='D', lastName='U')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def register(self, **data):
+        payload = {'deviceId': 'phone-1', 'token': 'token-1', 'deviceType': 'android', 'language': 'en', **data}
+        return self.client.post('/users-devices/register/', payload, format='json', HTTP_HOST='localhost')
+
+    def test_register_is_idempotent(self):
+        first = self.register(info='Android 14')
+        self.assertEqual(first.status_code, 200)
+        device = UsersDevices.objects.get()
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.register(token='token-2', language='fr')
+        self.assertEqual(second.status_code, 200)
+        # the upsert and reading back what it kept
+        self.assertEqual(len([query for query in queries if 'users_devices' in query['sql']]), 2)
+
+        updated = UsersDevices.objects.get()
+        self.assertEqual(updated.id, device.id)
+        self.assertEqual((updated.token, updated.language, updated.info), ('token-2', 'fr', 'Android 14'))
+        self.assertEqual(updated.createdAt, device.createdAt)
+        self.assertEqual(second.json()['data']['id'], str(device.id))
+
+        self.register(deviceId='tablet-1')
+        self.assertEqual(UsersDevices.objects.filter(userId=self.user).count(), 2)
+
+    def test_register_validates(self):
+        response = self.register(deviceType='fridge')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UsersDevices.objects.exists())
+
+
+@override_settings(STORAGE_BACKEND='utils.storage.LocalStorage', LOCAL_STORAGE_URL='http://localhost/storage')
+class AsyncViewsTest(APITestCase):
+
+    def setUp(self):
+        storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_dir)
+        self.enterContext(override_settings(LOCAL_STORAGE_DIR=storage_dir))
+        reset_storage()
+        self.addCleanup(reset_storage)
+        self.email = self.enterContext(mock.patch('users.views.users.send_email'))
+
+    def post(self, path, data, **kwargs):
+        return self.client.post(path, data, HTTP_HOST='localhost', **kwargs)
+
+    def test_register(self):
+        data = {'email': 'new@test.com', 'password': 'Str0ng-pass!', 'firstName': 'N', 'lastName': 'U'}
+        self.assertEqual(self.post('/register/', data, format='json').status_code, 201)
+        self.assertEqual(self.email.call_args.kwargs['receiver'], 'new@test.com')
+
+        # an unverified account registers again in place, a verified one is refused
+        Users.objects.filter(email='new@test.com').update(isVerified=False)
+        self.assertEqual(self.post('/register/', data, format='json').status_code, 201)
+        self.assertEqual(Users.objects.filter(email='new@test.com').count(), 1)
+        self.assertEqual(self.post('/register/', data, format='json').status_code, 400)
+        self.assertEqual(self.post('/register/', {'email': 'bad'}, format='json').status_code, 400)
+
+    def test_register_survives_a_broker_outage(self):
+        self.email.side_effect = send_email
+        data = {'email': 'new@test.com', 'password': 'Str0ng-pass!', 'firstName': 'N', 'lastName': 'U'}
+        with mock.patch('atomicloops.tasks.send_email.delay', side_effect=OperationalError('down')) as delay, \
+                self.assertLogs('utils.email', 'ERROR'):
+            self.assertEqual(self.post('/register/', data, format='json').status_code, 201)
+        delay.assert_called_once()
+        self.assertTrue(Users.objects.filter(email='new@test.com').exists())
+
+    def test_upload_profile(self):
+        user = Users.objects.create_user(email='pic@test.com', password='test', firstName='P', lastName='U')
+        image = SimpleUploadedFile('me.jpg', b'\xff\xd8 image', content_type='image/jpeg')
+        self.assertEqual(self.post('/users/upload-profile/', {'file': image}).status_code, 401)
+
+        self.client.force_authenticate(user)
+        image.seek(0)
+        response = self.post('/users/upload-profile/', {'file': image})
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.profilePicture.startswith('http://localhost/storage/profiles/images/'))
+
+        self.assertEqual(self.post('/users/upload-profile/', {}).status_code, 400)
@@ -2,7 +2,12 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views.users import UsersView, UsersDevicesView, RegisterUserView
+from .views.users import (
+    UsersView,
+    UsersDevicesView,
+    RegisterUserView,
+    UploadProfileView,
+)
 from .views.update_password import UpdatePasswordView
 from .views.login import LoginView
 from .views.login import AdminLoginView
@@ -27,6 +32,7 @@ router.register('users-devices', UsersDevicesView, basename='users-devices')
 
 urlpatterns = [
     path('register/', RegisterUserView.as_view(), name='register-user'),
+    path('users/upload-profile/', UploadProfileView.as_view(), name='users-upload-profile'),
     path('login/', LoginView.as_view(), name='token-obtain-pair'),
     path('admin-login/', AdminLoginView.as_view(), name='token-obtain-pair-admin'),
     path('update-password/<uuid:pk>/', UpdatePasswordView.as_view(), name='auth_change_password'),
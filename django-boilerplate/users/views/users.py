@@ -1,6 +1,7 @@
 # Standard Imports
 
 # 3rd party libraries imports
+from asgiref.sync import sync_to_async
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.views import Response
 from rest_framework import status
@@ -16,13 +17,16 @@ from users.models import Users, UsersDevices
 from users.serializers import (
     UsersSerializer,
     UsersDevicesSerializer,
+    RegisterDeviceSerializer,
     RegisterSerializer,
     UploadProfilePictureSerializer,
     ResendOTPSerializer,
     VerifyAccountSerializer
 )
 from users.filters import UsersFilter, UsersDevicesFilter
-from atomicloops.viewsets import AtomicViewSet
+from atomicloops.querybudget import QueryBudget
+from atomicloops.viewsets import AtomicViewSet, PrincipalScopeMixin, ReplicaReadMixin, touch
+from atomicloops.views import AtomicAsyncAPIView
 from atomicloops.permissions import UsersPermission
 from users.serializers import UpdateAdminStatusSerializer
 from utils.aws_script import upload_image
@@ -37,6 +41,8 @@ class UsersView(AtomicViewSet):
     queryset = Users.objects.all()
     serializer_class = UsersSerializer
     permission_classes = [IsAuthenticated, UsersPermission]
+    # users change only their own row, unless superuser
+    owner_field = 'pk'
     filterset_class = UsersFilter
     search_fields = [
         'firstName',
@@ -51,6 +57,13 @@ class UsersView(AtomicViewSet):
     # This will be used as the default ordering
     ordering = ('-createdAt',)
 
+    query_budgets = {
+        'multiple_update': QueryBudget(8),
+        # cascades over every table pointing at users
+        'multiple_delete': QueryBudget(21),
+        'update_admin_user': QueryBudget(8),
+    }
+
     def create(self, request, *args, **kwargs):
         return Response("Method Not Allowed", status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
@@ -71,9 +84,10 @@ class UsersView(AtomicViewSet):
             if len(request.data) > 100:
                 raise ValidationError('Number of list elements must not be greater than 100')
             ids = self.validate_ids(request.data)
-            instances = Users.objects.filter(id__in=ids)
+            instances = list(Users.objects.filter(id__in=ids))
             fields = [f.name for f in Users._meta.concrete_fields]
             fields.remove('id')
+            touch(instances)
             _ = Users.objects.bulk_update(instances, fields)
             serializer = serializer_class(instances, many=True, partial=True, context={'request': self.request, 'view': self})
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -89,58 +103,31 @@ class UsersView(AtomicViewSet):
             t, _ = BlacklistedToken.objects.get_or_create(token=token)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['post'], url_path='upload-profile')
-    def upload_profile(self, request, *args, **kwargs):
-        image = request.FILES.get('file', None)
-        if not image:
-            return Response("Image not found", status=status.HTTP_400_BAD_REQUEST)
-        image_url = upload_image(image, folder="profiles")
-        data = {
-            'profilePicture': image_url
-        }
-        serialized_data = UploadProfilePictureSerializer(instance=request.user, data=data, partial=True)
-        if serialized_data.is_valid():
-            serialized_data.save()
-            return Response(serialized_data.data, status=status.HTTP_200_OK)
-        return Response(serialized_data.errors, status=status.HTTP_400_BAD_REQUEST)
-
 
 # Register Users
-class RegisterUserView(APIView):
+class RegisterUserView(AtomicAsyncAPIView):
     authentication_classes = ()
     permission_classes = (AllowAny, )
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         try:
             email = request.data.get('email', None)
-            user = Users.objects.get(email=email)
-            if user.isVerified:
-                return Response("User already register", status=status.HTTP_400_BAD_REQUEST)
-            else:
-                user.delete()
+            user = await Users.objects.filter(email=email).afirst()
+            if user is not None:
+                if user.isVerified:
+                    return Response("User already register", status=status.HTTP_400_BAD_REQUEST)
+                await user.adelete()
             userInput = request.data
             userInput['otp'] = str(random.randint(100000, 999999))
             userInput["signInMethod"] = "email"
             serializer = RegisterSerializer(data=userInput)
 
-            if serializer.is_valid():
-                serializer.save()  # user is saved in db
+            # validation queries the database and save hashes the password, keep both off the event loop
+            if await sync_to_async(serializer.is_valid)():
+                await sync_to_async(serializer.save)()  # user is saved in db
                 message = send_otp(str(userInput['otp']))
-                send_email(receiver=userInput['email'], subject="Verification otp", message=message)
-                return Response("ok", status.HTTP_201_CREATED)
-            return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
-
-        except Users.DoesNotExist:
-            # This is actually the normal case for new registrations
-            userInput = request.data
-            userInput['otp'] = str(random.randint(100000, 999999))
-            userInput["signInMethod"] = "email"
-            serializer = RegisterSerializer(data=userInput)
-
-            if serializer.is_valid():
-                serializer.save()  # user is saved in db
-                message = send_otp(str(userInput['otp']))
-                send_email(receiver=userInput['email'], subject="Verification otp", message=message)
+                # publishing to the broker blocks
+                await sync_to_async(send_email)(receiver=userInput['email'], subject="Verification otp", message=message)
                 return Response("ok", status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -148,20 +135,20 @@ class RegisterUserView(APIView):
             return Response("Internal Server Error", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ResendOTPView(APIView):
+class ResendOTPView(AtomicAsyncAPIView):
     authentication_classes = ()
     permission_classes = (AllowAny, )
 
-    def post(self, request):
+    async def post(self, request):
         try:
             userInput = request.data
             userInput['otp'] = str(random.randint(100000, 999999))
-            user = Users.objects.filter(email=userInput["email"]).first()
+            user = await Users.objects.filter(email=userInput["email"]).afirst()
             serializer = ResendOTPSerializer(data=userInput, instance=user)
-            if serializer.is_valid():
-                user = serializer.save()  # user is saved in db
+            if await sync_to_async(serializer.is_valid)():
+                await sync_to_async(serializer.save)()  # user is saved in db
                 message = send_otp(str(userInput['otp']))
-                send_email(receiver=userInput['email'], subject="Verification otp", message=message)
+                await sync_to_async(send_email)(receiver=userInput['email'], subject="Verification otp", message=message)
 
                 return Response("OK", status.HTTP_201_CREATED)
             return Response({"message": serializer.errors}, status.HTTP_400_BAD_REQUEST)
@@ -198,9 +185,10 @@ class VerifyAccountView(APIView):
 
 
 # users devices views
-class UsersDevicesView(ModelViewSet):
+class UsersDevicesView(ReplicaReadMixin, PrincipalScopeMixin, ModelViewSet):
     queryset = UsersDevices.objects.all()
     serializer_class = UsersDevicesSerializer
+    owner_field = 'userId'
     filterset_class = UsersDevicesFilter
     search_fields = [
         'userId__firstName',
@@ -215,18 +203,60 @@ class UsersDevicesView(ModelViewSet):
     # This will be used as the default ordering
     ordering = ('-createdAt',)
 
+    query_budgets = {
+        'list': QueryBudget(2),
+        'create': QueryBudget(3),
+        'retrieve': QueryBudget(1),
+        'update': QueryBudget(5),
+        'partial_update': QueryBudget(3),
+        'destroy': QueryBudget(3),
+        'register': QueryBudget(2),
+    }
+
+    @action(detail=False, methods=['post'], url_path='register', permission_classes=[IsAuthenticated])
+    def register(self, request, *args, **kwargs):
+        """
+        Register the caller's device on every app launch. Idempotent: a known deviceId
+        gets its token and language updated in place instead of a new row.
+        """
+        serializer = RegisterDeviceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        device = UsersDevices.objects.register(request.user, **serializer.validated_data)
+        return Response(self.get_serializer(device).data, status=status.HTTP_200_OK)
+
 
 # Upload Image API
-class UploadImageView(APIView):
+class UploadImageView(AtomicAsyncAPIView):
     serializer_class = UsersSerializer
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         file = request.FILES['file'] if 'file' in request.FILES else None
 
         if file is None:
             return Response({"message": "File Not Provided"}, status.HTTP_400_BAD_REQUEST)
 
-        url = upload_image(file, folder="profiles")
+        # the storage round trip doesn't touch the database, it can use any worker thread
+        url = await sync_to_async(upload_image, thread_sensitive=False)(file, folder="profiles")
         if url is None:
             return Response({"message": "File not Uploaded"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
         return Response({"message": "OK", "imageUrl": url}, status.HTTP_201_CREATED)
+
+
+# Upload the caller's profile picture, users/upload-profile/
+class UploadProfileView(AtomicAsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request, *args, **kwargs):
+        image = request.FILES.get('file', None)
+        if not image:
+            return Response("Image not found", status=status.HTTP_400_BAD_REQUEST)
+        image_url = await sync_to_async(upload_image, thread_sensitive=False)(image, folder="profiles")
+        data = {
+            'profilePicture': image_url
+        }
+        serialized_data = UploadProfilePictureSerializer(instance=request.user, data=data, partial=True)
+        if await sync_to_async(serialized_data.is_valid)():
+            await sync_to_async(serialized_data.save)()
+            return Response(serialized_data.data, status=status.HTTP_200_OK)
+        return Response(serialized_data.errors, status=status.HTTP_400_BAD_REQUEST)
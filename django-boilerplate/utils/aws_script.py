@@ -1,13 +1,17 @@
-from django.conf import settings
 import uuid
-import boto3
 import os
-from PIL import Image
-from pillow_heif import register_heif_opener
 import io
-register_heif_opener()
+from functools import lru_cache
+from utils.storage import get_storage
 
-s3 = boto3.client("s3", region_name=settings.REGION, aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+
+@lru_cache(maxsize=None)
+def get_image_module():
+    """PIL.Image with the HEIF opener registered, imported on the first image instead of with the urlconf."""
+    from PIL import Image
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    return Image
 
 
 def upload_image(file, folder=None):
@@ -18,12 +22,10 @@ def upload_image(file, folder=None):
     else:
         aws_path = os.path.join("images", f"{image_id}.jpg")
     try:
-        s3.upload_fileobj(
+        url = get_storage().upload_fileobj(
             file_bytes,
-            settings.S3_BUCKET,
             aws_path,
-            ExtraArgs={'ACL': 'public-read'})
-        url = f"{settings.AWS_URL}/{aws_path}"
+            extra_args={'ACL': 'public-read'})
         return url
     except Exception:
         return None
@@ -32,7 +34,7 @@ def upload_image(file, folder=None):
 def crop_and_upload_image(file, folder=None, width=512, height=512):
     image_id = str(uuid.uuid4())
     file_bytes = file.open()
-    image = Image.open(file_bytes)
+    image = get_image_module().open(file_bytes)
     format = image.format
     image = image.resize((width, height))
     in_mem_file = io.BytesIO()
@@ -43,10 +45,9 @@ def crop_and_upload_image(file, folder=None, width=512, height=512):
     else:
         aws_path = os.path.join("images", f"{image_id}.jpg")
     try:
-        s3.upload_fileobj(
-            in_mem_file, settings.S3_BUCKET, aws_path, ExtraArgs={"ACL": "public-read"}
+        url = get_storage().upload_fileobj(
+            in_mem_file, aws_path, extra_args={"ACL": "public-read"}
         )
-        url = f"{settings.AWS_URL}/{aws_path}"
         return url
     except Exception:
         return None
@@ -67,12 +68,10 @@ def upload_file(file, folder=None, file_format=None, extraArgsUser=None):
             extraArgsUser = dict(extraArgsUser)
             extraArgs.update(extraArgsUser)
 
-        s3.upload_fileobj(
+        url = get_storage().upload_fileobj(
             file_bytes,
-            settings.S3_BUCKET,
             aws_path,
-            ExtraArgs=extraArgs)
-        url = f"{settings.AWS_URL}/{aws_path}"
+            extra_args=extraArgs)
         return url
     except Exception:
         return None
@@ -83,7 +82,7 @@ def compress_image(file, folder=None, extraArgsUser=None):
         folder = 'extras'
     try:
         # open the file
-        image = Image.open(file)
+        image = get_image_module().open(file)
         # Create a BytesIO object to store the compressed image
         output = io.BytesIO()
         # Compress the image and save it to the BytesIO object
@@ -101,14 +100,11 @@ def compress_image(file, folder=None, extraArgsUser=None):
             extraArgsUser = dict(extraArgsUser)
             extraArgs.update(extraArgsUser)
         # Upload file
-        s3.upload_fileobj(
+        url = get_storage().upload_fileobj(
             output,
-            settings.S3_BUCKET,
             aws_path,
-            ExtraArgs=extraArgs
+            extra_args=extraArgs
         )
-        # Construct the URL for the uploaded image
-        url = f"{settings.AWS_URL}/{aws_path}"
         return url
     except Exception as e:
         print("Error While Uploading File:", e, flush=True)
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# FCM accepts at most 500 tokens per multicast message
+MULTICAST_LIMIT = 500
+
+# Per token results of send_multicast, anything else is a transient failure worth retrying later
+SENT = 'sent'
+INVALID_TOKEN = 'invalid-token'
+FAILED = 'failed'
+
+
+class BasePushClient:
+    """
+    Push notification client used by users.notifications. send_multicast sends one
+    message to up to MULTICAST_LIMIT tokens and returns one result per token.
+    """
+
+    def send_multicast(self, tokens, title, body, data=None):
+        raise NotImplementedError
+
+
+class FirebasePushClient(BasePushClient):
+    """
+    FCM through firebase-admin. The app is initialised on first use from the service
+    account file in FIREBASE_CREDENTIALS and shared by every thread of the process.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+
+    @property
+    def app(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    # firebase-admin pulls in the google cloud stack, keep it out of import time
+                    import firebase_admin
+                    from firebase_admin import credentials
+                    # one app per process, a forked child must not reuse its parent's transport
+                    self._app = firebase_admin.initialize_app(
+                        credentials.Certificate(settings.FIREBASE_CREDENTIALS), name=f'push-{os.getpid()}'
+                    )
+        return self._app
+
+    def send_multicast(self, tokens, title, body, data=None):
+        from firebase_admin import exceptions, messaging
+        message = messaging.MulticastMessage(
+            tokens=tokens,
+            notification=messaging.Notification(title=title, body=body),
+            data={key: str(value) for key, value in (data or {}).items()},
+        )
+        response = messaging.send_each_for_multicast(message, app=self.app)
+        invalid = (messaging.UnregisteredError, messaging.SenderIdMismatchError, exceptions.InvalidArgumentError)
+        results = []
+        for item in response.responses:
+            if item.success:
+                results.append(SENT)
+            elif isinstance(item.exception, invalid):
+                results.append(INVALID_TOKEN)
+            else:
+                results.append(FAILED)
+        return results
+
+
+class FakePushClient(BasePushClient):
+    """
+    Offline stand-in for tests and benchmarks. Records every multicast, treats tokens
+    starting with "invalid" as unregistered and can simulate FCM round trip latency
+    with PUSH_FAKE_LATENCY (seconds per multicast).
+    """
+
+    def __init__(self):
+        self.latency = getattr(settings, 'PUSH_FAKE_LATENCY', 0)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_multicast(self, tokens, title, body, data=None):
+        if len(tokens) > MULTICAST_LIMIT:
+            raise ValueError('A multicast message may contain at most %s tokens' % MULTICAST_LIMIT)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append({'tokens': list(tokens), 'title': title, 'body': body, 'data': data or {}})
+        return [INVALID_TOKEN if token.startswith('invalid') else SENT for token in tokens]
+
+
+_push_client = None
+_push_client_lock = threading.Lock()
+
+
+def get_push_client():
+    """Return the process wide push client configured by PUSH_BACKEND."""
+    global _push_client
+    if _push_client is None:
+        with _push_client_lock:
+            if _push_client is None:
+                backend = getattr(settings, 'PUSH_BACKEND', 'utils.push.FirebasePushClient')
+                _push_client = import_string(backend)()
+    return _push_client
+
+
+def reset_push_client():
+    global _push_client, _push_client_lock
+    _push_client = None
+    _push_client_lock = threading.Lock()
+
+
+# grpc/http clients are not fork safe, so prefork celery children build their own
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_push_client)
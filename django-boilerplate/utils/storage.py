@@ -0,0 +1,121 @@
+import os
+import shutil
+import threading
+import time
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseStorage:
+    """
+    Minimal file storage interface used by utils.aws_script, the export task
+    and the vault commands. Backends return the public url of the stored file.
+    """
+
+    def upload_fileobj(self, fileobj, path, extra_args=None):
+        raise NotImplementedError
+
+    def upload_file(self, filename, path, extra_args=None):
+        with open(filename, 'rb') as f:
+            return self.upload_fileobj(f, path, extra_args=extra_args)
+
+    def url(self, path):
+        raise NotImplementedError
+
+
+class S3Storage(BaseStorage):
+    """
+    S3 backend. The boto3 client is only built on first use and then shared by
+    every thread of the process, so web workers, celery tasks and commands that
+    never touch S3 don't pay for the boto3 import and client construction.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # boto3 is heavy, keep it out of import time
+                    import boto3
+                    from botocore.config import Config
+                    config = Config(
+                        max_pool_connections=getattr(settings, 'AWS_MAX_POOL_CONNECTIONS', 10),
+                        retries={'max_attempts': getattr(settings, 'AWS_MAX_ATTEMPTS', 3), 'mode': 'standard'},
+                    )
+                    self._client = boto3.client(
+                        "s3",
+                        region_name=settings.REGION,
+                        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                        config=config,
+                    )
+        return self._client
+
+    def upload_fileobj(self, fileobj, path, extra_args=None):
+        self.client.upload_fileobj(fileobj, settings.S3_BUCKET, path, ExtraArgs=extra_args or {})
+        return self.url(path)
+
+    def upload_file(self, filename, path, extra_args=None):
+        self.client.upload_file(filename, settings.S3_BUCKET, path, ExtraArgs=extra_args or {})
+        return self.url(path)
+
+    def url(self, path):
+        return f"{settings.AWS_URL}/{path}"
+
+
+class LocalStorage(BaseStorage):
+    """
+    Filesystem backend for tests and local development. Files are written
+    under LOCAL_STORAGE_DIR and served from LOCAL_STORAGE_URL. LOCAL_STORAGE_LATENCY
+    (seconds per upload) simulates the S3 round trip for benchmarks.
+    """
+
+    def __init__(self):
+        self.root = getattr(settings, 'LOCAL_STORAGE_DIR', os.path.join(settings.BASE_DIR, 'storage'))
+        self.base_url = getattr(settings, 'LOCAL_STORAGE_URL', 'http://localhost:8000/storage')
+        self.latency = getattr(settings, 'LOCAL_STORAGE_LATENCY', 0)
+
+    def upload_fileobj(self, fileobj, path, extra_args=None):
+        if self.latency:
+            time.sleep(self.latency)
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+        return self.url(path)
+
+    def url(self, path):
+        return f"{self.base_url}/{path}"
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """
+    Return the process wide storage backend configured by STORAGE_BACKEND.
+    The instance is created once and reused across requests and celery tasks.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = getattr(settings, 'STORAGE_BACKEND', 'utils.storage.S3Storage')
+                _storage = import_string(backend)()
+    return _storage
+
+
+def reset_storage():
+    global _storage, _storage_lock
+    _storage = None
+    _storage_lock = threading.Lock()
+
+
+# boto3 clients are not fork safe, so prefork celery/gunicorn children build their own
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_storage)
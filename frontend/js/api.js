@@ -155,6 +155,83 @@ async function deleteTask(taskId) {
     }
 }
 
+async function getTaskSummary() {
+    try {
+        const token = localStorage.getItem('token');
+        const response = await fetch(`${API_BASE_URL}/tasks/summary/`, {
+            method: 'GET',
+            headers: {
+                'Authorization': `Bearer ${token}`,
+                'Content-Type': 'application/json',
+            },
+        });
+        
+        const data = await response.json();
+        if (response.ok) {
+            return { success: true, data };
+        } else {
+            return { success: false, error: data.detail || 'Failed to fetch task summary' };
+        }
+    } catch (error) {
+        console.error('Get task summary error:', error);
+        return { success: false, error: 'Network error' };
+    }
+}
+
+// Tickets open the events stream once, so the JWT never goes in a URL
+async function getTaskEventsTicket() {
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${API_BASE_URL}/tasks/events/ticket/`, {
+        method: 'POST',
+        headers: {
+            'Authorization': `Bearer ${token}`,
+            'Content-Type': 'application/json',
+        },
+    });
+    const data = await response.json();
+    if (!response.ok) {
+        throw new Error(data.error?.message || data.detail || 'Failed to open task events');
+    }
+    return data.data.ticket;
+}
+
+// Push updates instead of polling, onEvent(type, data) gets task.updated, task.removed and resync.
+// Returns { close() }.
+function subscribeTaskEvents(onEvent, retryMs = 5000) {
+    let source = null;
+    let closed = false;
+
+    async function connect() {
+        let ticket;
+        try {
+            ticket = await getTaskEventsTicket();
+        } catch (error) {
+            console.error('Task events error:', error);
+            if (!closed) setTimeout(connect, retryMs);
+            return;
+        }
+        if (closed) return;
+        source = new EventSource(`${API_BASE_URL}/tasks/events/?ticket=${encodeURIComponent(ticket)}`);
+        ['task.updated', 'task.removed', 'resync'].forEach(type => {
+            source.addEventListener(type, event => onEvent(type, JSON.parse(event.data)));
+        });
+        source.onerror = error => {
+            console.error('Task events error:', error);
+            // EventSource would reconnect with the used ticket, reconnect with a new one instead
+            source.close();
+            if (!closed) setTimeout(connect, retryMs);
+        };
+    }
+
+    connect();
+    return {
+        close() {
+            closed = true;
+            if (source) source.close();
+        },
+    };
+}
+
 // Company management functions
 async function getCompanyDetails() {
     try {